@@ -32,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'topic_evolution_visualization.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,7 +46,7 @@ ROOT_URLCONF = 'topic_evolution.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'topic_evolution_visualization.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')]
         ,
         'APP_DIRS': True,
@@ -102,5 +103,67 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 LDA_MODEL_NAME_SYNTAX = r"^.+\.lda$"
 TOP_N_TOPIC_TERMS = 50
+# Terms shown for every topic of the home page
+HOME_TOP_N_TOPIC_TERMS = 10
+# Cached topic-term representations are versioned per model, so they never need to expire on their own
+TOPICS_TERMS_CACHE_TIMEOUT = None
+# Seconds each process keeps the main model before looking it up again; changes made by other processes, e.g.
+# ingestion workers, are noticed after at most this long
+MAIN_MODEL_CACHE_TIMEOUT = 60
+# Number of topic-term rows written per bulk insert while ingesting an LDA model
+INGESTION_CHUNK_SIZE = 5000
+# Maximum number of topic-term weights held in memory at once while extracting the top terms of the topics
+INGESTION_BLOCK_ELEMENTS = 2 ** 24
+# Background ingestion: worker processes of run_ingestion_jobs, seconds between polls of the job table and seconds
+# without a heartbeat after which a running job is considered crashed and gets resumed
+INGESTION_WORKERS = 2
+INGESTION_POLL_INTERVAL = 5
+INGESTION_JOB_STALE_SECONDS = 600
+# Number of gensim models kept loaded by each process, and whether the main model, its indexes and cached topics are
+# loaded when the WSGI application is created. With a server that loads the application before forking its workers,
+# e.g. gunicorn --preload, the workers share them copy-on-write
+GENSIM_MODEL_CACHE_SIZE = 2
+GENSIM_MODEL_WARM_UP = False
+# Custom text inference: topics returned per document, documents inferred per gensim call and preprocessing processes
+INFERENCE_TOP_K = 5
+INFERENCE_BATCH_SIZE = 256
+INFERENCE_WORKERS = 2
+# Custom text inference requests: maximum number of documents and of body bytes accepted
+INFERENCE_MAX_DOCUMENTS = 10000
+INFERENCE_MAX_BYTES = 50 * 2 ** 20
+# Corpus scoring: topics stored per article, articles read and inferred per batch, worker processes and batches
+# queued per worker
+SCORING_TOP_K = 5
+SCORING_BATCH_SIZE = 1000
+SCORING_WORKERS = 4
+SCORING_QUEUED_BATCHES = 2
+# Seconds after which a scoring job still marked as running without a heartbeat is considered crashed and resumed
+SCORING_JOB_STALE_SECONDS = 600
+# Similarity indexes: maximum number of topic-term weights held in memory at once while building the topic index and
+# number of similar topics or articles returned by default
+SIMILARITY_BLOCK_ELEMENTS = 2 ** 24
+SIMILARITY_TOP_K = 10
+# Topic comparisons: worker processes and maximum number of values computed at once by a worker, which also bounds
+# the temporaries of Jensen-Shannon
+COMPARISON_WORKERS = 2
+COMPARISON_BLOCK_ELEMENTS = 2 ** 24
+# Number of topic evolution graphs kept by each process
+EVOLUTION_GRAPH_CACHE_SIZE = 8
+# Read API: default and maximum number of topics per page
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+# Text search configuration of the article search vectors and number of articles whose vectors are computed per
+# transaction after a corpus is loaded
+ARTICLE_SEARCH_CONFIG = "english"
+ARTICLE_SEARCH_VECTOR_BATCH_SIZE = 10000
+# Fraction of the requests whose queries, spans and duration are recorded and whether sampled responses carry them in a
+# Server-Timing header
+INSTRUMENTATION_SAMPLE_RATE = 0.1
+INSTRUMENTATION_SERVER_TIMING = True
+# Whether the Prometheus metrics of the sampled requests are served, and the addresses allowed to read them. Behind a
+# reverse proxy on the same host every request comes from a local address, so only enable the metrics when the path is
+# not proxied and scrapers reach the application server directly
+INSTRUMENTATION_METRICS_ENABLED = False
+INSTRUMENTATION_METRICS_ALLOWED_IPS = ("127.0.0.1", "::1")
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
@@ -14,3 +14,19 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'topic_evolution.settings')
 
 application = get_wsgi_application()
+
+from topic_evolution import settings  # noqa: E402
+
+if settings.GENSIM_MODEL_WARM_UP:
+    import gc
+
+    from django.db import connections
+
+    from topic_evolution_visualization import model_registry
+
+    model_registry.warm_up()
+    # Forked workers must not share the database connections of this process. Objects allocated so far are moved out
+    # of the garbage collector's reach, so that collections in the workers do not write to, and thereby copy, their
+    # shared pages
+    connections.close_all()
+    gc.freeze()
@@ -0,0 +1 @@
+default_app_config = 'topic_evolution_visualization.apps.TopicEvolutionVisualizationConfig'
@@ -1,45 +1,73 @@
-import os
-
 from django.contrib import admin
-from django.db import transaction
-from gensim import models
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path
 
-from topic_evolution import settings
-from .models import LdaModel, Topic, Term, TopicTermDistribution
+from . import jobs
+from .models import LdaModel, IngestionJob, ScoringJob
 
 
 @admin.register(LdaModel)
 class LdaModelAdmin(admin.ModelAdmin):
+    list_display = ("name", "description", "is_main", "is_ingested")
+    actions = ("reingest",)
+
+    def reingest(self, request, queryset):
+        # Only the rows that differ from the model files are written, so re-ingesting an unchanged model is cheap
+        queued = [jobs.enqueue_ingestion(lda_model_obj) for lda_model_obj in queryset]
+        self.message_user(request, "Re-ingestion of {} model(s) has been queued as job(s) {}.".format(
+            len(queued), ", ".join(str(job.pk) for job in queued)))
+
+    reingest.short_description = "Re-ingest selected models"
 
     def save_related(self, request, form, formsets, change):
-        path = os.path.abspath(request.POST["path"])
-        lda_model = models.LdaModel.load(path)
-        dictionary = lda_model.id2word
-
-        lda_model_obj = LdaModel.objects.get(name=request.POST["name"])
-        with transaction.atomic():
-            topics = list()
-            topicterm_distribution_matrix = list()
-            for i in range(lda_model.num_topics):
-                topics.append(Topic(index=i, parent_model=lda_model_obj, keyphrase=""))
-                topicterm_distribution_matrix.append(lda_model.get_topic_terms(i, topn=settings.TOP_N_TOPIC_TERMS))
-
-            Topic.objects.bulk_create(topics)
-
-            with transaction.atomic():
-                terms = dict()
-                topicterm_distributions = list()
-                for topic_index in range(len(topicterm_distribution_matrix)):
-                    topicterms_distribution = topicterm_distribution_matrix[topic_index]
-                    for rank in range(len(topicterms_distribution)):
-                        term_id = int(topicterms_distribution[rank][0])
-                        term_weight = float(topicterms_distribution[rank][1])
-                        term_string = dictionary[term_id]
-                        if term_id not in terms:
-                            terms[term_id] = Term.objects.get_or_create(string=term_string)
-                        topicterm_distributions.append(
-                            TopicTermDistribution(topic=topics[topic_index], term=terms[term_id][0],
-                                                  value=round(term_weight, 5),
-                                                  rank=rank + 1))
-                # Term.objects.bulk_create([new_term[0] for new_term in filter(lambda v: v[1] == 1, terms.values())])
-                TopicTermDistribution.objects.bulk_create(topicterm_distributions)
+        super().save_related(request, form, formsets, change)
+        lda_model_obj = form.instance
+        if change and "path" not in form.changed_data:
+            return
+        # When the model file is replaced, its topics are re-ingested in place: only the terms that changed are
+        # written and the model stays available meanwhile
+        job = jobs.enqueue_ingestion(lda_model_obj)
+        if change:
+            self.message_user(request, "Re-ingestion of the model's topics has been queued as job {}.".format(job.pk))
+        else:
+            self.message_user(request, "Ingestion of the model's topics has been queued as job {}. The model will be "
+                                       "available once the job is done.".format(job.pk))
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ("lda_model", "status", "ingested_topics", "total_topics", "created", "heartbeat")
+    list_filter = ("status",)
+    readonly_fields = ("lda_model", "status", "ingested_topics", "total_topics", "error", "created", "heartbeat")
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path("<int:job_id>/progress/", self.admin_site.admin_view(self.progress_view),
+                 name="topic_evolution_visualization_ingestionjob_progress")
+        ] + super().get_urls()
+
+    def progress_view(self, request, job_id):
+        job = get_object_or_404(IngestionJob, pk=job_id)
+        return JsonResponse({
+            "status": job.get_status_display(),
+            "ingested_topics": job.ingested_topics,
+            "total_topics": job.total_topics,
+            "progress": job.progress,
+            "heartbeat": job.heartbeat,
+            "error": job.error or None
+        })
+
+
+@admin.register(ScoringJob)
+class ScoringJobAdmin(admin.ModelAdmin):
+    list_display = ("corpus", "lda_model", "status", "scored_articles", "total_articles", "created", "heartbeat")
+    list_filter = ("status",)
+    readonly_fields = ("lda_model", "corpus", "status", "top_k", "scored_articles", "total_articles", "last_article",
+                       "error", "created", "heartbeat")
+
+    def has_add_permission(self, request):
+        return False
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TopicEvolutionVisualizationConfig(AppConfig):
     name = 'topic_evolution_visualization'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,125 @@
+import logging
+import time
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Exists, ExpressionWrapper, F, FloatField, OuterRef, Subquery
+
+from topic_evolution import settings
+from . import prevalence
+from .bulk import copy_into
+from .models import Article, ArticleTopicDistribution, LdaModel
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = "article_import"
+# Fields of an article record, as loaded from a corpus file
+ARTICLE_FIELDS = ("identifier", "title", "abstract", "year", "authors", "language")
+
+
+def article_search_vector():
+    # Title matches outrank abstract matches
+    return SearchVector("title", weight="A", config=settings.ARTICLE_SEARCH_CONFIG) + \
+        SearchVector("abstract", weight="B", config=settings.ARTICLE_SEARCH_CONFIG)
+
+
+def load_articles(corpus, records):
+    # Inserts the article records of a corpus, or updates the articles they already exist as. Records are streamed into
+    # a staging table and merged in a single statement; articles whose title or abstract changed lose their search
+    # vector until the next batch update. The prevalence of the topics of scored articles whose year changed is moved
+    # to their new year in the same transaction
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS "{}"'.format(STAGING_TABLE))
+        cursor.execute('CREATE TEMPORARY TABLE "{}" (identifier varchar(100), title varchar(500), abstract text, '
+                       'year integer, authors text, language varchar(20))'.format(STAGING_TABLE))
+    staged = copy_into(STAGING_TABLE, ARTICLE_FIELDS,
+                       ((record["identifier"], record.get("title", ""), record["abstract"], record.get("year"),
+                         record.get("authors", ""), record.get("language", "")) for record in records))
+
+    columns = ", ".join(ARTICLE_FIELDS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The previous years are read from the snapshot the statement started with
+        cursor.execute(
+            'WITH previous AS ('
+            'SELECT id, year FROM "{articles}" WHERE identifier IN (SELECT identifier FROM "{staging}")'
+            '), upserted AS ('
+            'INSERT INTO "{articles}" ({columns}, corpus_id) '
+            'SELECT DISTINCT ON (identifier) {columns}, %s FROM "{staging}" ORDER BY identifier '
+            'ON CONFLICT (identifier) DO UPDATE SET '
+            'title = EXCLUDED.title, abstract = EXCLUDED.abstract, year = EXCLUDED.year, '
+            'authors = EXCLUDED.authors, language = EXCLUDED.language, corpus_id = EXCLUDED.corpus_id, '
+            'search_vector = CASE WHEN ("{articles}".title, "{articles}".abstract) = '
+            '(EXCLUDED.title, EXCLUDED.abstract) THEN "{articles}".search_vector END '
+            'WHERE ("{articles}".title, "{articles}".abstract, "{articles}".year, "{articles}".authors, '
+            '"{articles}".language, "{articles}".corpus_id) IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.abstract, '
+            'EXCLUDED.year, EXCLUDED.authors, EXCLUDED.language, EXCLUDED.corpus_id) '
+            'RETURNING id, year'
+            '), moved AS ('
+            'SELECT upserted.id, previous.year AS previous_year, upserted.year FROM upserted '
+            'JOIN previous ON previous.id = upserted.id WHERE previous.year IS DISTINCT FROM upserted.year '
+            'AND EXISTS (SELECT 1 FROM "{distributions}" WHERE article_id = upserted.id)'
+            ') SELECT (SELECT count(*) FROM upserted), '
+            '(SELECT coalesce(array_agg(ARRAY[id, previous_year, year]), ARRAY[]::integer[]) FROM moved)'.format(
+                articles=Article._meta.db_table, staging=STAGING_TABLE, columns=columns,
+                distributions=ArticleTopicDistribution._meta.db_table), [corpus.pk])
+        written, moved = cursor.fetchone()
+        move_prevalence(moved)
+        cursor.execute('DROP TABLE IF EXISTS "{}"'.format(STAGING_TABLE))
+    elapsed = time.perf_counter() - started
+    logger.info("Loaded %d articles into corpus %s in %.2fs: %d written, %d scored articles changed year", staged,
+                corpus.name, elapsed, written, len(moved))
+    return {"articles": staged, "written": written, "moved": len(moved), "seconds": elapsed}
+
+
+def move_prevalence(moved):
+    # Moves the topics of the given (article primary key, previous year, year) scored articles from their previous
+    # year to their new one, in the prevalence of every model that scored them
+    years = {article_pk: (previous_year, year) for article_pk, previous_year, year in moved}
+    deltas = dict()
+    rows = ArticleTopicDistribution.objects.filter(article__in=list(years)) \
+        .values_list("topic__parent_model", "article", "topic__index", "value").iterator(chunk_size=50000)
+    for lda_model_pk, article_pk, topic_index, value in rows:
+        previous_year, year = years[article_pk]
+        model_deltas = deltas.setdefault(lda_model_pk, prevalence.distribution_deltas(()))
+        prevalence.distribution_deltas([(topic_index, previous_year, value)], sign=-1, deltas=model_deltas)
+        prevalence.distribution_deltas([(topic_index, year, value)], deltas=model_deltas)
+    for lda_model_obj in LdaModel.objects.filter(pk__in=list(deltas)):
+        prevalence.apply_deltas(lda_model_obj, deltas[lda_model_obj.pk])
+
+
+def update_search_vectors(batch_size=None):
+    # Computes the missing search vectors a batch of articles at a time, each batch in its own transaction, so that
+    # loading a large corpus never holds locks on all of its rows at once
+    batch_size = batch_size or settings.ARTICLE_SEARCH_VECTOR_BATCH_SIZE
+    updated = 0
+    while True:
+        with transaction.atomic():
+            batch = list(Article.objects.filter(search_vector__isnull=True).order_by("pk")
+                         .values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                return updated
+            updated += Article.objects.filter(pk__in=batch).update(search_vector=article_search_vector())
+
+
+def search_articles(text, topics=None, min_weight=None, corpus=None, limit=None):
+    # Articles matching a web search style query, best first. Given topics, only articles assigned one of them with a
+    # weight above min_weight match, and their text rank is scaled by the weight of their heaviest such topic
+    query = SearchQuery(text, config=settings.ARTICLE_SEARCH_CONFIG, search_type="websearch")
+    articles = Article.objects.filter(search_vector=query)
+    if corpus is not None:
+        articles = articles.filter(corpus=corpus)
+    score = SearchRank(F("search_vector"), query)
+    if topics is not None:
+        distributions = ArticleTopicDistribution.objects.filter(article=OuterRef("pk"), topic__in=topics)
+        if min_weight is not None:
+            distributions = distributions.filter(value__gt=min_weight)
+        articles = articles.filter(Exists(distributions)).annotate(
+            topic_weight=Subquery(distributions.order_by("-value").values("value")[:1]))
+        score = ExpressionWrapper(score * F("topic_weight"), output_field=FloatField())
+    articles = articles.annotate(
+        score=score,
+        headline=SearchHeadline("abstract", query, config=settings.ARTICLE_SEARCH_CONFIG, max_fragments=2)
+    ).order_by("-score", "pk")
+    fields = ["identifier", "title", "year", "score", "headline"] + (["topic_weight"] if topics is not None else [])
+    return list(articles.values(*fields)[:limit or settings.API_PAGE_SIZE])
@@ -0,0 +1,43 @@
+import csv
+import io
+import itertools
+
+from django.db import connection
+
+NULL = "\\N"
+
+
+def copy_into(table, columns, rows, chunk_size=50000):
+    # Streams an iterable of row tuples into a PostgreSQL table through COPY, holding at most chunk_size rows in memory
+    # Nulls are spelled out, so that empty strings are not read as nulls
+    rows = (tuple(NULL if value is None else value for value in row) for row in rows)
+    statement = 'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv, NULL \'{}\')'.format(
+        table, ", ".join('"{}"'.format(column) for column in columns), NULL)
+    copied = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return copied
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(statement, buffer)
+        copied += len(chunk)
+
+
+def copy_rows(model, fields, rows, chunk_size=50000):
+    # Bulk-loads an iterable of row tuples, holding at most chunk_size rows in memory. PostgreSQL gets them through
+    # COPY; other databases fall back to bulk_create
+    if connection.vendor == "postgresql":
+        return copy_into(model._meta.db_table, [model._meta.get_field(field).column for field in fields], rows,
+                         chunk_size=chunk_size)
+    rows = iter(rows)
+    attributes = [model._meta.get_field(field).attname for field in fields]
+    copied = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return copied
+        model.objects.bulk_create([model(**dict(zip(attributes, row))) for row in chunk])
+        copied += len(chunk)
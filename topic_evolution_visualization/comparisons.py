@@ -0,0 +1,136 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.db import transaction
+
+from topic_evolution import settings
+from . import model_registry
+from .bulk import copy_rows
+from .ingestion import top_topic_terms
+from .metrics import METRICS, compare_block, init_worker, map_worker_matrices, pruning_mask
+from .models import Comparison, Topic, TopicsComparison
+
+logger = logging.getLogger(__name__)
+
+
+def shared_vocabulary_matrices(lda_model_0, lda_model_1):
+    # The topic-term distributions of both models restricted to the terms both vocabularies share, in the same column
+    # order, along with the probability mass and the squared norm of every topic outside of them
+    topics_0, topics_1 = lda_model_0.get_topics(), lda_model_1.get_topics()
+    token2id_1 = lda_model_1.id2word.token2id
+    columns_0, columns_1 = list(), list()
+    for token, term_id in lda_model_0.id2word.token2id.items():
+        other_term_id = token2id_1.get(token)
+        if other_term_id is not None:
+            columns_0.append(term_id)
+            columns_1.append(other_term_id)
+    matrices = dict()
+    for suffix, topics, columns in (("0", topics_0, columns_0), ("1", topics_1, columns_1)):
+        shared = np.ascontiguousarray(topics[:, columns], dtype=np.float64)
+        matrices["shared_" + suffix] = shared
+        matrices["outside_mass_" + suffix] = topics.sum(axis=1, dtype=np.float64) - shared.sum(axis=1)
+        matrices["outside_squares_" + suffix] = (topics.astype(np.float64) ** 2).sum(axis=1) - (shared ** 2).sum(axis=1)
+    return matrices
+
+
+def top_terms_incidence(lda_model_0, lda_model_1, topn):
+    # Binary topic x term matrices of the top-n terms of every topic, over the union of both models' top terms
+    top_terms = list()
+    for lda_model in (lda_model_0, lda_model_1):
+        term_ids, _ = top_topic_terms(lda_model, topn, 0, lda_model.num_topics)
+        top_terms.append([[lda_model.id2word[term_id] for term_id in row] for row in term_ids.tolist()])
+    columns = {term: column for column, term in enumerate({term for rows in top_terms for row in rows for term in row})}
+    matrices = dict()
+    for suffix, rows in zip(("0", "1"), top_terms):
+        incidence = np.zeros((len(rows), len(columns)), dtype=np.float64)
+        for topic_index, row in enumerate(rows):
+            incidence[topic_index, [columns[term] for term in row]] = 1
+        matrices["incidence_" + suffix] = incidence
+    return matrices
+
+
+def compare_models(lda_model_obj_0, lda_model_obj_1, metric, workers=settings.COMPARISON_WORKERS):
+    # Dense matrix of metric values, rows being the topics of the first model and columns the topics of the second
+    lda_model_0 = model_registry.get_gensim_model(lda_model_obj_0)
+    lda_model_1 = model_registry.get_gensim_model(lda_model_obj_1)
+    if metric not in METRICS:
+        raise ValueError("Unknown metric \"{}\"".format(metric))
+    if metric == "jaccard":
+        matrices = top_terms_incidence(lda_model_0, lda_model_1, settings.TOP_N_TOPIC_TERMS)
+        num_topics_0, (num_topics_1, width) = len(matrices["incidence_0"]), matrices["incidence_1"].shape
+    else:
+        matrices = shared_vocabulary_matrices(lda_model_0, lda_model_1)
+        num_topics_0, (num_topics_1, width) = len(matrices["shared_0"]), matrices["shared_1"].shape
+
+    # Every row of a block is a topics_1 row of values; Jensen-Shannon further splits its topics_1 x terms temporaries
+    max_elements = settings.COMPARISON_BLOCK_ELEMENTS
+    block_size = max(1, max_elements // max(num_topics_1, width, 1))
+    blocks = [(start, min(start + block_size, num_topics_0)) for start in range(0, num_topics_0, block_size)]
+
+    result = np.empty((num_topics_0, num_topics_1), dtype=np.float32)
+    started = time.perf_counter()
+    if workers > 1 and len(blocks) > 1:
+        # The matrices are handed to the workers as memory-mapped files
+        with tempfile.TemporaryDirectory(prefix="comparison-") as directory:
+            for name, matrix in matrices.items():
+                np.save(os.path.join(directory, name + ".npy"), matrix)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=map_worker_matrices, initargs=(directory,)) as executor:
+                futures = [(start, end, executor.submit(compare_block, metric, start, end, max_elements))
+                           for start, end in blocks]
+                for start, end, future in futures:
+                    result[start:end] = future.result()
+    else:
+        init_worker(matrices)
+        for start, end in blocks:
+            result[start:end] = compare_block(metric, start, end, max_elements)
+    logger.info("Compared %d x %d topics with %s in %.2fs", num_topics_0, num_topics_1, metric,
+                time.perf_counter() - started)
+    return result
+
+
+@transaction.atomic
+def store_comparison(comparison, values):
+    # Replaces the stored values of comparison with the given matrix. The whole matrix is packed into the comparison,
+    # while only the pairs passing its threshold and top_k are stored as topic comparisons; reads of the packed matrix
+    # prune it the same way
+    values = np.ascontiguousarray(values, dtype=np.float32)
+    comparison.matrix = values.tobytes()
+    comparison.matrix_rows, comparison.matrix_columns = values.shape
+    comparison.save(update_fields=("matrix", "matrix_rows", "matrix_columns", "data_version"))
+
+    topic_ids_0 = dict(Topic.objects.filter(parent_model=comparison.lda_model_0_id).values_list("index", "pk"))
+    topic_ids_1 = dict(Topic.objects.filter(parent_model=comparison.lda_model_1_id).values_list("index", "pk"))
+    TopicsComparison.objects.filter(parent_comparison=comparison).delete()
+    indexes_0, indexes_1 = np.nonzero(pruning_mask(values, comparison.type_of_comparison, comparison.threshold,
+                                                   comparison.top_k))
+    return copy_rows(
+        TopicsComparison, ("parent_comparison", "topic_0", "topic_1", "value"),
+        ((comparison.pk, topic_ids_0[index_0], topic_ids_1[index_1], value)
+         for index_0, index_1, value in zip(indexes_0.tolist(), indexes_1.tolist(),
+                                            values[indexes_0, indexes_1].tolist()))
+    )
+
+
+def create_comparison(name, description, lda_model_obj_0, lda_model_obj_1, metric, threshold=None, top_k=None,
+                      workers=settings.COMPARISON_WORKERS):
+    type_of_comparison, lower_bound, upper_bound = METRICS[metric]
+    values = compare_models(lda_model_obj_0, lda_model_obj_1, metric, workers=workers)
+    with transaction.atomic():
+        comparison, _ = Comparison.objects.defer("matrix").update_or_create(name=name, defaults={
+            "description": description,
+            "type_of_comparison": type_of_comparison,
+            "lower_bound": lower_bound,
+            "upper_bound": upper_bound,
+            "lda_model_0": lda_model_obj_0,
+            "lda_model_1": lda_model_obj_1,
+            "threshold": threshold,
+            "top_k": top_k
+        })
+        store_comparison(comparison, values)
+    return comparison
@@ -0,0 +1,112 @@
+import collections
+import threading
+
+import numpy as np
+
+from topic_evolution import settings
+from .models import Comparison, TopicsComparison
+from .queries import get_packed_values
+
+# Evolution graphs keyed by the (pk, data_version) of their comparisons, least recently used first
+_graphs = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+class Adjacency:
+    # Compressed adjacency lists of topic pairs, the neighbors of every topic being sorted best first. Keys are the
+    # comparison values oriented so that smaller is better, thus the neighbors within a threshold are always a prefix
+
+    def __init__(self, sources, targets, keys, size):
+        order = np.lexsort((keys, sources))
+        self.targets = targets[order]
+        self.keys = keys[order]
+        self.indptr = np.searchsorted(sources[order], np.arange(size + 1))
+
+    def neighbors(self, topic_index, key_threshold):
+        if topic_index + 1 >= len(self.indptr):
+            return self.targets[:0], self.keys[:0]
+        start, end = self.indptr[topic_index], self.indptr[topic_index + 1]
+        cut = start + np.searchsorted(self.keys[start:end], key_threshold, side="right")
+        return self.targets[start:cut], self.keys[start:cut]
+
+
+class EvolutionGraph:
+    # Topic evolution across a chain of comparisons, each one comparing a model (generation) to the next one
+
+    def __init__(self, comparisons, pairs):
+        # pairs holds, for every comparison, its (topic_0 indexes, topic_1 indexes, values) arrays
+        self.comparisons = comparisons
+        self.generations = [comparisons[0].lda_model_0] + [comparison.lda_model_1 for comparison in comparisons]
+        self.signs = [-1 if comparison.type_of_comparison == 0 else 1 for comparison in comparisons]
+        self.forward, self.backward = list(), list()
+        for sign, (indexes_0, indexes_1, values) in zip(self.signs, pairs):
+            keys = sign * values
+            size = int(max(indexes_0.max(initial=-1), indexes_1.max(initial=-1))) + 1
+            self.forward.append(Adjacency(indexes_0, indexes_1, keys, size))
+            self.backward.append(Adjacency(indexes_1, indexes_0, keys, size))
+
+    def trace(self, generation, topic_index, threshold):
+        # Edges (generation, topic index, next generation, topic index, value) reaching the given topic through
+        # comparisons at least as good as threshold: its ancestors in the previous generations and its descendants in
+        # the following ones, found by a breadth first search a generation at a time
+        edges = list()
+        frontier = {topic_index}
+        for step in range(generation, len(self.forward)):
+            frontier = self._expand(self.forward[step], self.signs[step], frontier, threshold, edges,
+                                    lambda source, target, value: (step, source, step + 1, target, value))
+        frontier = {topic_index}
+        for step in range(generation - 1, -1, -1):
+            frontier = self._expand(self.backward[step], self.signs[step], frontier, threshold, edges,
+                                    lambda source, target, value: (step, target, step + 1, source, value))
+        return edges
+
+    @staticmethod
+    def _expand(adjacency, sign, frontier, threshold, edges, edge):
+        reached = set()
+        for source in frontier:
+            targets, keys = adjacency.neighbors(source, sign * threshold)
+            for target, key in zip(targets.tolist(), keys.tolist()):
+                edges.append(edge(source, target, sign * key))
+                reached.add(target)
+        return reached
+
+
+def comparison_pairs(comparison):
+    matrix = get_packed_values(comparison)
+    if matrix is not None:
+        indexes_0, indexes_1 = np.nonzero(~np.isnan(matrix))
+        return indexes_0, indexes_1, matrix[indexes_0, indexes_1].astype(np.float64)
+    rows = np.array(
+        TopicsComparison.objects.filter(parent_comparison=comparison).values_list("topic_0__index", "topic_1__index",
+                                                                                  "value"),
+        dtype=np.float64
+    ).reshape(-1, 3)
+    return rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2]
+
+
+def get_evolution_graph(comparison_names):
+    # The evolution graph of the named comparisons, in the given order. Every comparison must compare the second model
+    # of the previous one to a next model
+    comparisons = {comparison.name: comparison
+                   for comparison in Comparison.objects.filter(name__in=comparison_names).defer("matrix")
+                                                       .select_related("lda_model_0", "lda_model_1")}
+    missing = [name for name in comparison_names if name not in comparisons]
+    if missing:
+        raise ValueError("Unknown comparison(s): {}".format(", ".join(missing)))
+    comparisons = [comparisons[name] for name in comparison_names]
+    for previous, following in zip(comparisons, comparisons[1:]):
+        if previous.lda_model_1_id != following.lda_model_0_id:
+            raise ValueError("Comparison {} does not follow comparison {}".format(following.name, previous.name))
+
+    key = tuple((comparison.pk, comparison.data_version) for comparison in comparisons)
+    with _lock:
+        if key in _graphs:
+            _graphs.move_to_end(key)
+            return _graphs[key]
+
+    graph = EvolutionGraph(comparisons, [comparison_pairs(comparison) for comparison in comparisons])
+    with _lock:
+        _graphs[key] = graph
+        while len(_graphs) > settings.EVOLUTION_GRAPH_CACHE_SIZE:
+            _graphs.popitem(last=False)
+    return graph
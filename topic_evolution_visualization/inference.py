@@ -0,0 +1,86 @@
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from topic_evolution import settings
+from . import model_registry, tfidf
+from .preprocessing import get_preprocessor, preprocess_texts
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def get_executor():
+    # A single preprocessing pool per process, created on first use. Its workers are spawned, so they neither inherit
+    # the database connections nor the loaded models of the web worker
+    global _executor
+    with _executor_lock:
+        if _executor is None and settings.INFERENCE_WORKERS > 1:
+            _executor = ProcessPoolExecutor(max_workers=settings.INFERENCE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def preprocess_batch(preprocessor_name, texts):
+    executor = get_executor()
+    if executor is None or len(texts) < 2 * settings.INFERENCE_WORKERS:
+        return preprocess_texts(preprocessor_name, texts)
+    slice_size = -(-len(texts) // settings.INFERENCE_WORKERS)
+    slices = [texts[i:i + slice_size] for i in range(0, len(texts), slice_size)]
+    return [tokens for slice_tokens in executor.map(preprocess_texts, [preprocessor_name] * len(slices), slices)
+            for tokens in slice_tokens]
+
+
+def load_inference_model(lda_model_obj):
+    # The gensim model and, if the model uses tf-idf, the idf table inference needs, after checking the model's
+    # preprocessor exists. Raises PreprocessingError or OSError for a misconfigured model
+    get_preprocessor(lda_model_obj.preprocessor_name)
+    lda_model = model_registry.get_gensim_model(lda_model_obj)
+    idf = model_registry.get_idf(lda_model_obj) if lda_model_obj.use_tfidf else None
+    return lda_model, idf
+
+
+def infer_topics(lda_model_obj, documents, top_k=settings.INFERENCE_TOP_K, batch_size=settings.INFERENCE_BATCH_SIZE,
+                 preprocess=preprocess_batch):
+    # Returns an iterator of (document id, [(topic index, probability), ...]) for every (document id, text) pair of
+    # documents, with the top_k most probable topics of each document. The model is loaded right away, so that a
+    # misconfigured model fails before the first document is read. Documents are inferred in batches: the texts of a
+    # batch are preprocessed, in parallel by default, and their bags of words are inferred by gensim in a single call
+    lda_model, idf = load_inference_model(lda_model_obj)
+    return _infer_batches(lda_model_obj, lda_model, idf, documents, min(top_k, lda_model.num_topics), batch_size,
+                          preprocess)
+
+
+def _infer_batches(lda_model_obj, lda_model, idf, documents, top_k, batch_size, preprocess):
+    dictionary = lda_model.id2word
+    for batch in chunked(documents, batch_size):
+        document_ids = [document_id for document_id, _ in batch]
+        bows = [dictionary.doc2bow(tokens)
+                for tokens in preprocess(lda_model_obj.preprocessor_name, [text for _, text in batch])]
+        if idf is not None:
+            bows = tfidf.weight_bows(bows, idf)
+        gamma, _ = lda_model.inference(bows)
+        theta = gamma / gamma.sum(axis=1, keepdims=True)
+        top_topics = np.argpartition(-theta, top_k - 1, axis=1)[:, :top_k]
+        top_values = np.take_along_axis(theta, top_topics, axis=1)
+        order = np.argsort(-top_values, axis=1)
+        top_topics = np.take_along_axis(top_topics, order, axis=1).tolist()
+        top_values = np.take_along_axis(top_values, order, axis=1).tolist()
+        for document_id, bow, topics, values in zip(document_ids, bows, top_topics, top_values):
+            # A document without any term of the model's vocabulary has no topics to speak of
+            yield document_id, list(zip(topics, values)) if bow else []
@@ -0,0 +1,236 @@
+import logging
+import time
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Q
+
+from topic_evolution import settings
+from . import model_registry, queries, similarity, tfidf
+from .models import LdaModel, Topic, Term, TopicTermDistribution, TopicTermRepresentation, Comparison, \
+    TopicsComparison, TopicYearPrevalence
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_terms(strings, known_terms):
+    # Resolves the given term strings to Term primary keys, creating the missing ones. known_terms is updated in place
+    # so that each string hits the database at most once per ingestion
+    unknown = {string for string in strings if string not in known_terms}
+    if not unknown:
+        return known_terms
+    known_terms.update(Term.objects.filter(string__in=unknown).values_list("string", "pk"))
+    missing = [string for string in unknown if string not in known_terms]
+    if missing:
+        Term.objects.bulk_create([Term(string=string) for string in missing], ignore_conflicts=True)
+        known_terms.update(Term.objects.filter(string__in=missing).values_list("string", "pk"))
+    return known_terms
+
+
+def top_topic_terms(lda_model, topn, first_topic, last_topic):
+    # Top-n term ids and weights of topics [first_topic, last_topic), sorted by descending weight. The topic-term
+    # distributions are normalized from the model state (the same values get_topic_terms gives) in blocks of rows, so
+    # that a memory-mapped state is never fully loaded in memory and no full vocabulary row is ever sorted
+    state = lda_model.state
+    eta = np.asarray(state.eta)
+    num_terms = state.sstats.shape[1]
+    topn = min(topn, num_terms)
+    block_size = max(1, settings.INGESTION_BLOCK_ELEMENTS // num_terms)
+    term_ids = np.empty((last_topic - first_topic, topn), dtype=np.int64)
+    term_weights = np.empty((last_topic - first_topic, topn), dtype=np.float64)
+    for block_start in range(first_topic, last_topic, block_size):
+        block_end = min(block_start + block_size, last_topic)
+        block = state.sstats[block_start:block_end] + (eta[block_start:block_end] if eta.ndim == 2 else eta)
+        block /= block.sum(axis=1, keepdims=True)
+        top = np.argpartition(block, num_terms - topn, axis=1)[:, num_terms - topn:]
+        top_weights = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_weights, axis=1)
+        term_ids[block_start - first_topic:block_end - first_topic] = np.take_along_axis(top, order, axis=1)
+        term_weights[block_start - first_topic:block_end - first_topic] = np.take_along_axis(top_weights, order, axis=1)
+    return term_ids, term_weights
+
+
+def invalidate_topic_comparisons(lda_model_obj, topic_indexes, num_topics):
+    # The comparisons of the given topics of a re-ingested model no longer hold: their topic comparisons are deleted and
+    # their values in the packed matrices are marked as unknown (NaN). Packed matrices that no longer match the number
+    # of topics of the model are dropped altogether
+    topic_indexes = sorted(topic_indexes)
+    for comparison in Comparison.objects.select_for_update().filter(
+            Q(lda_model_0=lda_model_obj) | Q(lda_model_1=lda_model_obj)):
+        TopicsComparison.objects.filter(
+            Q(topic_0__parent_model=lda_model_obj, topic_0__index__in=topic_indexes) |
+            Q(topic_1__parent_model=lda_model_obj, topic_1__index__in=topic_indexes),
+            parent_comparison=comparison
+        ).delete()
+        matrix = comparison.get_matrix()
+        if matrix is not None:
+            matrix = matrix.copy()
+            for axis, lda_model_id in enumerate((comparison.lda_model_0_id, comparison.lda_model_1_id)):
+                if lda_model_id != lda_model_obj.pk:
+                    continue
+                if matrix is None or matrix.shape[axis] != num_topics:
+                    matrix = None
+                elif axis == 0:
+                    matrix[topic_indexes, :] = np.nan
+                else:
+                    matrix[:, topic_indexes] = np.nan
+        if matrix is None:
+            comparison.matrix = comparison.matrix_rows = comparison.matrix_columns = None
+        else:
+            comparison.matrix = matrix.tobytes()
+        comparison.save(update_fields=("matrix", "matrix_rows", "matrix_columns", "data_version"))
+
+
+def ingest_lda_model(lda_model_obj, start_topic=0, progress_callback=None, heartbeat_callback=None,
+                     chunk_size=settings.INGESTION_CHUNK_SIZE):
+    # The top terms of every topic are diffed against the stored ones, so that only the rows that changed are written:
+    # ingesting a new model inserts every row, while re-ingesting a replaced model file keeps the keyphrases of its
+    # topics and the comparisons of the topics whose terms did not change.
+    # Topics are processed in batches of roughly chunk_size topic-term rows, each batch in its own transaction.
+    # progress_callback(ingested_topics, total_topics) is called inside the transaction of each batch, so the progress
+    # it records always matches the committed rows and ingesting again from start_topic resumes an interrupted run.
+    # heartbeat_callback() is called outside of any transaction before every step that may take long, so that a
+    # running ingestion is never mistaken for a crashed one
+    def beat():
+        if heartbeat_callback is not None:
+            heartbeat_callback()
+
+    lda_model = model_registry.get_gensim_model(lda_model_obj)
+    dictionary = lda_model.id2word
+    num_topics = lda_model.num_topics
+    topn = settings.TOP_N_TOPIC_TERMS
+    started = time.perf_counter()
+    stats = {"inserted": 0, "updated": 0, "deleted": 0, "changed_topics": 0}
+    beat()
+    # The idf table is built even when the model does not use tf-idf, so that use_tfidf can be switched on at any time
+    tfidf.build_idf(lda_model_obj, lda_model)
+    beat()
+    similarity.build_topic_index(lda_model_obj, lda_model)
+    beat()
+
+    with transaction.atomic():
+        # Topics beyond the ones of the model file are gone along with their terms, comparisons and prevalence
+        removed_topics = list(Topic.objects.filter(parent_model=lda_model_obj, index__gte=num_topics)
+                              .values_list("index", flat=True))
+        if removed_topics:
+            invalidate_topic_comparisons(lda_model_obj, removed_topics, num_topics)
+            Topic.objects.filter(parent_model=lda_model_obj, index__gte=num_topics).delete()
+            TopicTermRepresentation.objects.filter(lda_model=lda_model_obj, topic_index__gte=num_topics).delete()
+            TopicYearPrevalence.objects.filter(lda_model=lda_model_obj, topic_index__gte=num_topics).delete()
+        existing_topics = set(Topic.objects.filter(parent_model=lda_model_obj).values_list("index", flat=True))
+        Topic.objects.bulk_create(
+            [Topic(index=i, parent_model=lda_model_obj, keyphrase="") for i in range(num_topics)
+             if i not in existing_topics]
+        )
+    topic_ids, keyphrases = dict(), dict()
+    for index, pk, keyphrase in Topic.objects.filter(parent_model=lda_model_obj) \
+            .values_list("index", "pk", "keyphrase"):
+        topic_ids[index], keyphrases[index] = pk, keyphrase
+
+    known_terms = dict()
+    topics_per_chunk = max(1, chunk_size // topn)
+    for first_topic in range(start_topic, num_topics, topics_per_chunk):
+        beat()
+        last_topic = min(first_topic + topics_per_chunk, num_topics)
+        term_ids, term_weights = top_topic_terms(lda_model, topn, first_topic, last_topic)
+        # Dictionary lookups are only needed once per distinct term of the batch
+        unique_term_ids, term_positions = np.unique(term_ids, return_inverse=True)
+        term_strings = [dictionary[term_id] for term_id in unique_term_ids.tolist()]
+        with transaction.atomic():
+            resolve_terms(term_strings, known_terms)
+            unique_term_pks = [known_terms[term_string] for term_string in term_strings]
+            display_terms = dict(zip(unique_term_pks, term_strings))
+            display_terms.update(
+                Term.objects.filter(pk__in=unique_term_pks, display_word__isnull=False).values_list("pk",
+                                                                                                    "display_word")
+            )
+            batch = zip(
+                np.repeat(np.arange(first_topic, last_topic), term_ids.shape[1]).tolist(),
+                np.tile(np.arange(1, term_ids.shape[1] + 1), last_topic - first_topic).tolist(),
+                np.array(unique_term_pks)[term_positions.ravel()].tolist(),
+                np.round(term_weights, 5).ravel().tolist()
+            )
+
+            # Stored rows of the batch's topics, by (topic index, rank)
+            stored = {(topic_index, rank): (pk, term_pk, float(value)) for pk, topic_index, rank, term_pk, value in
+                      TopicTermDistribution.objects.filter(topic__parent_model=lda_model_obj,
+                                                           topic__index__gte=first_topic,
+                                                           topic__index__lt=last_topic)
+                                                   .values_list("pk", "topic__index", "rank", "term_id", "value")}
+            stored_representations = {
+                (topic_index, rank): pk for pk, topic_index, rank in
+                TopicTermRepresentation.objects.filter(lda_model=lda_model_obj, topic_index__gte=first_topic,
+                                                       topic_index__lt=last_topic)
+                                               .values_list("pk", "topic_index", "rank")
+            }
+            # Representation rows are diffed on their own, so that missing ones are inserted even for unchanged terms
+            inserted, updated, changed_topics = list(), list(), set()
+            inserted_representations, updated_representations = list(), list()
+            for topic_index, rank, term_pk, value in batch:
+                stored_row = stored.pop((topic_index, rank), None)
+                representation_pk = stored_representations.pop((topic_index, rank), None)
+                changed = stored_row is None or stored_row[1:] != (term_pk, value)
+                if stored_row is None:
+                    inserted.append((topic_index, rank, term_pk, value))
+                elif changed:
+                    updated.append((stored_row[0], term_pk, value))
+                if changed:
+                    changed_topics.add(topic_index)
+                if representation_pk is None:
+                    inserted_representations.append((topic_index, rank, term_pk, value))
+                elif changed:
+                    updated_representations.append((representation_pk, term_pk, value))
+            # Whatever is left of the stored rows is ranked beyond the top terms of the model file
+            deleted = list(stored.items())
+            changed_topics.update(topic_index for (topic_index, _), _ in deleted)
+
+            if deleted:
+                TopicTermDistribution.objects.filter(pk__in=[pk for _, (pk, _, _) in deleted]).delete()
+            if stored_representations:
+                TopicTermRepresentation.objects.filter(pk__in=list(stored_representations.values())).delete()
+            if inserted:
+                TopicTermDistribution.objects.bulk_create(
+                    [TopicTermDistribution(topic_id=topic_ids[topic_index], term_id=term_pk, value=value, rank=rank)
+                     for topic_index, rank, term_pk, value in inserted]
+                )
+            if inserted_representations:
+                TopicTermRepresentation.objects.bulk_create(
+                    [TopicTermRepresentation(lda_model=lda_model_obj, topic_index=topic_index,
+                                             keyphrase=keyphrases[topic_index], rank=rank, term_id=term_pk,
+                                             display_term=display_terms[term_pk], value=value)
+                     for topic_index, rank, term_pk, value in inserted_representations]
+                )
+            if updated:
+                TopicTermDistribution.objects.bulk_update(
+                    [TopicTermDistribution(pk=pk, term_id=term_pk, value=value) for pk, term_pk, value in updated],
+                    ("term", "value"), batch_size=chunk_size
+                )
+            if updated_representations:
+                TopicTermRepresentation.objects.bulk_update(
+                    [TopicTermRepresentation(pk=pk, term_id=term_pk, display_term=display_terms[term_pk], value=value)
+                     for pk, term_pk, value in updated_representations],
+                    ("term", "display_term", "value"), batch_size=chunk_size
+                )
+            if changed_topics and existing_topics:
+                invalidate_topic_comparisons(lda_model_obj, changed_topics, num_topics)
+            if progress_callback is not None:
+                progress_callback(last_topic, num_topics)
+        stats["inserted"] += len(inserted)
+        stats["updated"] += len(updated)
+        stats["deleted"] += len(deleted)
+        stats["changed_topics"] += len(changed_topics)
+        logger.debug("Model %s: %d/%d topics ingested", lda_model_obj.name, last_topic, num_topics)
+
+    LdaModel.objects.filter(pk=lda_model_obj.pk).update(is_ingested=True, data_version=F("data_version") + 1)
+    lda_model_obj.refresh_from_db(fields=("is_ingested", "data_version"))
+    queries.forget_model()
+
+    elapsed = time.perf_counter() - started
+    rows = stats["inserted"] + stats["updated"] + stats["deleted"]
+    rows_per_second = rows / elapsed if elapsed else float(rows)
+    logger.info("Model %s: ingested %d topics (%d changed), %d topic-term rows inserted, %d updated, %d deleted in "
+                "%.2fs (%.0f rows/s)", lda_model_obj.name, num_topics - start_topic, stats["changed_topics"],
+                stats["inserted"], stats["updated"], stats["deleted"], elapsed, rows_per_second)
+    stats.update({"topics": num_topics - start_topic, "rows": rows, "seconds": elapsed,
+                  "rows_per_second": rows_per_second})
+    return stats
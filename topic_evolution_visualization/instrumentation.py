@@ -0,0 +1,164 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import random
+import threading
+import time
+
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+from topic_evolution import settings
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Metrics of the request being handled, if it is sampled
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.spans = collections.OrderedDict()
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self, total_seconds):
+        # Server-Timing header value; durations are in milliseconds
+        metrics = ['db;dur={:.2f};desc="{} queries"'.format(1000 * self.sql_seconds, self.queries)]
+        metrics.extend("{};dur={:.2f}".format(name, 1000 * seconds) for name, seconds in self.spans.items())
+        metrics.append("total;dur={:.2f}".format(1000 * total_seconds))
+        return ", ".join(metrics)
+
+
+class Registry:
+    # Aggregated metrics of the sampled requests handled by this process, per view and per span
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.buckets = collections.defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+        self.durations = collections.Counter()
+        self.queries = collections.Counter()
+        self.sql_seconds = collections.Counter()
+        self.span_counts = collections.Counter()
+        self.span_seconds = collections.Counter()
+
+    def record(self, view, total_seconds, metrics):
+        with self.lock:
+            self.requests[view] += 1
+            self.buckets[view][bisect.bisect_left(DURATION_BUCKETS, total_seconds)] += 1
+            self.durations[view] += total_seconds
+            self.queries[view] += metrics.queries
+            self.sql_seconds[view] += metrics.sql_seconds
+            for name, seconds in metrics.spans.items():
+                self.span_counts[name] += 1
+                self.span_seconds[name] += seconds
+
+    def export(self):
+        # The metrics in the Prometheus text exposition format
+        lines = list()
+
+        def family(name, kind, description, samples):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines.extend("{}{{{}}} {}".format(name, labels, value) for labels, value in samples)
+
+        with self.lock:
+            views = sorted(self.requests)
+            lines.append("# HELP topic_evolution_request_duration_seconds Duration of the sampled requests")
+            lines.append("# TYPE topic_evolution_request_duration_seconds histogram")
+            for view in views:
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS + ("+Inf",), self.buckets[view]):
+                    cumulative += count
+                    lines.append('topic_evolution_request_duration_seconds_bucket{{view="{}",le="{}"}} {}'.format(
+                        view, bound, cumulative))
+                lines.append('topic_evolution_request_duration_seconds_sum{{view="{}"}} {}'.format(
+                    view, self.durations[view]))
+                lines.append('topic_evolution_request_duration_seconds_count{{view="{}"}} {}'.format(
+                    view, self.requests[view]))
+            family("topic_evolution_db_queries_total", "counter", "Database queries of the sampled requests",
+                   [('view="{}"'.format(view), self.queries[view]) for view in views])
+            family("topic_evolution_db_seconds_total", "counter", "Database time of the sampled requests",
+                   [('view="{}"'.format(view), self.sql_seconds[view]) for view in views])
+            spans = sorted(self.span_counts)
+            family("topic_evolution_span_seconds_total", "counter", "Time spent in the instrumented spans",
+                   [('span="{}"'.format(name), self.span_seconds[name]) for name in spans])
+            family("topic_evolution_span_count_total", "counter", "Times the instrumented spans were entered",
+                   [('span="{}"'.format(name), self.span_counts[name]) for name in spans])
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+@contextlib.contextmanager
+def span(name):
+    # Times a named part of the handling of a sampled request. Outside of sampled requests it does nothing
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.spans[name] = metrics.spans.get(name, 0.0) + time.perf_counter() - started
+
+
+class InstrumentedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with span("render"):
+            return super().render(context, request)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    # Template backend timing the rendering of every template, whichever view renders it, in the "render" span
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
+
+
+class InstrumentationMiddleware:
+    # Records the database queries and time, the spans and the duration of a sample of the requests. Sampled responses
+    # carry them in a Server-Timing header, and their aggregates are exported by the metrics view
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.INSTRUMENTATION_SAMPLE_RATE <= 0 or random.random() >= settings.INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_seconds = time.perf_counter() - metrics.started
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response["Server-Timing"] = metrics.server_timing(total_seconds)
+        resolver_match = getattr(request, "resolver_match", None)
+        registry.record(resolver_match.url_name or resolver_match.view_name if resolver_match else "unresolved",
+                        total_seconds, metrics)
+        return response
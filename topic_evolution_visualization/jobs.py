@@ -0,0 +1,72 @@
+import datetime
+import logging
+import traceback
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from topic_evolution import settings
+from .models import IngestionJob, LdaModel, TopicTermRepresentation
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_ingestion(lda_model_obj):
+    return IngestionJob.objects.create(lda_model=lda_model_obj)
+
+
+def enqueue_backfill():
+    # Models stored before ingestion jobs and topic-term representations existed have topics, but are not marked as
+    # ingested or have no representation rows. Re-ingesting them only writes what they are missing
+    lda_model_objs = LdaModel.objects.annotate(
+        has_representations=Exists(TopicTermRepresentation.objects.filter(lda_model=OuterRef("pk")))
+    ).filter(Q(is_ingested=False) | Q(has_representations=False), model_topics__isnull=False) \
+        .exclude(ingestion_jobs__status__in=(IngestionJob.PENDING, IngestionJob.RUNNING)).distinct().order_by("pk")
+    return [enqueue_ingestion(lda_model_obj) for lda_model_obj in lda_model_objs]
+
+
+def requeue_stale_jobs():
+    # Jobs still marked as running without a recent heartbeat belong to a crashed worker; they are resumed from their
+    # last committed topic
+    stale_before = timezone.now() - datetime.timedelta(seconds=settings.INGESTION_JOB_STALE_SECONDS)
+    return IngestionJob.objects.filter(status=IngestionJob.RUNNING, heartbeat__lt=stale_before) \
+        .update(status=IngestionJob.PENDING)
+
+
+def claim_pending_jobs(limit):
+    claimed = list()
+    for job_pk in IngestionJob.objects.filter(status=IngestionJob.PENDING).order_by("created") \
+                                      .values_list("pk", flat=True)[:limit]:
+        # The conditional update makes claiming safe when several runners poll the same table
+        if IngestionJob.objects.filter(pk=job_pk, status=IngestionJob.PENDING) \
+                .update(status=IngestionJob.RUNNING, heartbeat=timezone.now()):
+            claimed.append(job_pk)
+    return claimed
+
+
+def fail_job(job_pk):
+    # Called while handling the exception the job failed with
+    IngestionJob.objects.filter(pk=job_pk).update(status=IngestionJob.FAILED, error=traceback.format_exc())
+
+
+def run_ingestion_job(job_pk):
+    from .ingestion import ingest_lda_model
+
+    job = IngestionJob.objects.select_related("lda_model").get(pk=job_pk)
+
+    def report_progress(ingested_topics, total_topics):
+        IngestionJob.objects.filter(pk=job_pk).update(ingested_topics=ingested_topics, total_topics=total_topics,
+                                                      heartbeat=timezone.now())
+
+    def beat():
+        IngestionJob.objects.filter(pk=job_pk).update(heartbeat=timezone.now())
+
+    try:
+        stats = ingest_lda_model(job.lda_model, start_topic=job.ingested_topics, progress_callback=report_progress,
+                                 heartbeat_callback=beat)
+    except Exception:
+        logger.exception("Ingestion job %d failed", job_pk)
+        fail_job(job_pk)
+        return None
+    IngestionJob.objects.filter(pk=job_pk).update(status=IngestionJob.DONE, heartbeat=timezone.now())
+    return stats
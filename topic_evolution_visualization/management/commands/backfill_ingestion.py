@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from topic_evolution_visualization import jobs
+
+
+class Command(BaseCommand):
+    help = "Queues the ingestion of the models that have topics but were never ingested or lack their topic-term " \
+           "representations"
+
+    def handle(self, *args, **options):
+        queued = jobs.enqueue_backfill()
+        for job in queued:
+            self.stdout.write("Queued job {} for model {}".format(job.pk, job.lda_model.name))
+        self.stdout.write("{} job(s) queued; run_ingestion_jobs runs them".format(len(queued)))
@@ -0,0 +1,139 @@
+import datetime
+import glob
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import django
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from topic_evolution import settings
+from topic_evolution_visualization import queries, synthetic
+from topic_evolution_visualization.ingestion import ingest_lda_model
+from topic_evolution_visualization.models import LdaModel
+
+# Names of the synthetic models the benchmark creates and deletes
+MODEL_NAMES = ("benchmark-0", "benchmark-1", "benchmark-ingest")
+PATHS = ("ingest", "topics_terms", "topic_terms", "topic_comparisons", "comparison_edges")
+
+
+def measure(function, iterations):
+    # Latency percentiles and queries per call over the given iterations, then the peak of the memory allocated by a
+    # single call, traced separately so that tracing does not weigh on the latencies
+    latencies, query_counts = list(), list()
+    for iteration in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            function(iteration)
+            latencies.append(time.perf_counter() - started)
+        query_counts.append(len(context))
+    tracemalloc.start()
+    function(iterations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = 1000 * np.array(latencies)
+    return {
+        "iterations": iterations,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "queries": float(np.mean(query_counts)),
+        "peak_memory_kb": peak / 1024
+    }
+
+
+class Command(BaseCommand):
+    help = "Measures the ingestion and read paths on synthetic models and stores the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--topics", type=int, default=200, help="Topics of every synthetic model")
+        parser.add_argument("--vocabulary", type=int, default=20000, help="Terms of every synthetic model")
+        parser.add_argument("--words-per-term", type=int, default=2, help="Original words of every term")
+        parser.add_argument("--density", type=float, default=0.1,
+                            help="Fraction of the topic pairs stored as topic comparisons")
+        parser.add_argument("--iterations", type=int, default=50, help="Calls measured per read path")
+        parser.add_argument("--rounds", type=int, default=3, help="Ingestions measured")
+        parser.add_argument("--paths", nargs="+", choices=PATHS, default=PATHS, help="Paths to measure")
+        parser.add_argument("--output", help="File to store the results in, as JSON")
+        parser.add_argument("--baseline", help="Results of a previous run to compare with")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if LdaModel.objects.filter(name__in=MODEL_NAMES).exists():
+            raise CommandError("Synthetic benchmark models exist already; a previous run was interrupted. Delete the "
+                               "models named {} first".format(", ".join(MODEL_NAMES)))
+        generator = random.Random(options["seed"])
+        topics = options["topics"]
+        model_path = os.path.join(settings.RESOURCES_DIRECTORY, "synthetic", "{}.lda".format(MODEL_NAMES[2]))
+        results = dict()
+        try:
+            self.stdout.write("Generating synthetic data")
+            lda_model_obj = synthetic.create_model(MODEL_NAMES[0], topics, options["vocabulary"],
+                                                   words_per_term=options["words_per_term"], seed=options["seed"])
+            other = synthetic.create_model(MODEL_NAMES[1], topics, options["vocabulary"], seed=options["seed"] + 1)
+            comparison = synthetic.create_comparison(MODEL_NAMES[1], lda_model_obj, other, density=options["density"],
+                                                     seed=options["seed"])
+            threshold = 1.0 - options["density"]
+
+            read_paths = {
+                "topics_terms": lambda _: queries.get_topics_terms_representation(lda_model_obj),
+                "topic_terms": lambda _: queries.get_topics_terms_representation(
+                    lda_model_obj, generator.randrange(topics), top_n=10),
+                "topic_comparisons": lambda _: queries.get_topic_comparisons(
+                    comparison, generator.randrange(topics), threshold=threshold),
+                "comparison_edges": lambda _: queries.get_comparison_edges_page(
+                    comparison, threshold=threshold, after=generator.randrange(topics) - 1)
+            }
+            for path in options["paths"]:
+                if path in read_paths:
+                    results[path] = measure(read_paths[path], options["iterations"])
+                    self.report(path, results[path])
+
+            if "ingest" in options["paths"]:
+                synthetic.write_gensim_model(model_path, topics, options["vocabulary"], seed=options["seed"])
+
+                def ingest(_):
+                    LdaModel.objects.filter(name=MODEL_NAMES[2]).delete()
+                    ingest_lda_model(LdaModel.objects.create(name=MODEL_NAMES[2], is_main=False, path=model_path,
+                                                             description="Synthetic model"))
+
+                results["ingest"] = measure(ingest, options["rounds"])
+                self.report("ingest", results["ingest"])
+        finally:
+            synthetic.delete_synthetic_data(*MODEL_NAMES)
+            for path in glob.glob(glob.escape(model_path) + "*"):
+                os.remove(path)
+
+        report = {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "parameters": {name: options[name] for name in ("topics", "vocabulary", "words_per_term", "density",
+                                                             "iterations", "rounds", "seed")},
+            "results": results
+        }
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(report, output_file, indent=2)
+            self.stdout.write("Results stored in {}".format(options["output"]))
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)["results"]
+            for path, stats in results.items():
+                if path in baseline:
+                    self.stdout.write("{}: p50 {:+.1%}, p99 {:+.1%}, queries {:+.1f}, peak memory {:+.1%}".format(
+                        path, stats["p50_ms"] / baseline[path]["p50_ms"] - 1,
+                        stats["p99_ms"] / baseline[path]["p99_ms"] - 1,
+                        stats["queries"] - baseline[path]["queries"],
+                        stats["peak_memory_kb"] / max(baseline[path]["peak_memory_kb"], 1e-9) - 1))
+
+    def report(self, path, stats):
+        self.stdout.write("{}: p50 {p50_ms:.2f}ms, p90 {p90_ms:.2f}ms, p99 {p99_ms:.2f}ms, max {max_ms:.2f}ms, "
+                          "{queries:.1f} queries, peak memory {peak_memory_kb:.0f}KB".format(path, **stats))
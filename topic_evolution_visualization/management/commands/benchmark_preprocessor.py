@@ -0,0 +1,50 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from topic_evolution_visualization import preprocessing
+
+SAMPLE_WORDS = ("the", "topic", "models", "learning", "of", "neural", "networks", "were", "trained", "on", "abstracts",
+                "proteins", "sequencing", "galaxies", "observations", "economic", "policies", "and", "markets",
+                "evaluation", "results", "showing", "significant", "improvements", "using", "methods")
+
+
+class Command(BaseCommand):
+    help = "Measures the throughput of a text preprocessor, on the lines of a file or on synthetic texts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", default="default", help="Name of the preprocessor")
+        parser.add_argument("--file", help="File with one text per line. Synthetic texts are used if omitted")
+        parser.add_argument("--documents", type=int, default=10000, help="Number of texts to preprocess per round")
+        parser.add_argument("--words", type=int, default=200, help="Words per synthetic text")
+        parser.add_argument("--rounds", type=int, default=3, help="Rounds to run")
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            with open(options["file"], encoding="utf-8") as texts_file:
+                texts = list(itertools.islice((line for line in texts_file if line.strip()), options["documents"]))
+        else:
+            generator = random.Random(0)
+            texts = [" ".join(generator.choice(SAMPLE_WORDS) for _ in range(options["words"]))
+                     for _ in range(options["documents"])]
+        if not texts:
+            raise CommandError("No texts to preprocess")
+        characters = sum(len(text) for text in texts)
+
+        started = time.perf_counter()
+        try:
+            preprocessor = preprocessing.get_preprocessor(options["name"])
+        except preprocessing.PreprocessingError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Pipeline built in {:.2f}ms".format(1000 * (time.perf_counter() - started)))
+
+        for round_number in range(1, options["rounds"] + 1):
+            started = time.perf_counter()
+            tokens = sum(len(terms) for terms in preprocessor.iter_preprocess(iter(texts)))
+            elapsed = time.perf_counter() - started
+            self.stdout.write("Round {}: {} texts, {} terms in {:.3f}s - {:.0f} texts/s, {:.1f} MB/s".format(
+                round_number, len(texts), tokens, elapsed, len(texts) / elapsed, characters / elapsed / 2 ** 20))
+        if preprocessor.stem is not None:
+            self.stdout.write("Stem cache: {}".format(preprocessor.stem.cache_info()))
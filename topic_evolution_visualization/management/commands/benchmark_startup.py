@@ -0,0 +1,83 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings as django_settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules a web worker should only import once a request needs them
+HEAVY_MODULES = ("numpy", "scipy", "gensim", "nltk", "smart_open")
+
+# Run in a fresh interpreter: boots the WSGI application the way a server worker does, loads the URL configuration and
+# optionally warms up, then reports the time taken, the resident memory and the heavy modules imported
+PROBE = """
+import json, os, resource, sys, time
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "topic_evolution.settings")
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+booted = time.perf_counter()
+if {warm_up}:
+    from topic_evolution_visualization import model_registry
+    model_registry.warm_up()
+warmed_up = time.perf_counter()
+
+def rss_kb():
+    try:
+        with open("/proc/self/status") as status:
+            return next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+
+print(json.dumps({{"boot_ms": 1000 * (booted - started), "warm_up_ms": 1000 * (warmed_up - booted), "rss_kb": rss_kb(),
+                  "heavy_modules": [name for name in {heavy_modules!r} if name in sys.modules]}}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measures the time and memory it takes a fresh web worker to boot the application, optionally warming up"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=5, help="Fresh worker processes to measure")
+        parser.add_argument("--warm-up", action="store_true", help="Also load the main model as a preloading server "
+                                                                   "does before forking")
+        parser.add_argument("--output", help="File to store the results in, as JSON")
+        parser.add_argument("--baseline", help="Results of a previous run to compare with")
+
+    def handle(self, *args, **options):
+        probe = PROBE.format(warm_up=options["warm_up"], heavy_modules=HEAVY_MODULES)
+        environment = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE",
+                                                                              "topic_evolution.settings"))
+        samples = list()
+        for _ in range(options["rounds"]):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, "-c", probe], cwd=django_settings.BASE_DIR, env=environment,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if completed.returncode:
+                raise CommandError("The worker failed to boot:\n{}".format(completed.stderr))
+            sample = json.loads(completed.stdout.strip().splitlines()[-1])
+            sample["process_ms"] = 1000 * (time.perf_counter() - started)
+            samples.append(sample)
+
+        results = {name: statistics.median(sample[name] for sample in samples)
+                   for name in ("process_ms", "boot_ms", "warm_up_ms", "rss_kb")}
+        results["heavy_modules"] = sorted({name for sample in samples for name in sample["heavy_modules"]})
+        self.stdout.write("process {process_ms:.0f}ms, boot {boot_ms:.0f}ms, warm-up {warm_up_ms:.0f}ms, "
+                          "RSS {rss_kb:.0f}KB (medians of {rounds} workers)".format(rounds=len(samples), **results))
+        self.stdout.write("Heavy modules imported: {}".format(", ".join(results["heavy_modules"]) or "none"))
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump({"warm_up": options["warm_up"], "rounds": options["rounds"], "results": results,
+                           "samples": samples}, output_file, indent=2)
+            self.stdout.write("Results stored in {}".format(options["output"]))
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)["results"]
+            self.stdout.write("boot {:+.1%}, RSS {:+.1%}".format(results["boot_ms"] / baseline["boot_ms"] - 1,
+                                                                 results["rss_kb"] / baseline["rss_kb"] - 1))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from topic_evolution_visualization import model_registry, similarity
+from topic_evolution_visualization.models import LdaModel
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the topic and article similarity indexes stored next to the file of an LDA model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="Name of the LDA model")
+
+    def handle(self, *args, **options):
+        lda_model_obj = LdaModel.objects.filter(name=options["model"]).first()
+        if lda_model_obj is None:
+            raise CommandError("No LDA model named {}".format(options["model"]))
+        similarity.build_topic_index(lda_model_obj, model_registry.get_gensim_model(lda_model_obj))
+        index = similarity.build_article_index(lda_model_obj)
+        self.stdout.write("Indexed {} topics and {} articles".format(lda_model_obj.model_topics.count(),
+                                                                     len(index["articles"])))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from topic_evolution import settings
+from topic_evolution_visualization import comparisons
+from topic_evolution_visualization.models import LdaModel
+
+
+class Command(BaseCommand):
+    help = "Compares every topic of an LDA model with every topic of another one and stores the result as a comparison"
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", help="Name of the comparison; an existing comparison with this name is replaced")
+        parser.add_argument("lda_model_0", help="Name of the first LDA model")
+        parser.add_argument("lda_model_1", help="Name of the second LDA model")
+        parser.add_argument("--metric", choices=sorted(comparisons.METRICS), default="hellinger")
+        parser.add_argument("--description", help="Description of the comparison. Defaults to the metric's name")
+        parser.add_argument("--threshold", type=float,
+                            help="Only store the topic pairs at least this good as topic comparisons")
+        parser.add_argument("--top-k", type=int,
+                            help="Only store the k best topic pairs of every topic of the second model as topic "
+                                 "comparisons")
+        parser.add_argument("--workers", type=int, default=settings.COMPARISON_WORKERS,
+                            help="Number of worker processes")
+
+    def handle(self, *args, **options):
+        lda_model_objs = list()
+        for name in (options["lda_model_0"], options["lda_model_1"]):
+            try:
+                lda_model_objs.append(LdaModel.objects.get(name=name, is_ingested=True))
+            except LdaModel.DoesNotExist:
+                raise CommandError("No ingested LDA model named \"{}\"".format(name))
+        description = options["description"] or options["metric"].replace("_", "-").capitalize()
+        comparison = comparisons.create_comparison(options["name"], description, *lda_model_objs,
+                                                   options["metric"], threshold=options["threshold"],
+                                                   top_k=options["top_k"], workers=options["workers"])
+        self.stdout.write("Stored {} topic comparisons for {}".format(comparison.topics_measurement.count(),
+                                                                      comparison))
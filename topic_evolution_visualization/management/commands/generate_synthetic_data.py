@@ -0,0 +1,49 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from topic_evolution import settings
+from topic_evolution_visualization import synthetic
+from topic_evolution_visualization.models import LdaModel
+
+
+class Command(BaseCommand):
+    help = "Creates a synthetic LDA model, either written directly to the database or as a gensim model file to be " \
+           "ingested, optionally along with a comparison to another model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", help="Name of the synthetic LDA model")
+        parser.add_argument("--topics", type=int, default=100, help="Number of topics")
+        parser.add_argument("--vocabulary", type=int, default=10000, help="Number of terms")
+        parser.add_argument("--words-per-term", type=int, default=0,
+                            help="Original words of every term. Only used when writing to the database directly")
+        parser.add_argument("--gensim", action="store_true",
+                            help="Write a gensim model file in the synthetic directory of the resources, instead of "
+                                 "writing to the database")
+        parser.add_argument("--compare-to", help="Name of an LDA model to create a synthetic comparison with")
+        parser.add_argument("--density", type=float, default=0.1,
+                            help="Fraction of the topic pairs of the comparison stored as topic comparisons")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if LdaModel.objects.filter(name=options["name"]).exists():
+            raise CommandError("An LDA model named \"{}\" already exists".format(options["name"]))
+        if options["gensim"]:
+            path = synthetic.write_gensim_model(
+                os.path.join(settings.RESOURCES_DIRECTORY, "synthetic", "{}.lda".format(options["name"])),
+                options["topics"], options["vocabulary"], seed=options["seed"])
+            self.stdout.write("Wrote {}; add it as an LDA model to ingest it".format(path))
+            return
+
+        lda_model_obj = synthetic.create_model(options["name"], options["topics"], options["vocabulary"],
+                                               words_per_term=options["words_per_term"], seed=options["seed"])
+        self.stdout.write("Created {}".format(lda_model_obj))
+        if options["compare_to"]:
+            try:
+                other = LdaModel.objects.get(name=options["compare_to"], is_ingested=True)
+            except LdaModel.DoesNotExist:
+                raise CommandError("No ingested LDA model named \"{}\"".format(options["compare_to"]))
+            comparison = synthetic.create_comparison("{}-{}".format(other.name, lda_model_obj.name)[:30], other,
+                                                     lda_model_obj, density=options["density"], seed=options["seed"])
+            self.stdout.write("Stored {} topic comparisons for {}".format(comparison.topics_measurement.count(),
+                                                                          comparison))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from topic_evolution_visualization import words
+
+
+class Command(BaseCommand):
+    help = "Replaces the original words of the stemmed terms with the ones of a nonstemmed map file, whose lines are " \
+           "tab separated stemmed term, word and optional frequency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the nonstemmed map file")
+
+    def handle(self, *args, **options):
+        with open(options["path"], encoding="utf-8") as map_file:
+            stats = words.import_words(map_file)
+        self.stdout.write("Imported {words} words in {seconds:.2f}s: {inserted} inserted, {updated} updated, "
+                          "{deleted} deleted".format(**stats))
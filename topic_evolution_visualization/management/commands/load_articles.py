@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from topic_evolution_visualization import articles
+from topic_evolution_visualization.models import Corpus
+
+
+def read_records(lines):
+    # A corpus file holds a JSON object per line; authors may be given as a list
+    for line in lines:
+        if line.strip():
+            record = json.loads(line)
+            if isinstance(record.get("authors"), list):
+                record["authors"] = ", ".join(record["authors"])
+            yield record
+
+
+class Command(BaseCommand):
+    help = "Loads the articles of a corpus file, whose lines are JSON objects with an identifier, an abstract and " \
+           "optionally a title, year, authors and language, then computes their search vectors"
+
+    def add_arguments(self, parser):
+        parser.add_argument("corpus", help="Name of the corpus, created if it does not exist")
+        parser.add_argument("path", help="Path of the corpus file")
+        parser.add_argument("--description", default="", help="Description of a newly created corpus")
+
+    def handle(self, *args, **options):
+        corpus, _ = Corpus.objects.get_or_create(name=options["corpus"],
+                                                 defaults={"description": options["description"]})
+        with open(options["path"], encoding="utf-8") as corpus_file:
+            stats = articles.load_articles(corpus, read_records(corpus_file))
+        self.stdout.write("Loaded {articles} articles in {seconds:.2f}s: {written} written, {moved} scored articles "
+                          "changed year".format(**stats))
+        self.stdout.write("Computed {} search vectors".format(articles.update_search_vectors()))
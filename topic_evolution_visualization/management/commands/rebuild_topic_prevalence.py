@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from topic_evolution_visualization import prevalence
+from topic_evolution_visualization.models import LdaModel
+
+
+class Command(BaseCommand):
+    help = "Recomputes the yearly topic prevalence of an LDA model from the topics of the articles it has scored"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="Name of the LDA model")
+
+    def handle(self, *args, **options):
+        lda_model_obj = LdaModel.objects.filter(name=options["model"]).first()
+        if lda_model_obj is None:
+            raise CommandError("No LDA model named {}".format(options["model"]))
+        self.stdout.write("Stored {} topic-year rows".format(prevalence.rebuild_prevalence(lda_model_obj)))
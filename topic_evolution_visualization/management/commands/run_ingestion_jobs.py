@@ -0,0 +1,77 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+
+from topic_evolution import settings
+from topic_evolution_visualization import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs the pending LDA model ingestion jobs in a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.INGESTION_WORKERS,
+                            help="Number of worker processes")
+        parser.add_argument("--poll-interval", type=float, default=settings.INGESTION_POLL_INTERVAL,
+                            help="Seconds to wait between checks for new jobs")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit once there are no pending or running jobs instead of waiting for new ones")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        executor = self.create_executor(workers)
+        running = dict()
+        try:
+            while True:
+                requeued = jobs.requeue_stale_jobs()
+                if requeued:
+                    self.stdout.write("Resuming {} interrupted job(s)".format(requeued))
+
+                broken = False
+                for future in [future for future in running if future.done()]:
+                    broken |= self.finish(running.pop(future), future)
+                if broken:
+                    # Every job of a broken pool fails
+                    self.stderr.write("A worker process died, restarting the workers")
+                    wait(running)
+                    for future, job_pk in running.items():
+                        self.finish(job_pk, future)
+                    running.clear()
+                    executor.shutdown(wait=False)
+                    executor = self.create_executor(workers)
+
+                for job_pk in jobs.claim_pending_jobs(workers - len(running)):
+                    self.stdout.write("Starting job {}".format(job_pk))
+                    running[executor.submit(jobs.run_ingestion_job, job_pk)] = job_pk
+
+                if options["once"] and not running:
+                    break
+                time.sleep(options["poll_interval"])
+        finally:
+            executor.shutdown()
+
+    def finish(self, job_pk, future):
+        # Reports the outcome of a job and whether its worker process died, breaking the pool
+        try:
+            stats = future.result()
+        except Exception as error:
+            # The job never finished, so it could not record its failure itself
+            jobs.fail_job(job_pk)
+            self.stderr.write("Job {} failed: {!r}".format(job_pk, error))
+            return isinstance(error, BrokenProcessPool)
+        if stats is None:
+            self.stderr.write("Job {} failed".format(job_pk))
+        else:
+            self.stdout.write("Job {} done: {changed_topics} topics changed, {rows} rows written in "
+                              "{seconds:.2f}s ({rows_per_second:.0f} rows/s)".format(job_pk, **stats))
+        return False
+
+    @staticmethod
+    def create_executor(workers):
+        # Workers are spawned rather than forked so that they never share the database connection of this process
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=django.setup)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from topic_evolution import settings
+from topic_evolution_visualization import scoring
+from topic_evolution_visualization.models import Corpus, LdaModel
+
+
+class Command(BaseCommand):
+    help = "Infers the top topics of every article of a corpus with an LDA model. An interrupted run of the same " \
+           "scoring is resumed from its last checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="Name of the LDA model")
+        parser.add_argument("corpus", help="Name of the corpus")
+        parser.add_argument("--top-k", type=int, default=settings.SCORING_TOP_K, help="Topics stored per article")
+        parser.add_argument("--workers", type=int, default=settings.SCORING_WORKERS,
+                            help="Number of worker processes")
+        parser.add_argument("--batch-size", type=int, default=settings.SCORING_BATCH_SIZE,
+                            help="Articles inferred per batch")
+
+    def handle(self, *args, **options):
+        lda_model_obj = LdaModel.objects.filter(name=options["model"], is_ingested=True).first()
+        if lda_model_obj is None:
+            raise CommandError("No ingested LDA model named {}".format(options["model"]))
+        corpus = Corpus.objects.filter(name=options["corpus"]).first()
+        if corpus is None:
+            raise CommandError("No corpus named {}".format(options["corpus"]))
+        job = scoring.get_scoring_job(lda_model_obj, corpus, top_k=options["top_k"])
+        if job.last_article:
+            self.stdout.write("Resuming job {} after {} scored articles".format(job.pk, job.scored_articles))
+
+        def report_progress(scored):
+            self.stdout.write("{} articles scored".format(scored))
+
+        try:
+            stats = scoring.run_scoring_job(job.pk, workers=options["workers"], batch_size=options["batch_size"],
+                                            progress_callback=report_progress)
+        except ValueError as e:
+            raise CommandError(e)
+        if stats is None:
+            raise CommandError("Job {} failed; run the command again to resume it".format(job.pk))
+        self.stdout.write("Scored {articles} articles in {seconds:.2f}s ({articles_per_second:.0f} articles/s), "
+                          "{rows} rows written".format(**stats))
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+
+# Topic comparison metrics. This module is kept free of Django imports, as it is all that the spawned comparison worker
+# processes need to import
+
+SCORE, DISTANCE = 0, 1
+
+# Metric name: (type of comparison, lower bound, upper bound)
+METRICS = {
+    "hellinger": (DISTANCE, 0.0, 1.0),
+    "jensen_shannon": (DISTANCE, 0.0, 1.0),
+    "cosine": (SCORE, 0.0, 1.0),
+    "jaccard": (SCORE, 0.0, 1.0),
+}
+
+# Set in every worker process by init_worker
+_worker_matrices = None
+
+
+def init_worker(matrices):
+    global _worker_matrices
+    _worker_matrices = matrices
+
+
+def map_worker_matrices(directory):
+    # Worker processes memory-map the matrices saved to directory, rather than each receiving a pickled copy, so their
+    # pages are shared through the OS page cache
+    init_worker({name[:-len(".npy")]: np.load(os.path.join(directory, name), mmap_mode="r")
+                 for name in os.listdir(directory) if name.endswith(".npy")})
+
+
+def jensen_shannon_divergence(shared_0, shared_1, max_elements):
+    # Sums of the pointwise Jensen-Shannon terms of the shared terms of every pair of topics. Topics of the second model
+    # and terms are taken in chunks, so that no temporary holds more than max_elements values
+    rows, width = shared_0.shape
+    terms_per_chunk = max(1, min(width, max_elements // max(rows, 1)))
+    topics_per_chunk = max(1, max_elements // (rows * terms_per_chunk))
+    divergence = np.zeros((rows, len(shared_1)), dtype=np.float64)
+    for first_topic in range(0, len(shared_1), topics_per_chunk):
+        last_topic = first_topic + topics_per_chunk
+        for first_term in range(0, width, terms_per_chunk):
+            p = shared_0[:, None, first_term:first_term + terms_per_chunk]
+            q = shared_1[None, first_topic:last_topic, first_term:first_term + terms_per_chunk]
+            m = (p + q) / 2
+            with np.errstate(divide="ignore", invalid="ignore"):
+                divergence[:, first_topic:last_topic] += np.where(p > 0, p * np.log2(p / m), 0).sum(axis=2) + \
+                    np.where(q > 0, q * np.log2(q / m), 0).sum(axis=2)
+    return divergence
+
+
+def compare_block(metric, start, end, max_elements):
+    # Values of metric between topics [start, end) of the first model and every topic of the second one, no temporary
+    # holding more than about max_elements values
+    matrices = _worker_matrices
+    if metric == "jaccard":
+        incidence_0, incidence_1 = matrices["incidence_0"][start:end], matrices["incidence_1"]
+        intersections = incidence_0 @ incidence_1.T
+        unions = incidence_0.sum(axis=1)[:, None] + incidence_1.sum(axis=1)[None, :] - intersections
+        return intersections / np.maximum(unions, 1)
+
+    shared_0, shared_1 = matrices["shared_0"][start:end], matrices["shared_1"]
+    if metric == "hellinger":
+        # With normalized distributions, hellinger = sqrt(1 - Bhattacharyya coefficient), and the coefficient only sums
+        # over shared terms
+        coefficients = np.sqrt(shared_0) @ np.sqrt(shared_1).T
+        return np.sqrt(np.clip(1 - coefficients, 0, 1))
+    if metric == "cosine":
+        norms_0 = np.sqrt((shared_0 ** 2).sum(axis=1) + matrices["outside_squares_0"][start:end])
+        norms_1 = np.sqrt((shared_1 ** 2).sum(axis=1) + matrices["outside_squares_1"])
+        return (shared_0 @ shared_1.T) / np.maximum(np.outer(norms_0, norms_1), np.finfo(np.float64).tiny)
+    if metric == "jensen_shannon":
+        # Base 2 Jensen-Shannon distance. A term known to only one of the models adds half its probability to the
+        # divergence, the shared terms are compared pairwise
+        divergence = jensen_shannon_divergence(shared_0, shared_1, max_elements)
+        divergence += matrices["outside_mass_0"][start:end, None] + matrices["outside_mass_1"][None, :]
+        divergence /= 2
+        return np.sqrt(np.clip(divergence, 0, 1))
+    raise ValueError("Unknown metric \"{}\"".format(metric))
+
+
+def pruning_mask(values, type_of_comparison, threshold=None, top_k=None):
+    # Which topic pairs to keep: those at least as good as threshold and among the top_k best of their topic_1
+    keep = np.ones(values.shape, dtype=bool)
+    if threshold is not None:
+        keep &= values >= threshold if type_of_comparison == SCORE else values <= threshold
+    if top_k is not None and top_k < values.shape[0]:
+        ordering = -values if type_of_comparison == SCORE else values
+        best = np.argpartition(ordering, top_k - 1, axis=0)[:top_k]
+        top = np.zeros(values.shape, dtype=bool)
+        np.put_along_axis(top, best, True, axis=0)
+        keep &= top
+    return keep
@@ -0,0 +1,75 @@
+import collections
+import logging
+import os
+import threading
+
+import numpy as np
+from gensim import models
+
+from topic_evolution import settings
+from . import tfidf
+
+logger = logging.getLogger(__name__)
+
+# Loaded gensim models keyed by (absolute path, modification time), least recently used first
+_loaded_models = collections.OrderedDict()
+# Memory-mapped idf tables keyed the same way
+_loaded_idfs = dict()
+_lock = threading.Lock()
+
+
+def get_gensim_model(lda_model_obj):
+    # Models are memory-mapped, so the pages of their large arrays are shared through the OS page cache by every
+    # process that loads the same files
+    path = os.path.abspath(lda_model_obj.path)
+    key = (path, os.path.getmtime(path))
+    with _lock:
+        if key in _loaded_models:
+            _loaded_models.move_to_end(key)
+            return _loaded_models[key]
+
+        logger.info("Loading gensim model %s", path)
+        lda_model = models.LdaModel.load(path, mmap="r")
+        # Older versions of a replaced model file are never requested again
+        for stale_key in [loaded_key for loaded_key in _loaded_models if loaded_key[0] == path]:
+            del _loaded_models[stale_key]
+        _loaded_models[key] = lda_model
+        while len(_loaded_models) > settings.GENSIM_MODEL_CACHE_SIZE:
+            evicted_key, _ = _loaded_models.popitem(last=False)
+            logger.info("Evicting gensim model %s", evicted_key[0])
+        return lda_model
+
+
+def get_idf(lda_model_obj):
+    path = tfidf.idf_path(lda_model_obj)
+    key = (path, os.path.getmtime(path))
+    with _lock:
+        if key not in _loaded_idfs:
+            for stale_key in [loaded_key for loaded_key in _loaded_idfs if loaded_key[0] == path]:
+                del _loaded_idfs[stale_key]
+            _loaded_idfs[key] = np.load(path, mmap_mode="r")
+        return _loaded_idfs[key]
+
+
+def clear():
+    with _lock:
+        _loaded_models.clear()
+        _loaded_idfs.clear()
+
+
+def warm_up():
+    # Loads the main model, along with its indexes and cached topics, and the modules serving it ahead of the first
+    # request that needs them. Run before a preloading server forks its workers, it lets all of them share these pages
+    # copy-on-write instead of each loading its own copy
+    from . import evolution, inference, queries, similarity  # noqa: F401
+
+    main_model = queries.get_model()
+    if main_model is None:
+        return None
+    get_gensim_model(main_model)
+    if main_model.use_tfidf:
+        get_idf(main_model)
+    similarity.get_topic_index(main_model)
+    similarity.get_article_index(main_model)
+    queries.get_cached_topics_columns(main_model)
+    return main_model
@@ -1,5 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import connection
 from django.db import models
 
 from topic_evolution import settings
@@ -27,6 +28,15 @@ class LdaModel(models.Model):
     use_tfidf = models.BooleanField(default=False, help_text="Whether to use tf-idf vectorization for any custom text. "
                                                              "The tf-idf vectorization will be calculated with respect "
                                                              "to the term frequencies of the training corpus.")
+    is_ingested = models.BooleanField(default=False, editable=False,
+                                      help_text="Whether the topics of this model have been fully ingested")
+    data_version = models.PositiveIntegerField(default=0, editable=False,
+                                               help_text="Incremented whenever data presented for this model changes; "
+                                                         "used to version its cached representations.")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=("is_main",), condition=models.Q(is_main=True),
+                                               name="single_main_lda_model")]
 
     def __str__(self):
         return "Model {}({})".format(self.name, self.description) + (" - MAIN MODEL" if self.is_main else "")
@@ -37,17 +47,47 @@ class LdaModel(models.Model):
     #     return error_code
 
 
+class IngestionJob(models.Model):
+    PENDING, RUNNING, DONE, FAILED = range(4)
+
+    lda_model = models.ForeignKey(LdaModel, on_delete=models.CASCADE, related_name="ingestion_jobs")
+    status = models.SmallIntegerField(choices=((PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"),
+                                               (FAILED, "Failed")), default=PENDING)
+    total_topics = models.PositiveIntegerField(null=True, blank=True)
+    ingested_topics = models.PositiveIntegerField(default=0,
+                                                  help_text="Number of topics whose terms have been committed. A "
+                                                            "resumed job continues from this topic on.")
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    heartbeat = models.DateTimeField(null=True, blank=True,
+                                     help_text="Last time the worker running this job reported progress")
+
+    @property
+    def progress(self):
+        if not self.total_topics:
+            return 0.0
+        return 100 * self.ingested_topics / self.total_topics
+
+    def __str__(self):
+        return "Ingestion of {} - {}".format(self.lda_model.name, self.get_status_display())
+
+
 class Topic(models.Model):
     index = models.PositiveIntegerField()
     keyphrase = models.CharField(max_length=64, blank=True)
     parent_model = models.ForeignKey(LdaModel, on_delete=models.CASCADE, related_name="model_topics")
 
+    class Meta:
+        indexes = [models.Index(fields=("parent_model", "index"))]
+
     def __str__(self):
         return "Topic {} of model: {}".format(self.index, self.parent_model.name)
 
 
 class Term(models.Model):
     string = models.CharField(max_length=200, help_text="The actual term value", unique=True)
+    display_word = models.CharField(max_length=220, null=True, blank=True, editable=False,
+                                    help_text="The rank 1 original word of the term, if it has any")
     parent_topics = models.ManyToManyField(Topic, related_name="topic_terms", through="TopicTermDistribution")
 
     class Meta:
@@ -57,33 +97,38 @@ class Term(models.Model):
         return self.string
 
 
-# class Corpus(models.Model):
-#     name = models.CharField(max_length=32, verbose_name="Application-wide unique name identifying the corpus")
-#     description = models.CharField(max_length=64, verbose_name="A readable name/description for the corpus")
-#
-#
-# class Article(models.Model):
-#     identifier = models.CharField(max_length=100, verbose_name='Article identifier', unique=True)
-#     abstract = models.TextField(verbose_name="Abstract")
-#     title = models.CharField(max_length=500, verbose_name="Article title", blank=True)
-#     year = models.PositiveIntegerField(verbose_name="Year of publication", validators=(MinValueValidator(1930),),
-#                                        null=True, blank=True)
-#     authors = models.TextField(verbose_name="Authors and collaborators", blank=True)
-#     language = models.CharField(max_length=20, verbose_name="Language", blank=True)
-#
-#     corpus = models.ForeignKey(Corpus, on_delete=models.CASCADE)
-#
-#     topics = models.ManyToManyField(Topic, related_name="article_topics", through="ArticleTopicDistribution")
-#
-#     search_vector = SearchVectorField(null=True)
-#
-#     def __str__(self):
-#         return self.title if self.title != "" else self.identifier
-#
-#     class Meta:
-#         indexes = [GinIndex(fields=['search_vector']), models.Index(fields=['identifier'])]
-#
-#
+class Corpus(models.Model):
+    name = models.CharField(max_length=32, unique=True,
+                            verbose_name="Application-wide unique name identifying the corpus")
+    description = models.CharField(max_length=64, verbose_name="A readable name/description for the corpus")
+
+    def __str__(self):
+        return self.name
+
+
+class Article(models.Model):
+    identifier = models.CharField(max_length=100, verbose_name='Article identifier', unique=True)
+    abstract = models.TextField(verbose_name="Abstract")
+    title = models.CharField(max_length=500, verbose_name="Article title", blank=True)
+    year = models.PositiveIntegerField(verbose_name="Year of publication", validators=(MinValueValidator(1930),),
+                                       null=True, blank=True)
+    authors = models.TextField(verbose_name="Authors and collaborators", blank=True)
+    language = models.CharField(max_length=20, verbose_name="Language", blank=True)
+
+    corpus = models.ForeignKey(Corpus, on_delete=models.CASCADE, related_name="articles")
+
+    topics = models.ManyToManyField(Topic, related_name="article_topics", through="ArticleTopicDistribution")
+
+    # Weighted title and abstract lexemes; empty while an article waits for the next batch update
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    def __str__(self):
+        return self.title if self.title != "" else self.identifier
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector']), models.Index(fields=("corpus", "year"))]
+
+
 # class ReportedError(models.Model):
 #     article = models.OneToOneField(Article, on_delete=models.CASCADE)
 #     error_description = models.CharField(max_length=80)
@@ -99,18 +144,94 @@ class TopicTermDistribution(models.Model):
                                 help_text="The probability of the given term to exist in the given topic")
     rank = models.PositiveIntegerField(validators=(MinValueValidator(1),))
 
+    class Meta:
+        indexes = [models.Index(fields=("topic", "rank")), models.Index(fields=("topic", "value"))]
+
     def __str__(self):
         return "{} - {}, probability: {}".format(self.topic, self.term, self.value)
 
 
-# class ArticleTopicDistribution(models.Model):
-#     topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
-#     article = models.ForeignKey(Article, on_delete=models.CASCADE)
-#     rank = models.IntegerField(validators=(MinValueValidator(1),))
-#     value = models.DecimalField(max_digits=6, decimal_places=5, validators=(MinValueValidator(0), MaxValueValidator(1)))
-#
-#     def __str__(self):
-#         return "{} - {}, probability: {}".format(self.article, self.topic, self.value)
+class TopicTermRepresentation(models.Model):
+    # Read-optimized copy of a model's topic-term distributions, holding everything needed to present them
+    lda_model = models.ForeignKey(LdaModel, on_delete=models.CASCADE, related_name="topic_term_representations")
+    topic_index = models.PositiveIntegerField()
+    keyphrase = models.CharField(max_length=64, blank=True)
+    rank = models.PositiveIntegerField(validators=(MinValueValidator(1),))
+    term = models.ForeignKey(Term, on_delete=models.CASCADE, related_name="+")
+    display_term = models.CharField(max_length=220,
+                                    help_text="The term's most frequent original word, or the term itself if unknown")
+    value = models.DecimalField(max_digits=6, decimal_places=5,
+                                validators=(MinValueValidator(0), MaxValueValidator(1)))
+
+    class Meta:
+        indexes = [models.Index(fields=("lda_model", "topic_index", "rank"))]
+
+    def __str__(self):
+        return "{} - topic {} - {}, probability: {}".format(self.lda_model.name, self.topic_index, self.display_term,
+                                                            self.value)
+
+
+class ArticleTopicDistribution(models.Model):
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    article = models.ForeignKey(Article, on_delete=models.CASCADE)
+    rank = models.PositiveIntegerField(validators=(MinValueValidator(1),))
+    value = models.DecimalField(max_digits=6, decimal_places=5, validators=(MinValueValidator(0), MaxValueValidator(1)))
+
+    class Meta:
+        # The articles of a topic above a weight are read off the first index, the topics of an article off the second
+        indexes = [models.Index(fields=("topic", "-value")), models.Index(fields=("article", "rank"))]
+        constraints = [models.UniqueConstraint(fields=("article", "topic"), name="unique_article_topic")]
+
+    def __str__(self):
+        return "{} - {}, probability: {}".format(self.article, self.topic, self.value)
+
+
+class TopicYearPrevalence(models.Model):
+    # Aggregate of a model's article-topic distributions by topic and publication year, kept up to date as articles
+    # are scored
+    lda_model = models.ForeignKey(LdaModel, on_delete=models.CASCADE, related_name="topic_year_prevalences")
+    topic_index = models.PositiveIntegerField()
+    year = models.PositiveIntegerField()
+    doc_count = models.PositiveIntegerField(help_text="Number of articles of the year holding the topic")
+    weight_sum = models.FloatField(help_text="Sum of the topic's weights in the articles of the year")
+
+    class Meta:
+        # Its index returns every series of a model in a single scan, ordered by topic and year
+        constraints = [models.UniqueConstraint(fields=("lda_model", "topic_index", "year"),
+                                               name="unique_topic_year_prevalence")]
+
+    def __str__(self):
+        return "{} - topic {} - {}: {} articles".format(self.lda_model.name, self.topic_index, self.year,
+                                                       self.doc_count)
+
+
+class ScoringJob(models.Model):
+    PENDING, RUNNING, DONE, FAILED = range(4)
+
+    lda_model = models.ForeignKey(LdaModel, on_delete=models.CASCADE, related_name="scoring_jobs")
+    corpus = models.ForeignKey(Corpus, on_delete=models.CASCADE, related_name="scoring_jobs")
+    status = models.SmallIntegerField(choices=((PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"),
+                                               (FAILED, "Failed")), default=PENDING)
+    top_k = models.PositiveIntegerField(validators=(MinValueValidator(1),),
+                                        help_text="Number of most probable topics stored for every article")
+    total_articles = models.PositiveIntegerField(null=True, blank=True)
+    scored_articles = models.PositiveIntegerField(default=0)
+    last_article = models.PositiveIntegerField(default=0,
+                                               help_text="Primary key of the last article whose topics have been "
+                                                         "committed. A resumed job continues after it.")
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    heartbeat = models.DateTimeField(null=True, blank=True,
+                                     help_text="Last time the job reported progress")
+
+    @property
+    def progress(self):
+        if not self.total_articles:
+            return 0.0
+        return 100 * self.scored_articles / self.total_articles
+
+    def __str__(self):
+        return "Scoring of {} with {} - {}".format(self.corpus.name, self.lda_model.name, self.get_status_display())
 
 
 class Comparison(models.Model):
@@ -129,10 +250,31 @@ class Comparison(models.Model):
                                               "defined")
     lda_model_0 = models.ForeignKey(LdaModel, related_name="comparison_first_model", on_delete=models.CASCADE)
     lda_model_1 = models.ForeignKey(LdaModel, related_name="comparison_second_model", on_delete=models.CASCADE)
+    threshold = models.FloatField(blank=True, null=True,
+                                  help_text="Only topic pairs at least this good are stored as topic comparisons. "
+                                            "Leave empty to store every pair")
+    top_k = models.PositiveIntegerField(blank=True, null=True, validators=(MinValueValidator(1),),
+                                        help_text="Only the k best topic pairs of every topic of the second model "
+                                                  "are stored as topic comparisons. Leave empty to store every pair")
+    matrix = models.BinaryField(blank=True, null=True, editable=False,
+                                help_text="Every topic pair's value as a row-major float32 matrix, rows being the "
+                                          "topics of the first model and columns the topics of the second")
+    matrix_rows = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    matrix_columns = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    data_version = models.PositiveIntegerField(default=0, editable=False,
+                                               help_text="Incremented whenever the comparison changes; used to "
+                                                         "version its cached representations.")
 
     def __str__(self):
         return "{}: Comparing models {}, {}".format(self.name, self.lda_model_0.name, self.lda_model_1.name)
 
+    def get_matrix(self):
+        if self.matrix is None:
+            return None
+        import numpy as np
+
+        return np.frombuffer(self.matrix, dtype=np.float32).reshape(self.matrix_rows, self.matrix_columns)
+
 
 class TopicsComparison(models.Model):
     parent_comparison = models.ForeignKey(Comparison, related_name="topics_measurement", on_delete=models.CASCADE)
@@ -150,10 +292,8 @@ class Word(models.Model):
     rank = models.PositiveIntegerField()
     stemmed = models.ForeignKey(Term, on_delete=models.CASCADE, related_name="original_word")
 
+    class Meta:
+        indexes = [models.Index(fields=("stemmed", "rank"))]
+
     def __str__(self):
         return "{}".format(self.string)
-
-    @classmethod
-    def truncate(cls):
-        with connection.cursor() as cursor:
-            cursor.execute('TRUNCATE TABLE "{0}" CASCADE'.format(cls._meta.db_table))
@@ -0,0 +1,72 @@
+import functools
+import re
+import threading
+
+from gensim.parsing.preprocessing import STOPWORDS
+from nltk.stem import PorterStemmer
+
+# Distinct words stemmed by a preprocessor are memoized; a corpus vocabulary rarely exceeds this
+STEM_CACHE_SIZE = 2 ** 17
+
+
+class PreprocessingError(Exception):
+    pass
+
+
+class Preprocessor:
+    # A tokenize, stopword removal and stemming pipeline. Everything that does not depend on the text is prepared once,
+    # when the pipeline is built
+
+    def __init__(self, token_pattern, stopwords, stem=None, lowercase=True):
+        self.token_pattern = re.compile(token_pattern)
+        self.stopwords = frozenset(stopwords)
+        self.stem = functools.lru_cache(maxsize=STEM_CACHE_SIZE)(stem) if stem is not None else None
+        self.lowercase = lowercase
+
+    def __call__(self, text):
+        if self.lowercase:
+            text = text.lower()
+        stopwords = self.stopwords
+        tokens = [token for token in self.token_pattern.findall(text) if token not in stopwords]
+        if self.stem is None:
+            return tokens
+        stem = self.stem
+        return [stem(token) for token in tokens]
+
+    def iter_preprocess(self, texts):
+        # Lazily preprocesses any iterable of texts, generators included
+        for text in texts:
+            yield self(text)
+
+
+def build_default_preprocessor():
+    return Preprocessor(r"[a-z]{3,}", STOPWORDS, stem=PorterStemmer().stem)
+
+
+# Pipelines available to LdaModel.preprocessor_name, by the function building each of them
+PREPROCESSOR_BUILDERS = {
+    "default": build_default_preprocessor
+}
+
+_preprocessors = dict()
+_lock = threading.Lock()
+
+
+def get_preprocessor(name):
+    # Every pipeline is built once per process and shared afterwards
+    try:
+        return _preprocessors[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _preprocessors:
+            try:
+                builder = PREPROCESSOR_BUILDERS[name]
+            except KeyError:
+                raise PreprocessingError("Unknown preprocessor \"{}\"".format(name))
+            _preprocessors[name] = builder()
+        return _preprocessors[name]
+
+
+def preprocess_texts(name, texts):
+    return list(get_preprocessor(name).iter_preprocess(texts))
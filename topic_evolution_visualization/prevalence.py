@@ -0,0 +1,92 @@
+import collections
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from .models import ArticleTopicDistribution, TopicYearPrevalence
+
+
+def distribution_deltas(distributions, sign=1, deltas=None):
+    # Changes to the prevalence of every (topic index, year) brought by adding, or with sign -1 removing,
+    # (topic index, year, weight) article-topic distributions, accumulated onto deltas if given. Articles without a
+    # year are left out
+    if deltas is None:
+        deltas = collections.defaultdict(lambda: [0, 0.0])
+    for topic_index, year, value in distributions:
+        if year is not None:
+            delta = deltas[topic_index, year]
+            delta[0] += sign
+            delta[1] += sign * float(value)
+    return deltas
+
+
+def apply_deltas(lda_model_obj, deltas):
+    # Adds the given (topic index, year) changes to the prevalence of a model. Rows gaining articles are upserted; the
+    # others, which must exist, are updated, since a proposed row with a negative count fails its check constraint even
+    # when it conflicts. Rows no article counts towards any more are removed
+    if not deltas:
+        return
+    table = TopicYearPrevalence._meta.db_table
+    gaining = sorted(key for key, (doc_count, _) in deltas.items() if doc_count > 0)
+    losing = sorted(key for key, (doc_count, _) in deltas.items() if doc_count <= 0)
+
+    def columns(keys):
+        return [[topic_index for topic_index, _ in keys], [year for _, year in keys],
+                [deltas[key][0] for key in keys], [deltas[key][1] for key in keys]]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if gaining:
+            cursor.execute(
+                'INSERT INTO "{table}" (lda_model_id, topic_index, year, doc_count, weight_sum) '
+                'SELECT %s, * FROM unnest(%s::integer[], %s::integer[], %s::integer[], %s::double precision[]) '
+                'ON CONFLICT (lda_model_id, topic_index, year) DO UPDATE SET '
+                'doc_count = "{table}".doc_count + EXCLUDED.doc_count, '
+                'weight_sum = "{table}".weight_sum + EXCLUDED.weight_sum'.format(table=table),
+                [lda_model_obj.pk] + columns(gaining))
+        if losing:
+            cursor.execute(
+                'UPDATE "{table}" SET doc_count = "{table}".doc_count + deltas.doc_count, '
+                'weight_sum = "{table}".weight_sum + deltas.weight_sum '
+                'FROM unnest(%s::integer[], %s::integer[], %s::integer[], %s::double precision[]) '
+                'AS deltas (topic_index, year, doc_count, weight_sum) '
+                'WHERE "{table}".lda_model_id = %s AND "{table}".topic_index = deltas.topic_index '
+                'AND "{table}".year = deltas.year'.format(table=table), columns(losing) + [lda_model_obj.pk])
+            cursor.execute('DELETE FROM "{}" WHERE lda_model_id = %s AND doc_count = 0'.format(table),
+                           [lda_model_obj.pk])
+
+
+@transaction.atomic
+def rebuild_prevalence(lda_model_obj):
+    # Recomputes the prevalence of a model from all of its article-topic distributions, e.g. after the years of already
+    # scored articles changed
+    TopicYearPrevalence.objects.filter(lda_model=lda_model_obj).delete()
+    rows = ArticleTopicDistribution.objects.filter(topic__parent_model=lda_model_obj, article__year__isnull=False) \
+        .values("topic__index", "article__year").annotate(doc_count=Count("pk"), weight_sum=Sum("value")) \
+        .order_by()
+    return len(TopicYearPrevalence.objects.bulk_create(
+        [TopicYearPrevalence(lda_model=lda_model_obj, topic_index=row["topic__index"], year=row["article__year"],
+                             doc_count=row["doc_count"], weight_sum=float(row["weight_sum"])) for row in rows]))
+
+
+def get_prevalence_series(lda_model_obj):
+    # The yearly series of every topic of a model, aligned on the years any of them spans: the number of articles
+    # holding the topic, the sum of its weights and its share of the weights of the year
+    rows = list(TopicYearPrevalence.objects.filter(lda_model=lda_model_obj).order_by("topic_index", "year")
+                .values_list("topic_index", "year", "doc_count", "weight_sum"))
+    if not rows:
+        return {"years": [], "topics": []}
+    first_year = min(year for _, year, _, _ in rows)
+    years = list(range(first_year, max(year for _, year, _, _ in rows) + 1))
+    year_weights = [0.0] * len(years)
+    series = collections.OrderedDict()
+    for topic_index, year, doc_count, weight_sum in rows:
+        if topic_index not in series:
+            series[topic_index] = {"topic": topic_index, "doc_count": [0] * len(years),
+                                   "weight_sum": [0.0] * len(years)}
+        series[topic_index]["doc_count"][year - first_year] = doc_count
+        series[topic_index]["weight_sum"][year - first_year] = weight_sum
+        year_weights[year - first_year] += weight_sum
+    for topic in series.values():
+        topic["share"] = [weight_sum / total if total else 0.0
+                          for weight_sum, total in zip(topic["weight_sum"], year_weights)]
+    return {"years": years, "topics": list(series.values())}
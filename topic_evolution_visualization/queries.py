@@ -1,77 +1,232 @@
+import time
+
+from django.core.cache import cache
 from django.db.models import Q, F
 
-from .models import Topic, LdaModel
+from topic_evolution import settings
+from .instrumentation import span
+from .models import LdaModel, Topic, TopicsComparison, TopicTermRepresentation
+
+TOPICS_COLUMNS_CACHE_KEY = "topics-columns:{model_pk}:{data_version}"
+
+
+# The main model of this process and when it expires, as (expiry, model). Saving or deleting a model clears it, while
+# the expiry bounds how long changes made by other processes go unnoticed
+_main_model = (0.0, None)
 
 
 def get_model():
-    return LdaModel.objects.filter(is_main=True)[:1].union(LdaModel.objects.all().order_by("pk")[:1]).first()
+    # The main model or, failing that, the first one. Models still being ingested are never presented
+    global _main_model
+    expiry, lda_model = _main_model
+    now = time.monotonic()
+    if now < expiry:
+        return lda_model
+    lda_model = LdaModel.objects.filter(is_ingested=True).order_by("-is_main", "pk").first()
+    _main_model = (now + settings.MAIN_MODEL_CACHE_TIMEOUT, lda_model)
+    return lda_model
+
+
+def forget_model():
+    global _main_model
+    _main_model = (0.0, None)
+
+
+def get_cached_topics_columns(parent_model):
+    cache_key = TOPICS_COLUMNS_CACHE_KEY.format(model_pk=parent_model.pk, data_version=parent_model.data_version)
+    with span("topics_columns_cache"):
+        result = cache.get(cache_key)
+    if result is None:
+        result = cache_topics_columns(parent_model)
+    return result
+
+
+def cache_topics_columns(parent_model):
+    result = get_topics_columns(parent_model)
+    cache.set(TOPICS_COLUMNS_CACHE_KEY.format(model_pk=parent_model.pk, data_version=parent_model.data_version), result,
+              settings.TOPICS_TERMS_CACHE_TIMEOUT)
+    return result
+
+
+def get_topics_columns(parent_model):
+    # Every topic-term row of parent_model in columns: the topic indexes and keyphrases, the offsets of the terms of
+    # every topic, the term ids into a table of the displayed term strings and the term values
+    import numpy as np
+
+    with span("topics_columns_query"):
+        rows = list(topic_term_representations(parent_model).values_list("topic_index", "keyphrase", "display_term",
+                                                                         "value"))
+    topics, keyphrases, offsets, term_ids, terms = list(), list(), list(), list(), dict()
+    for position, (topic_index, keyphrase, display_term, _) in enumerate(rows):
+        if not topics or topics[-1] != topic_index:
+            topics.append(topic_index)
+            keyphrases.append(keyphrase)
+            offsets.append(position)
+        term_ids.append(terms.setdefault(display_term, len(terms)))
+    offsets.append(len(rows))
+    return {
+        "topics": np.array(topics, dtype=np.int32),
+        "keyphrases": keyphrases,
+        "offsets": np.array(offsets, dtype=np.int32),
+        "term_ids": np.array(term_ids, dtype=np.uint32),
+        "values": np.fromiter((value for _, _, _, value in rows), dtype=np.float32, count=len(rows)),
+        "terms": list(terms)
+    }
+
+
+def get_topics_columns_page(columns, after=-1, limit=None, top_n=None):
+    # The topics following the topic index after, up to limit of them, and their top_n terms, as columns whose term ids
+    # refer to a table of the terms of the page only, along with the index to continue from, if there are more
+    import numpy as np
 
+    limit = limit or settings.API_PAGE_SIZE
+    start = int(np.searchsorted(columns["topics"], after, side="right"))
+    end = min(start + limit, len(columns["topics"]))
+    starts, ends = columns["offsets"][start:end], columns["offsets"][start + 1:end + 1]
+    if top_n is not None:
+        ends = np.minimum(ends, starts + top_n)
+    lengths = ends - starts
+    # Positions of the kept terms of every topic, without a Python loop over topics
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    page_terms, term_ids = np.unique(columns["term_ids"][positions], return_inverse=True)
+    return {
+        "topics": columns["topics"][start:end],
+        "keyphrases": columns["keyphrases"][start:end],
+        "offsets": np.concatenate(([0], np.cumsum(lengths))).astype(np.int32),
+        "term_ids": term_ids.astype(np.uint32),
+        "values": columns["values"][positions],
+        "terms": [columns["terms"][term_id] for term_id in page_terms.tolist()]
+    }, (int(columns["topics"][end - 1]) if end < len(columns["topics"]) else None)
+
+
+def topic_term_representations(parent_model):
+    return TopicTermRepresentation.objects.filter(lda_model=parent_model).order_by("topic_index", "rank")
+
+
+def get_topics_terms_representation(parent_model, *topics, top_n=None):
+    # The terms of every topic of parent_model, or only of the given topics, identified either by index or by keyphrase.
+    # Only the top_n terms of each topic are fetched when it is given
+    query = topic_term_representations(parent_model)
+    if top_n is not None:
+        query = query.filter(rank__lte=top_n)
 
-def get_topics_terms_representation(parent_model, *topics):
     result = dict()
     if not topics:
-        query_result = Topic.objects.filter(
-            Q(topictermdistribution__term__original_word__rank=1) |
-            Q(topictermdistribution__term__original_word__isnull=True),
-            parent_model=parent_model,
-        ).annotate(
-            topic=F("index"),
-            term=F("topictermdistribution__term__string"),
-            word=F("topictermdistribution__term__original_word__string"),
-            value=F("topictermdistribution__value")
-        ).order_by(
-            "index",
-            "-value"
-        ).values("topic", "keyphrase", "term", "word", "value")
-
-        for topic_term in query_result:
-            topic = topic_term["keyphrase"] or topic_term["topic"]
-            # term_distribution = (topic_term["term"] or topic_term["word"], topic_term["value"])
+        with span("topics_terms_query"):
+            rows = list(query.values_list("topic_index", "keyphrase", "display_term", "value"))
+        for topic_index, keyphrase, display_term, value in rows:
+            topic = keyphrase or topic_index
             if topic not in result:
-                result[topic] = [
-                    {"topic": topic, "term": topic_term["term"] or topic_term["word"], "value": topic_term["value"]}
-                ]
-            else:
-                result[topic].append(
-                    {"topic": topic, "term": topic_term["term"] or topic_term["word"], "value": topic_term["value"]}
-                )
+                result[topic] = list()
+            result[topic].append({"topic": topic, "term": display_term, "value": value})
 
+        # Terms are read by rank, i.e. by descending value, but are presented by ascending value
         for topic in result:
-            result[topic] = sorted(result[topic], key=lambda td: td["value"], reverse=False)
+            result[topic].reverse()
 
     else:
-        for target_topic in topics:
-            if type(target_topic) is str:
-                query_result = Topic.objects.filter(
-                    Q(topictermdistribution__term__original_word__rank=1) |
-                    Q(topictermdistribution__term__original_word__isnull=True),
-                    parent_model=parent_model,
-                    keyphrase=target_topic
-                ).annotate(
-                    term=F("topictermdistribution__term__string"),
-                    word=F("topictermdistribution__term__original_word__string"),
-                    value=F("topictermdistribution__value")
-                ).order_by(
-                    "index",
-                    "-value"
-                ).values("term", "word", "value")
-            else:
-                query_result = Topic.objects.filter(
-                    Q(topictermdistribution__term__original_word__rank=1) |
-                    Q(topictermdistribution__term__original_word__isnull=True),
-                    parent_model=parent_model,
-                    index=target_topic
-                ).annotate(
-                    term=F("topictermdistribution__term__string"),
-                    word=F("topictermdistribution__term__original_word__string"),
-                    value=F("topictermdistribution__value")
-                ).order_by(
-                    "index",
-                    "-value"
-                ).values("term", "word", "value")
-
-            result[target_topic] = [
-                {"topic": target_topic, "term": res["term"] or res["word"], "value": res["value"]}
-                for res in query_result
-            ]
+        # Every requested topic is fetched by the same query, whether it is asked for by keyphrase or by index
+        keyphrases = {topic for topic in topics if type(topic) is str}
+        indexes = {topic for topic in topics if type(topic) is not str}
+        result = {topic: list() for topic in topics}
+        for topic_index, keyphrase, display_term, value in query.filter(
+                Q(topic_index__in=indexes) | Q(keyphrase__in=keyphrases)
+        ).values_list("topic_index", "keyphrase", "display_term", "value"):
+            if topic_index in indexes:
+                result[topic_index].append({"topic": topic_index, "term": display_term, "value": value})
+            if keyphrase in keyphrases:
+                result[keyphrase].append({"topic": keyphrase, "term": display_term, "value": value})
     return result
+
+
+def get_packed_values(comparison, columns=slice(None)):
+    # The given columns of the packed matrix of a comparison, or None if it has none. The pairs its threshold and top_k
+    # prune are NaN, as are those of topics changed by a re-ingestion, so that only the pairs stored as topic
+    # comparisons are ever served
+    matrix = comparison.get_matrix()
+    if matrix is None:
+        return None
+    block = matrix[:, columns]
+    if comparison.threshold is None and comparison.top_k is None:
+        return block
+    import numpy as np
+    from .metrics import pruning_mask
+
+    return np.where(pruning_mask(block, comparison.type_of_comparison, comparison.threshold, comparison.top_k), block,
+                    np.float32(np.nan))
+
+
+def get_topic_comparisons(comparison, topic_1_index, threshold=None, limit=None):
+    # The topics of the first model compared to a topic of the second, best first, optionally only those at least as
+    # good as threshold and up to limit of them. The packed matrix of the comparison is used when available, so only a
+    # single column of it is ever read
+    is_score = comparison.type_of_comparison == 0
+    column = get_packed_values(comparison, topic_1_index)
+    if column is not None:
+        import numpy as np
+
+        if threshold is not None:
+            candidates = np.nonzero(column >= threshold if is_score else column <= threshold)[0]
+        else:
+            candidates = np.nonzero(~np.isnan(column))[0]
+        candidates = candidates[np.argsort(-column[candidates] if is_score else column[candidates], kind="stable")]
+        return [{"topic_0": int(index), "topic_1": topic_1_index, "value": float(column[index])}
+                for index in candidates[:limit].tolist()]
+
+    query = TopicsComparison.objects.filter(parent_comparison=comparison, topic_1__index=topic_1_index)
+    if threshold is not None:
+        query = query.filter(**{"value__gte" if is_score else "value__lte": threshold})
+    query = query.order_by("-value" if is_score else "value").annotate(
+        topic_0_index=F("topic_0__index")
+    ).values("topic_0_index", "value")
+    if limit is not None:
+        query = query[:limit]
+    return [{"topic_0": row["topic_0_index"], "topic_1": topic_1_index, "value": row["value"]} for row in query]
+
+
+def get_topics_page(parent_model, after=-1, limit=None, top_n=None):
+    # The topics of parent_model following the topic index after, up to limit of them, along with the index to continue
+    # from, if there are more. The top_n terms of every topic, best first, are included when top_n is given
+    limit = limit or settings.API_PAGE_SIZE
+    topics = list(Topic.objects.filter(parent_model=parent_model, index__gt=after).order_by("index").values_list(
+        "index", "keyphrase")[:limit + 1])
+    next_cursor = topics[limit - 1][0] if len(topics) > limit else None
+    topics = [{"index": index, "keyphrase": keyphrase} for index, keyphrase in topics[:limit]]
+    if top_n is not None and topics:
+        terms = dict()
+        for topic_index, display_term, value in topic_term_representations(parent_model).filter(
+                topic_index__gte=topics[0]["index"], topic_index__lte=topics[-1]["index"], rank__lte=top_n
+        ).values_list("topic_index", "display_term", "value"):
+            terms.setdefault(topic_index, list()).append({"term": display_term, "value": float(value)})
+        for topic in topics:
+            topic["terms"] = terms.get(topic["index"], list())
+    return topics, next_cursor
+
+
+def get_comparison_edges_page(comparison, threshold=None, after=-1, limit=None):
+    # The topic comparisons at least as good as threshold of the topics of the second model following the topic index
+    # after, up to limit of these topics, along with the index to continue from, if there are more
+    limit = limit or settings.API_PAGE_SIZE
+    last = after + limit
+    is_score = comparison.type_of_comparison == 0
+    block = get_packed_values(comparison, slice(after + 1, last + 1))
+    if block is not None:
+        import numpy as np
+
+        mask = ~np.isnan(block) if threshold is None else block >= threshold if is_score else block <= threshold
+        indexes_0, indexes_1 = np.nonzero(mask)
+        edges = [{"topic_0": topic_0, "topic_1": topic_1 + after + 1, "value": value} for topic_0, topic_1, value in
+                 zip(indexes_0.tolist(), indexes_1.tolist(), block[mask].tolist())]
+        next_cursor = last if last + 1 < comparison.matrix_columns else None
+    else:
+        query = TopicsComparison.objects.filter(parent_comparison=comparison, topic_1__index__gt=after,
+                                                topic_1__index__lte=last)
+        if threshold is not None:
+            query = query.filter(**{"value__gte" if is_score else "value__lte": threshold})
+        edges = [{"topic_0": topic_0, "topic_1": topic_1, "value": value} for topic_0, topic_1, value in
+                 query.values_list("topic_0__index", "topic_1__index", "value")]
+        next_cursor = last if Topic.objects.filter(parent_model_id=comparison.lda_model_1_id,
+                                                   index__gt=last).exists() else None
+    # Edges are grouped by topic of the second model, best first
+    edges.sort(key=lambda edge: (edge["topic_1"], -edge["value"] if is_score else edge["value"], edge["topic_0"]))
+    return edges, next_cursor
@@ -0,0 +1,132 @@
+import collections
+import datetime
+import logging
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from topic_evolution import settings
+from . import prevalence, similarity
+from .bulk import copy_rows
+from .inference import chunked, infer_topics
+from .models import Article, ArticleTopicDistribution, ScoringJob, Topic
+from .preprocessing import preprocess_texts
+
+logger = logging.getLogger(__name__)
+
+
+def get_scoring_job(lda_model_obj, corpus, top_k=None):
+    # The latest unfinished job scoring corpus with the model for as many topics, to be resumed from its checkpoint, or
+    # a new job. A job still marked as running without a recent heartbeat belongs to a crashed run and is requeued
+    top_k = top_k or settings.SCORING_TOP_K
+    job = ScoringJob.objects.filter(lda_model=lda_model_obj, corpus=corpus, top_k=top_k) \
+        .exclude(status=ScoringJob.DONE).order_by("-created").first()
+    if job is None:
+        return ScoringJob.objects.create(lda_model=lda_model_obj, corpus=corpus, top_k=top_k)
+    stale_before = timezone.now() - datetime.timedelta(seconds=settings.SCORING_JOB_STALE_SECONDS)
+    if ScoringJob.objects.filter(pk=job.pk, status=ScoringJob.RUNNING, heartbeat__lt=stale_before) \
+            .update(status=ScoringJob.PENDING):
+        job.refresh_from_db()
+    return job
+
+
+def claim_scoring_job(job_pk):
+    # The conditional update makes sure a single run scores a job at a time
+    return bool(ScoringJob.objects.filter(pk=job_pk, status__in=(ScoringJob.PENDING, ScoringJob.FAILED))
+                .update(status=ScoringJob.RUNNING, error="", heartbeat=timezone.now()))
+
+
+def score_batch(lda_model_obj, top_k, documents):
+    # Runs in the worker processes. Each of them memory-maps the model once, so its arrays are shared through the OS
+    # page cache, and preprocesses its batch itself rather than through yet another pool
+    return list(infer_topics(lda_model_obj, documents, top_k=top_k, preprocess=preprocess_texts))
+
+
+def write_batch(job, topic_pks, results, years):
+    # The topics of a batch of articles replace any they had from the model, the model's prevalence by year follows and
+    # the checkpoint moves past them, all in the same transaction; a job interrupted at any point resumes without losing
+    # or duplicating rows
+    article_pks = [article_pk for article_pk, _ in results]
+    with transaction.atomic():
+        previous = ArticleTopicDistribution.objects.filter(article__in=article_pks, topic__parent_model=job.lda_model)
+        deltas = prevalence.distribution_deltas(previous.values_list("topic__index", "article__year", "value"),
+                                                sign=-1)
+        previous.delete()
+        rows = copy_rows(ArticleTopicDistribution, ("article", "topic", "rank", "value"),
+                         ((article_pk, topic_pks[topic_index], rank, round(value, 5))
+                          for article_pk, topics in results
+                          for rank, (topic_index, value) in enumerate(topics, start=1)))
+        prevalence.distribution_deltas(((topic_index, years[article_pk], round(value, 5))
+                                        for article_pk, topics in results for topic_index, value in topics),
+                                       deltas=deltas)
+        prevalence.apply_deltas(job.lda_model, deltas)
+        ScoringJob.objects.filter(pk=job.pk).update(last_article=article_pks[-1],
+                                                    scored_articles=F("scored_articles") + len(article_pks),
+                                                    heartbeat=timezone.now())
+    return rows
+
+
+def run_scoring_job(job_pk, workers=None, batch_size=None, progress_callback=None):
+    # Infers the top topics of every article of the job's corpus after its checkpoint. Articles are streamed in primary
+    # key order through a server-side cursor and their batches are inferred by a pool of spawned workers, with a bounded
+    # number of batches in flight; results are written back in order, so the checkpoint only ever moves forward.
+    # Raises ValueError if the job is done or already being run
+    started = time.perf_counter()
+    workers = workers or settings.SCORING_WORKERS
+    batch_size = batch_size or settings.SCORING_BATCH_SIZE
+    if not claim_scoring_job(job_pk):
+        raise ValueError("Scoring job {} is done or already running".format(job_pk))
+    job = ScoringJob.objects.select_related("lda_model", "corpus").get(pk=job_pk)
+    topic_pks = dict(Topic.objects.filter(parent_model=job.lda_model).values_list("index", "pk"))
+    ScoringJob.objects.filter(pk=job_pk).update(total_articles=job.corpus.articles.count())
+    articles = Article.objects.filter(corpus=job.corpus, pk__gt=job.last_article).order_by("pk") \
+        .values_list("pk", "abstract", "year").iterator(chunk_size=batch_size)
+    years = dict()
+    scored, rows = 0, 0
+
+    def documents():
+        # Years stay in this process until the articles they belong to are written
+        for article_pk, abstract, year in articles:
+            years[article_pk] = year
+            yield article_pk, abstract
+
+    def write(results):
+        nonlocal scored, rows
+        rows += write_batch(job, topic_pks, results, years)
+        for article_pk, _ in results:
+            del years[article_pk]
+        scored += len(results)
+        if progress_callback is not None:
+            progress_callback(scored)
+
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=django.setup) as executor:
+                pending = collections.deque()
+                for batch in chunked(documents(), batch_size):
+                    pending.append(executor.submit(score_batch, job.lda_model, job.top_k, batch))
+                    if len(pending) >= workers * settings.SCORING_QUEUED_BATCHES:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+        else:
+            for batch in chunked(documents(), batch_size):
+                write(score_batch(job.lda_model, job.top_k, batch))
+    except Exception:
+        logger.exception("Scoring job %d failed", job_pk)
+        ScoringJob.objects.filter(pk=job_pk).update(status=ScoringJob.FAILED, error=traceback.format_exc())
+        return None
+    ScoringJob.objects.filter(pk=job_pk).update(status=ScoringJob.DONE, heartbeat=timezone.now())
+    similarity.build_article_index(job.lda_model)
+    elapsed = time.perf_counter() - started
+    logger.info("Scored %d articles of corpus %s with model %s in %.2fs", scored, job.corpus.name, job.lda_model.name,
+                elapsed)
+    return {"articles": scored, "rows": rows, "seconds": elapsed,
+            "articles_per_second": scored / elapsed if elapsed else 0.0}
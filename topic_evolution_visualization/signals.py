@@ -0,0 +1,57 @@
+from django.db.models import F, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import queries
+from .articles import article_search_vector
+from .models import LdaModel, Topic, Term, Word, TopicTermRepresentation, Comparison, Article
+
+
+# Every cached representation of a model is keyed by its data_version, so bumping the version is enough to invalidate
+# them; stale entries simply expire from the cache.
+@receiver(pre_save, sender=LdaModel)
+@receiver(pre_save, sender=Comparison)
+def bump_model_version(sender, instance, **kwargs):
+    instance.data_version += 1
+
+
+@receiver(pre_save, sender=LdaModel)
+def demote_main_model(sender, instance, **kwargs):
+    # There is a single main model; a model set as main takes the place of the previous one
+    if instance.is_main:
+        LdaModel.objects.filter(is_main=True).exclude(pk=instance.pk).update(is_main=False)
+
+
+@receiver(post_save, sender=LdaModel)
+@receiver(post_delete, sender=LdaModel)
+def forget_main_model(sender, instance, **kwargs):
+    queries.forget_model()
+
+
+@receiver(post_save, sender=Topic)
+def update_topic_keyphrase(sender, instance, **kwargs):
+    TopicTermRepresentation.objects.filter(lda_model=instance.parent_model_id, topic_index=instance.index) \
+        .exclude(keyphrase=instance.keyphrase).update(keyphrase=instance.keyphrase)
+    LdaModel.objects.filter(pk=instance.parent_model_id).update(data_version=F("data_version") + 1)
+    queries.forget_model()
+
+
+@receiver(post_save, sender=Word)
+@receiver(post_delete, sender=Word)
+def update_display_terms(sender, instance, **kwargs):
+    # The rank 1 word of a term is what gets displayed for it, by the topics of every model
+    rank_1_word = Word.objects.filter(stemmed=instance.stemmed_id, rank=1).values("string")[:1]
+    Term.objects.filter(pk=instance.stemmed_id).update(display_word=Subquery(rank_1_word))
+    TopicTermRepresentation.objects.filter(term=instance.stemmed_id).update(
+        display_term=Coalesce(Subquery(rank_1_word),
+                              Subquery(Term.objects.filter(pk=instance.stemmed_id).values("string")[:1]))
+    )
+    LdaModel.objects.update(data_version=F("data_version") + 1)
+    queries.forget_model()
+
+
+@receiver(post_save, sender=Article)
+def update_search_vector(sender, instance, **kwargs):
+    # Articles saved one at a time get their search vector right away; bulk-loaded ones get it in batches
+    Article.objects.filter(pk=instance.pk).update(search_vector=article_search_vector())
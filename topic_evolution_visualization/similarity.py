@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from topic_evolution import settings
+from .models import ArticleTopicDistribution
+
+logger = logging.getLogger(__name__)
+
+# Loaded indexes keyed by (path, modification time); a rebuilt index file is picked up on its next use
+_loaded_indexes = dict()
+_lock = threading.Lock()
+
+
+def topic_index_path(lda_model_obj):
+    return os.path.abspath(lda_model_obj.path) + ".topic_similarity.npy"
+
+
+def article_index_path(lda_model_obj):
+    return os.path.abspath(lda_model_obj.path) + ".article_index.npz"
+
+
+def save_atomically(path, save):
+    # Readers of the previous file never see a partially written one
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as index_file:
+        save(index_file)
+    os.replace(temporary_path, path)
+
+
+def build_topic_index(lda_model_obj, lda_model):
+    # Stores next to the model file the cosine similarity of every pair of its topics, as a float32 topics x topics
+    # matrix. The normalized topic-term distributions are never held whole: the Gram matrix is accumulated over blocks
+    # of terms, so a memory-mapped state is read a block at a time
+    started = time.perf_counter()
+    state = lda_model.state
+    eta = np.asarray(state.eta)
+    num_topics, num_terms = state.sstats.shape
+    block_size = max(1, settings.SIMILARITY_BLOCK_ELEMENTS // num_topics)
+
+    def term_block(start, end):
+        return state.sstats[:, start:end] + (eta[..., start:end] if eta.ndim else eta)
+
+    blocks = [(start, min(start + block_size, num_terms)) for start in range(0, num_terms, block_size)]
+    sums = np.zeros(num_topics, dtype=np.float64)
+    for start, end in blocks:
+        sums += term_block(start, end).sum(axis=1)
+    squares = np.zeros(num_topics, dtype=np.float64)
+    for start, end in blocks:
+        squares += ((term_block(start, end) / sums[:, None]) ** 2).sum(axis=1)
+    scale = (1 / (sums * np.sqrt(squares)))[:, None]
+    similarities = np.zeros((num_topics, num_topics), dtype=np.float32)
+    for start, end in blocks:
+        block = (term_block(start, end) * scale).astype(np.float32)
+        similarities += block @ block.T
+    save_atomically(topic_index_path(lda_model_obj), lambda index_file: np.save(index_file, similarities))
+    logger.info("Model %s: topic similarity index of %d topics built in %.2fs", lda_model_obj.name, num_topics,
+                time.perf_counter() - started)
+    return similarities
+
+
+def build_article_index(lda_model_obj):
+    # Stores next to the model file the topic vectors of every article the model has scored, L2 normalized, both by
+    # article and inverted by topic: the articles sharing a topic with a query article are read off the postings of its
+    # few topics instead of comparing it with every article
+    started = time.perf_counter()
+    rows = ArticleTopicDistribution.objects.filter(topic__parent_model=lda_model_obj).order_by("article", "rank") \
+        .values_list("article_id", "topic__index", "value").iterator(chunk_size=50000)
+    article_pks, topic_indexes, values = list(), list(), list()
+    for article_pk, topic_index, value in rows:
+        article_pks.append(article_pk)
+        topic_indexes.append(topic_index)
+        values.append(value)
+    article_pks = np.array(article_pks, dtype=np.int64)
+    row_topics = np.array(topic_indexes, dtype=np.int32)
+    row_values = np.array(values, dtype=np.float32)
+
+    articles, row_lengths = np.unique(article_pks, return_counts=True)
+    entry_rows = np.repeat(np.arange(len(articles), dtype=np.int32), row_lengths)
+    norms = np.sqrt(np.bincount(entry_rows, weights=row_values.astype(np.float64) ** 2, minlength=len(articles)))
+    row_values /= np.where(norms > 0, norms, 1)[entry_rows].astype(np.float32)
+    num_topics = lda_model_obj.model_topics.count()
+    order = np.argsort(row_topics, kind="stable")
+    index = {
+        "articles": articles,
+        "row_offsets": np.concatenate(([0], np.cumsum(row_lengths))).astype(np.int64),
+        "row_topics": row_topics,
+        "row_values": row_values,
+        "topic_offsets": np.concatenate(([0], np.cumsum(np.bincount(row_topics, minlength=num_topics)))).astype(
+            np.int64),
+        "topic_rows": entry_rows[order],
+        "topic_values": row_values[order]
+    }
+    save_atomically(article_index_path(lda_model_obj), lambda index_file: np.savez(index_file, **index))
+    logger.info("Model %s: article similarity index of %d articles built in %.2fs", lda_model_obj.name, len(articles),
+                time.perf_counter() - started)
+    return index
+
+
+def load_index(path, load):
+    try:
+        key = (path, os.path.getmtime(path))
+    except OSError:
+        return None
+    with _lock:
+        if key not in _loaded_indexes:
+            for stale_key in [loaded_key for loaded_key in _loaded_indexes if loaded_key[0] == path]:
+                del _loaded_indexes[stale_key]
+            _loaded_indexes[key] = load(path)
+        return _loaded_indexes[key]
+
+
+def get_topic_index(lda_model_obj):
+    return load_index(topic_index_path(lda_model_obj), lambda path: np.load(path, mmap_mode="r"))
+
+
+def get_article_index(lda_model_obj):
+    def load(path):
+        with np.load(path) as index_file:
+            return dict(index_file)
+
+    return load_index(article_index_path(lda_model_obj), load)
+
+
+def top_k(candidates, scores, k):
+    # The k best scoring candidates, best first
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        candidates, scores = candidates[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    return list(zip(candidates[order].tolist(), scores[order].tolist()))
+
+
+def similar_topics(lda_model_obj, topic_index, k=None):
+    # The k topics of the same model most similar to the given one, as (topic index, cosine similarity), or None if the
+    # model has no topic index
+    similarities = get_topic_index(lda_model_obj)
+    if similarities is None or not 0 <= topic_index < len(similarities):
+        return None
+    scores = np.array(similarities[topic_index], dtype=np.float32)
+    scores[topic_index] = -np.inf
+    candidates = np.arange(len(scores))
+    return top_k(candidates[np.isfinite(scores)], scores[np.isfinite(scores)], k or settings.SIMILARITY_TOP_K)
+
+
+def similar_articles(lda_model_obj, article_pk, k=None):
+    # The k articles whose topics under the model are most similar to the given article's, as (article primary key,
+    # cosine similarity), or None if the model has no article index or has not scored the article. Only the articles
+    # sharing a topic with it can score above zero, so only they are scored
+    index = get_article_index(lda_model_obj)
+    if index is None:
+        return None
+    articles = index["articles"]
+    row = int(np.searchsorted(articles, article_pk))
+    if row == len(articles) or articles[row] != article_pk:
+        return None
+    start, end = index["row_offsets"][row], index["row_offsets"][row + 1]
+    topic_offsets = index["topic_offsets"]
+    postings = [(topic_offsets[topic_index], topic_offsets[topic_index + 1], weight)
+                for topic_index, weight in zip(index["row_topics"][start:end].tolist(),
+                                               index["row_values"][start:end].tolist())]
+    if not postings:
+        return []
+    rows = np.concatenate([index["topic_rows"][first:last] for first, last, _ in postings])
+    contributions = np.concatenate([weight * index["topic_values"][first:last] for first, last, weight in postings])
+    candidates, positions = np.unique(rows, return_inverse=True)
+    scores = np.bincount(positions, weights=contributions).astype(np.float32)
+    keep = candidates != row
+    return [(int(articles[candidate]), score)
+            for candidate, score in top_k(candidates[keep], scores[keep], k or settings.SIMILARITY_TOP_K)]
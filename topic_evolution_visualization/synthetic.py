@@ -0,0 +1,122 @@
+import os
+import string
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Concat
+
+from topic_evolution import settings
+from .bulk import copy_rows
+from .models import LdaModel, Topic, Term, TopicTermDistribution, TopicTermRepresentation, Word, Comparison
+
+# Synthetic terms are spelled with this prefix, so that they never collide with real ones and can be cleaned up
+TERM_PREFIX = "zyn"
+
+
+def synthetic_terms(vocabulary_size):
+    # Distinct lowercase strings, the base 26 spelling of their index
+    terms = list()
+    for index in range(vocabulary_size):
+        letters = ""
+        while True:
+            index, remainder = divmod(index, 26)
+            letters = string.ascii_lowercase[remainder] + letters
+            if not index:
+                break
+        terms.append(TERM_PREFIX + letters)
+    return terms
+
+
+def topic_term_weights(num_topics, vocabulary_size, generator):
+    # Sparse-looking topics: a few terms of every topic carry most of its mass, as in trained models
+    weights = generator.gamma(0.1, size=(num_topics, vocabulary_size))
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def write_gensim_model(path, num_topics, vocabulary_size, seed=0):
+    # A gensim LdaModel file with random topics over a synthetic vocabulary, ready to be ingested
+    from gensim.corpora import Dictionary
+    from gensim.models import LdaModel as GensimLdaModel
+
+    generator = np.random.default_rng(seed)
+    dictionary = Dictionary([synthetic_terms(vocabulary_size)])
+    dictionary.num_docs = 1000
+    dictionary.dfs = dict(enumerate(generator.integers(1, dictionary.num_docs, size=vocabulary_size).tolist()))
+    lda_model = GensimLdaModel(id2word=dictionary, num_topics=num_topics, random_state=seed)
+    lda_model.state.sstats = (1000 * topic_term_weights(num_topics, vocabulary_size, generator)).astype(lda_model.dtype)
+    lda_model.sync_state()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    lda_model.save(path)
+    return path
+
+
+@transaction.atomic
+def create_model(name, num_topics, vocabulary_size, words_per_term=0, is_main=False, seed=0):
+    # An ingested LdaModel whose topics, terms and words are written directly, without any gensim model behind it
+    generator = np.random.default_rng(seed)
+    topn = min(settings.TOP_N_TOPIC_TERMS, vocabulary_size)
+    lda_model_obj = LdaModel.objects.create(
+        name=name, is_main=is_main, is_ingested=True, description="Synthetic model",
+        path=os.path.join(settings.RESOURCES_DIRECTORY, "synthetic", "{}.lda".format(name)))
+
+    terms = synthetic_terms(vocabulary_size)
+    Term.objects.bulk_create([Term(string=term) for term in terms], ignore_conflicts=True, batch_size=10000)
+    term_ids = dict(Term.objects.filter(string__startswith=TERM_PREFIX).values_list("string", "pk"))
+    term_pks = [term_ids[term] for term in terms]
+    # The words of a term are the term followed by their rank
+    if words_per_term and not Word.objects.filter(stemmed=term_pks[0]).exists():
+        copy_rows(Word, ("string", "rank", "stemmed"),
+                  ((term + str(rank), rank, term_pk)
+                   for term, term_pk in zip(terms, term_pks) for rank in range(1, words_per_term + 1)))
+        Term.objects.filter(string__startswith=TERM_PREFIX).update(display_word=Concat("string", Value("1")))
+    display_words = dict(Term.objects.filter(string__startswith=TERM_PREFIX).values_list("string", "display_word"))
+    display_terms = [display_words[term] or term for term in terms]
+
+    Topic.objects.bulk_create([Topic(index=index, parent_model=lda_model_obj) for index in range(num_topics)])
+    topic_ids = dict(Topic.objects.filter(parent_model=lda_model_obj).values_list("index", "pk"))
+    weights = topic_term_weights(num_topics, vocabulary_size, generator)
+    top = np.argsort(-weights, axis=1)[:, :topn]
+    values = np.round(np.take_along_axis(weights, top, axis=1), 5)
+    rows = [(topic_index, rank, term_index, value)
+            for topic_index in range(num_topics)
+            for rank, (term_index, value) in enumerate(zip(top[topic_index].tolist(), values[topic_index].tolist()),
+                                                       start=1)]
+    copy_rows(TopicTermDistribution, ("topic", "term", "value", "rank"),
+              ((topic_ids[topic_index], term_pks[term_index], value, rank)
+               for topic_index, rank, term_index, value in rows))
+    copy_rows(TopicTermRepresentation, ("lda_model", "topic_index", "keyphrase", "rank", "term", "display_term",
+                                        "value"),
+              ((lda_model_obj.pk, topic_index, "", rank, term_pks[term_index], display_terms[term_index], value)
+               for topic_index, rank, term_index, value in rows))
+    return lda_model_obj
+
+
+def create_comparison(name, lda_model_obj_0, lda_model_obj_1, density=0.1, seed=0):
+    # A score comparison of random values between two models, storing about density of the topic pairs as topic
+    # comparisons
+    from .comparisons import store_comparison
+
+    generator = np.random.default_rng(seed)
+    num_topics_0 = lda_model_obj_0.model_topics.count()
+    num_topics_1 = lda_model_obj_1.model_topics.count()
+    with transaction.atomic():
+        comparison, _ = Comparison.objects.defer("matrix").update_or_create(name=name, defaults={
+            "description": "Synthetic comparison",
+            "type_of_comparison": 0,
+            "lower_bound": 0.0,
+            "upper_bound": 1.0,
+            "lda_model_0": lda_model_obj_0,
+            "lda_model_1": lda_model_obj_1,
+            "threshold": 1.0 - density,
+            "top_k": None
+        })
+        store_comparison(comparison, generator.random((num_topics_0, num_topics_1), dtype=np.float32))
+    return comparison
+
+
+def delete_synthetic_data(*names):
+    # Deletes the named synthetic models, along with their topics and comparisons, and the synthetic terms no longer
+    # used by any model
+    LdaModel.objects.filter(name__in=names).delete()
+    Term.objects.filter(string__startswith=TERM_PREFIX, topictermdistribution__isnull=True).delete()
@@ -1,3 +1,902 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.core.management import call_command
+from django.db import connection, IntegrityError
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from topic_evolution import settings
+
+from . import articles, comparisons, evolution, inference, ingestion, jobs, model_registry, prevalence, queries, \
+    scoring, similarity, synthetic, tfidf, words
+from .ingestion import ingest_lda_model
+from .models import LdaModel, Topic, Term, TopicTermDistribution, TopicTermRepresentation, Word, Corpus, Article, \
+    ArticleTopicDistribution, ScoringJob, Comparison, TopicsComparison, IngestionJob
+
+
+def create_topic_terms(lda_model, topic_index, terms, keyphrase=""):
+    topic = Topic.objects.create(index=topic_index, parent_model=lda_model, keyphrase=keyphrase)
+    for rank, (string, value) in enumerate(terms, start=1):
+        term, _ = Term.objects.get_or_create(string=string)
+        TopicTermDistribution.objects.create(topic=topic, term=term, value=value, rank=rank)
+        TopicTermRepresentation.objects.create(lda_model=lda_model, topic_index=topic_index, keyphrase=keyphrase,
+                                               rank=rank, term=term, display_term=string, value=value)
+    return topic
+
+
+class TopicsTermsRepresentationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=True, is_ingested=True, path="model.lda",
+                                                description="Model")
+        create_topic_terms(cls.lda_model, 0, [("network", 0.3), ("learn", 0.2), ("deep", 0.1)])
+        create_topic_terms(cls.lda_model, 1, [("galaxi", 0.4), ("star", 0.25)], keyphrase="astronomy")
+
+    def test_terms_are_presented_by_ascending_value(self):
+        representation = queries.get_topics_terms_representation(self.lda_model)
+        self.assertEqual([term["term"] for term in representation[0]], ["deep", "learn", "network"])
+
+    def test_topics_are_labeled_by_keyphrase(self):
+        representation = queries.get_topics_terms_representation(self.lda_model)
+        self.assertEqual(set(representation), {0, "astronomy"})
+
+    def test_requested_topics_are_fetched_by_index_and_keyphrase(self):
+        with self.assertNumQueries(1):
+            representation = queries.get_topics_terms_representation(self.lda_model, 0, "astronomy", 7, top_n=2)
+        self.assertEqual([term["term"] for term in representation[0]], ["network", "learn"])
+        self.assertEqual([term["term"] for term in representation["astronomy"]], ["galaxi", "star"])
+        self.assertEqual(representation[7], [])
+        self.assertEqual(queries.get_topics_terms_representation(self.lda_model, 1)[1][0]["term"], "galaxi")
+
+    def test_keyphrase_change_is_presented(self):
+        topic = Topic.objects.get(parent_model=self.lda_model, index=0)
+        topic.keyphrase = "machine learning"
+        topic.save()
+        self.assertIn("machine learning", queries.get_topics_terms_representation(self.lda_model))
+
+    def test_rank_1_word_is_displayed(self):
+        term = Term.objects.get(string="galaxi")
+        Word.objects.create(string="galaxies", rank=2, stemmed=term)
+        Word.objects.create(string="galaxy", rank=1, stemmed=term)
+        representation = queries.get_topics_terms_representation(self.lda_model)
+        self.assertEqual(representation["astronomy"][-1]["term"], "galaxy")
+
+
+class MainModelTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=False, is_ingested=True, path="model.lda",
+                                                description="Model")
+        cls.main_model = LdaModel.objects.create(name="main", is_main=True, is_ingested=True, path="main.lda",
+                                                 description="Main model")
+        create_topic_terms(cls.main_model, 0, [("network", 0.3)])
+
+    def setUp(self):
+        queries.forget_model()
+
+    def test_main_model_is_resolved_without_queries(self):
+        self.assertEqual(queries.get_model(), self.main_model)
+        self.client.get(reverse("home"))
+        with self.assertNumQueries(0):
+            self.assertEqual(queries.get_model(), self.main_model)
+            self.client.get(reverse("home"))
+
+    def test_new_main_model_replaces_the_previous_one(self):
+        self.assertEqual(queries.get_model(), self.main_model)
+        self.lda_model.is_main = True
+        self.lda_model.save()
+        self.assertEqual(queries.get_model(), self.lda_model)
+        self.assertFalse(LdaModel.objects.get(pk=self.main_model.pk).is_main)
+
+    def test_single_main_model_is_enforced(self):
+        with self.assertRaises(IntegrityError):
+            LdaModel.objects.filter(pk=self.lda_model.pk).update(is_main=True)
+
+
+class InstrumentationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=True, is_ingested=True, path="model.lda",
+                                                description="Model")
+        create_topic_terms(cls.lda_model, 0, [("network", 0.3)])
+
+    def setUp(self):
+        queries.forget_model()
+
+    @mock.patch.object(settings, "INSTRUMENTATION_SAMPLE_RATE", 1.0)
+    @mock.patch.object(settings, "INSTRUMENTATION_METRICS_ENABLED", True)
+    def test_sampled_requests_are_timed(self):
+        response = self.client.get(reverse("home"))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", .*render;dur=')
+        metrics = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('topic_evolution_request_duration_seconds_bucket{view="home",le="+Inf"}', metrics)
+        self.assertIn('topic_evolution_span_count_total{span="render"}', metrics)
+
+    @mock.patch.object(settings, "INSTRUMENTATION_SAMPLE_RATE", 0.0)
+    def test_requests_out_of_the_sample_are_not_timed(self):
+        self.assertNotIn("Server-Timing", self.client.get(reverse("home")))
+
+    @mock.patch.object(settings, "INSTRUMENTATION_SAMPLE_RATE", 1.0)
+    def test_rendering_is_timed_for_every_view(self):
+        self.assertIn("render;dur=", self.client.get(reverse("admin:login"))["Server-Timing"])
+
+    def test_metrics_are_only_served_locally_once_enabled(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+        with mock.patch.object(settings, "INSTRUMENTATION_METRICS_ENABLED", True):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+            self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1").status_code, 404)
+
+
+class ReadApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=True, is_ingested=True, path="model.lda",
+                                                description="Model")
+        for topic_index in range(3):
+            create_topic_terms(cls.lda_model, topic_index, [("term{}".format(topic_index), 0.5), ("common", 0.25)])
+
+    def test_topics_are_paginated_by_cursor(self):
+        url = reverse("api_model_topics", args=("model",))
+        page = self.client.get(url, {"limit": 2, "top": 1}).json()
+        self.assertEqual([topic["index"] for topic in page["topics"]], [0, 1])
+        self.assertEqual(page["topics"][1]["terms"], [{"term": "term1", "value": 0.5}])
+        page = self.client.get(url, {"limit": 2, "cursor": page["next_cursor"]}).json()
+        self.assertEqual([topic["index"] for topic in page["topics"]], [2])
+        self.assertIsNone(page["next_cursor"])
+
+    def test_unchanged_model_is_not_modified(self):
+        url = reverse("api_topic_terms", args=(1,))
+        response = self.client.get(url, {"top": 1})
+        self.assertEqual(response.json()["terms"], [{"term": "term1", "value": 0.5}])
+        self.assertEqual(self.client.get(url, {"top": 1}, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.lda_model.save()
+        self.assertEqual(self.client.get(url, {"top": 1}, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_model_is_resolved_once_per_request(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(reverse("api_model_topics", args=("model",))).status_code, 200)
+        self.assertEqual(sum(LdaModel._meta.db_table in query["sql"] for query in context.captured_queries), 1)
+
+    def test_topics_are_served_as_columns(self):
+        url = reverse("api_model_topics_columns", args=("model",))
+        page = self.client.get(url, {"limit": 2, "top": 2}).json()
+        self.assertEqual(page["topics"], [0, 1])
+        self.assertEqual(page["offsets"], [0, 2, 4])
+        self.assertEqual([page["terms"][term_id] for term_id in page["term_ids"]],
+                         ["term0", "common", "term1", "common"])
+        self.assertEqual(page["values"], [0.5, 0.25, 0.5, 0.25])
+        self.assertEqual(page["next_cursor"], 1)
+        content = self.client.get(url, {"cursor": 1, "top": 1, "format": "binary"}).content
+        self.assertEqual(content[:4], b"TTC1")
+        header_length = int.from_bytes(content[4:8], "little")
+        self.assertEqual(json.loads(content[8:8 + header_length])["terms"], ["term2"])
+        self.assertEqual(len(content), 8 + header_length + 4 * 2 + 4 + 4)
+
+
+@skipUnless(connection.vendor == "postgresql", "Query plans are only checked on PostgreSQL")
+class TopicTermsQueryPlanTests(TestCase):
+    # With sequential scans and sorts disabled, the planner still falls back to them when no index supports a query or
+    # provides the order of its rows
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=True, is_ingested=True, path="model.lda",
+                                                description="Model")
+        cls.topic = create_topic_terms(cls.lda_model, 0, [("network", 0.3), ("learn", 0.2)])
+
+    def assertIndexPlan(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_sort = off")
+        plan = queryset.explain()
+        self.assertNotIn("Seq Scan", plan)
+        if queryset.ordered:
+            self.assertNotIn("Sort", plan)
+
+    def test_topic_term_representations_use_index(self):
+        self.assertIndexPlan(queries.topic_term_representations(self.lda_model))
+
+    def test_topic_terms_by_rank_use_index(self):
+        self.assertIndexPlan(TopicTermDistribution.objects.filter(topic=self.topic).order_by("rank"))
+
+    def test_topic_terms_by_value_use_index(self):
+        self.assertIndexPlan(TopicTermDistribution.objects.filter(topic=self.topic).order_by("-value"))
+
+    def test_rank_1_words_use_index(self):
+        self.assertIndexPlan(Word.objects.filter(stemmed__in=[term.pk for term in Term.objects.all()], rank=1))
+
+
+@skipUnless(connection.vendor == "postgresql", "Words are imported through PostgreSQL")
+class WordImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=True, is_ingested=True, path="model.lda",
+                                                description="Model")
+        create_topic_terms(cls.lda_model, 0, [("galaxi", 0.4), ("star", 0.25)])
+        Word.objects.create(string="galaxies", rank=1, stemmed=Term.objects.get(string="galaxi"))
+
+    def test_words_are_replaced_and_ranked(self):
+        stats = words.import_words(["galaxi\tgalaxies\t3\n", "galaxi\tgalaxy\t10\n", "star\tstars\n",
+                                    "network\tnetworks\n"])
+        self.assertEqual(stats["words"], 4)
+        self.assertEqual(list(Word.objects.filter(stemmed__string="galaxi").order_by("rank")
+                              .values_list("string", flat=True)), ["galaxy", "galaxies"])
+        self.assertEqual(Term.objects.get(string="network").display_word, "networks")
+        self.assertEqual([term["term"] for term in queries.get_topics_terms_representation(self.lda_model)[0]],
+                         ["stars", "galaxy"])
+
+    def test_staged_words_are_merged_into_the_stored_ones(self):
+        galaxies = Word.objects.get(string="galaxies").pk
+        # A repeated word keeps its first occurrence; lines without a word are skipped
+        lines = ["galaxi\tgalaxies\t3\n", "galaxi\tgalaxy\t10\n", "galaxi\tgalaxies\t99\n", "star\tstars\n",
+                 "network\n"]
+        stats = words.import_words(lines)
+        self.assertEqual((stats["words"], stats["inserted"], stats["updated"], stats["deleted"]), (4, 2, 1, 0))
+        self.assertEqual(Word.objects.get(string="galaxies").pk, galaxies)
+        self.assertEqual(Word.objects.get(string="galaxies").rank, 2)
+        # Importing the same map again writes nothing
+        stats = words.import_words(lines)
+        self.assertEqual((stats["inserted"], stats["updated"], stats["deleted"]), (0, 0, 0))
+        # A word moving to another term is updated in place
+        stats = words.import_words(["star\tgalaxies\n"])
+        self.assertEqual((stats["inserted"], stats["updated"], stats["deleted"]), (0, 1, 2))
+        self.assertEqual(list(Word.objects.values_list("pk", "stemmed__string", "rank")), [(galaxies, "star", 1)])
+
+    def test_words_missing_from_the_map_are_removed(self):
+        words.import_words(["star\tstars\n"])
+        self.assertEqual(list(Word.objects.values_list("string", flat=True)), ["stars"])
+        self.assertIsNone(Term.objects.get(string="galaxi").display_word)
+        self.assertEqual(queries.get_topics_terms_representation(self.lda_model)[0][-1]["term"], "galaxi")
+
+
+class TopTopicTermsTests(TestCase):
+
+    def test_top_terms_match_gensim(self):
+        from gensim.models import LdaModel as GensimLdaModel
+
+        with tempfile.TemporaryDirectory() as directory:
+            gensim_model = GensimLdaModel.load(synthetic.write_gensim_model(os.path.join(directory, "model.lda"), 5,
+                                                                            80))
+        topics = gensim_model.get_topics()
+        # Blocks of two topics, starting from topic 1
+        with mock.patch.object(settings, "INGESTION_BLOCK_ELEMENTS", 160):
+            term_ids, term_weights = ingestion.top_topic_terms(gensim_model, 10, 1, 5)
+        np.testing.assert_array_equal(term_ids, np.argsort(-topics[1:], axis=1, kind="stable")[:, :10])
+        np.testing.assert_allclose(term_weights, -np.sort(-topics[1:], axis=1)[:, :10], rtol=1e-5)
+        self.assertEqual([term_id for term_id, _ in gensim_model.get_topic_terms(3, topn=10)], term_ids[2].tolist())
+        # Asking for more terms than the vocabulary holds gives all of them
+        self.assertEqual(ingestion.top_topic_terms(gensim_model, 100, 0, 1)[0].shape, (1, 80))
+
+    def test_terms_are_resolved_once(self):
+        stored = Term.objects.create(string="galaxi")
+        known_terms = dict()
+        ingestion.resolve_terms(["galaxi", "star", "star"], known_terms)
+        self.assertEqual(known_terms, {"galaxi": stored.pk, "star": Term.objects.get(string="star").pk})
+        with self.assertNumQueries(0):
+            ingestion.resolve_terms(["star", "galaxi"], known_terms)
+
+
+class ModelRegistryTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        model_registry.clear()
+        self.addCleanup(model_registry.clear)
+        self.lda_models = [LdaModel(name=name, path=synthetic.write_gensim_model(
+            os.path.join(directory.name, "{}.lda".format(name)), 2, 20)) for name in ("a", "b", "c")]
+
+    def test_least_recently_used_model_is_evicted(self):
+        a, b, c = self.lda_models
+        with mock.patch.object(settings, "GENSIM_MODEL_CACHE_SIZE", 2), \
+                mock.patch.object(model_registry.models.LdaModel, "load",
+                                  wraps=model_registry.models.LdaModel.load) as load:
+            loaded_a = model_registry.get_gensim_model(a)
+            model_registry.get_gensim_model(b)
+            self.assertIs(model_registry.get_gensim_model(a), loaded_a)
+            model_registry.get_gensim_model(c)
+            self.assertEqual(load.call_count, 3)
+            self.assertIs(model_registry.get_gensim_model(a), loaded_a)
+            model_registry.get_gensim_model(b)
+            self.assertEqual(load.call_count, 4)
+        self.assertEqual([os.path.basename(path) for path, _ in model_registry._loaded_models], ["a.lda", "b.lda"])
+
+    def test_replaced_model_file_is_reloaded(self):
+        a = self.lda_models[0]
+        loaded = model_registry.get_gensim_model(a)
+        modified = os.path.getmtime(a.path) + 10
+        os.utime(a.path, (modified, modified))
+        reloaded = model_registry.get_gensim_model(a)
+        self.assertIsNot(reloaded, loaded)
+        self.assertIs(model_registry.get_gensim_model(a), reloaded)
+        self.assertEqual(list(model_registry._loaded_models), [(os.path.abspath(a.path), modified)])
+
+
+class ReingestionTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        path = synthetic.write_gensim_model(os.path.join(self.directory, "model.lda"), 3, 60)
+        self.lda_model = LdaModel.objects.create(name="model", is_main=True, path=path, description="Model")
+        ingest_lda_model(self.lda_model)
+
+    def stored_rows(self):
+        return (list(TopicTermDistribution.objects.filter(topic__parent_model=self.lda_model).order_by("pk")
+                     .values_list("pk", "term", "value")),
+                list(TopicTermRepresentation.objects.filter(lda_model=self.lda_model).order_by("pk")
+                     .values_list("pk", "term", "display_term", "value", "keyphrase")))
+
+    def test_unchanged_rows_are_not_rewritten(self):
+        rows = self.stored_rows()
+        stats = ingest_lda_model(self.lda_model)
+        self.assertEqual((stats["inserted"], stats["updated"], stats["deleted"], stats["changed_topics"]),
+                         (0, 0, 0, 0))
+        self.assertEqual(self.stored_rows(), rows)
+
+    def test_unchanged_topics_keep_their_keyphrases_and_comparisons(self):
+        for topic in Topic.objects.filter(parent_model=self.lda_model):
+            topic.keyphrase = "topic {}".format(topic.index)
+            topic.save()
+        other = LdaModel.objects.create(name="other", is_main=False, is_ingested=True, path="other.lda",
+                                        description="Model")
+        other_topics = [create_topic_terms(other, topic_index, [("term", 0.5)]) for topic_index in range(2)]
+        comparison = Comparison.objects.create(name="comparison", description="Comparison", type_of_comparison=0,
+                                               lda_model_0=self.lda_model, lda_model_1=other,
+                                               matrix=np.full((3, 2), 0.5, dtype=np.float32).tobytes(),
+                                               matrix_rows=3, matrix_columns=2)
+        for topic in Topic.objects.filter(parent_model=self.lda_model):
+            for other_topic in other_topics:
+                TopicsComparison.objects.create(parent_comparison=comparison, topic_0=topic, topic_1=other_topic,
+                                                value=0.5)
+
+        # The replaced model file only changes the terms of topic 1
+        from gensim.models import LdaModel as GensimLdaModel
+
+        gensim_model = GensimLdaModel.load(self.lda_model.path)
+        gensim_model.state.sstats[1] = np.roll(gensim_model.state.sstats[1], 7)
+        self.lda_model.path = os.path.join(self.directory, "replaced.lda")
+        gensim_model.save(self.lda_model.path)
+        self.lda_model.save()
+        self.assertEqual(ingest_lda_model(self.lda_model)["changed_topics"], 1)
+
+        self.assertEqual(dict(TopicTermRepresentation.objects.filter(lda_model=self.lda_model)
+                              .values_list("topic_index", "keyphrase").distinct()),
+                         {0: "topic 0", 1: "topic 1", 2: "topic 2"})
+        self.assertEqual(sorted(comparison.topics_measurement.values_list("topic_0__index", "topic_1__index")),
+                         [(0, 0), (0, 1), (2, 0), (2, 1)])
+        matrix = Comparison.objects.get(pk=comparison.pk).get_matrix()
+        self.assertTrue(np.isnan(matrix[1]).all())
+        self.assertTrue((matrix[[0, 2]] == 0.5).all())
+
+    def test_missing_representation_rows_are_inserted(self):
+        representations = queries.get_topics_terms_representation(self.lda_model)
+        TopicTermRepresentation.objects.filter(lda_model=self.lda_model, topic_index__gt=0).delete()
+        stats = ingest_lda_model(self.lda_model)
+        self.assertEqual((stats["inserted"], stats["updated"], stats["deleted"]), (0, 0, 0))
+        queries.forget_model()
+        self.assertEqual(queries.get_topics_terms_representation(self.lda_model), representations)
+
+
+class IngestionJobTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = synthetic.write_gensim_model(os.path.join(directory.name, "model.lda"), 4, 60)
+        self.lda_model = LdaModel.objects.create(name="model", is_main=True, path=path, description="Model")
+
+    def test_pending_jobs_are_claimed_once_in_order(self):
+        queued = [jobs.enqueue_ingestion(self.lda_model) for _ in range(3)]
+        self.assertEqual(jobs.claim_pending_jobs(2), [job.pk for job in queued[:2]])
+        self.assertEqual(jobs.claim_pending_jobs(2), [queued[2].pk])
+        self.assertEqual(jobs.claim_pending_jobs(2), [])
+        self.assertFalse(IngestionJob.objects.exclude(status=IngestionJob.RUNNING).exists())
+
+    def test_stale_jobs_are_requeued(self):
+        stale, running = [jobs.enqueue_ingestion(self.lda_model) for _ in range(2)]
+        jobs.claim_pending_jobs(2)
+        IngestionJob.objects.filter(pk=stale.pk).update(
+            heartbeat=timezone.now() - datetime.timedelta(seconds=settings.INGESTION_JOB_STALE_SECONDS + 1))
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(jobs.claim_pending_jobs(2), [stale.pk])
+
+    def test_jobs_of_a_broken_pool_fail(self):
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+        from .management.commands.run_ingestion_jobs import Command
+
+        job = jobs.enqueue_ingestion(self.lda_model)
+        jobs.claim_pending_jobs(1)
+        future = Future()
+        future.set_exception(BrokenProcessPool("A worker process died"))
+        self.assertTrue(Command(stdout=io.StringIO(), stderr=io.StringIO()).finish(job.pk, future))
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.FAILED)
+        self.assertIn("BrokenProcessPool", job.error)
+
+    def test_models_stored_before_ingestion_jobs_are_backfilled(self):
+        ingest_lda_model(self.lda_model)
+        TopicTermRepresentation.objects.filter(lda_model=self.lda_model).delete()
+        LdaModel.objects.filter(pk=self.lda_model.pk).update(is_ingested=False)
+        ingested = LdaModel.objects.create(name="ingested", is_main=False, is_ingested=True, path="ingested.lda",
+                                           description="Model")
+        create_topic_terms(ingested, 0, [("term", 0.5)])
+        LdaModel.objects.create(name="empty", is_main=False, path="empty.lda", description="Model")
+
+        queued = jobs.enqueue_backfill()
+        self.assertEqual([job.lda_model_id for job in queued], [self.lda_model.pk])
+        self.assertEqual(jobs.enqueue_backfill(), [])
+        jobs.claim_pending_jobs(1)
+        stats = jobs.run_ingestion_job(queued[0].pk)
+        self.assertEqual((stats["inserted"], stats["updated"], stats["deleted"]), (0, 0, 0))
+        self.assertEqual(TopicTermRepresentation.objects.filter(lda_model=self.lda_model).count(),
+                         4 * settings.TOP_N_TOPIC_TERMS)
+        self.assertTrue(LdaModel.objects.get(pk=self.lda_model.pk).is_ingested)
+
+    def test_interrupted_job_resumes_from_its_last_committed_topic(self):
+        job = jobs.enqueue_ingestion(self.lda_model)
+        jobs.claim_pending_jobs(1)
+
+        def crash(ingested_topics, total_topics):
+            if ingested_topics > 2:
+                raise RuntimeError("Worker crashed")
+            IngestionJob.objects.filter(pk=job.pk).update(ingested_topics=ingested_topics, total_topics=total_topics)
+
+        heartbeat = mock.Mock()
+        with self.assertRaises(RuntimeError):
+            ingest_lda_model(self.lda_model, progress_callback=crash, heartbeat_callback=heartbeat,
+                             chunk_size=2 * settings.TOP_N_TOPIC_TERMS)
+        # Before the idf table, the topic index and the topics, then before every chunk
+        self.assertEqual(heartbeat.call_count, 5)
+        self.assertEqual(TopicTermDistribution.objects.filter(topic__parent_model=self.lda_model).count(),
+                         2 * settings.TOP_N_TOPIC_TERMS)
+
+        with mock.patch.object(ingestion, "top_topic_terms", wraps=ingestion.top_topic_terms) as top_topic_terms:
+            stats = jobs.run_ingestion_job(job.pk)
+        self.assertEqual(top_topic_terms.call_args_list[0].args[2:], (2, 4))
+        self.assertEqual(stats["topics"], 2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.ingested_topics, job.total_topics), (IngestionJob.DONE, 4, 4))
+        self.assertEqual(TopicTermDistribution.objects.filter(topic__parent_model=self.lda_model).count(),
+                         4 * settings.TOP_N_TOPIC_TERMS)
+
+
+class EvolutionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        topics = dict()
+        lda_models = dict()
+        for name, num_topics in (("a", 3), ("b", 3), ("c", 2)):
+            lda_models[name] = LdaModel.objects.create(name=name, is_main=name == "a", is_ingested=True,
+                                                       path="{}.lda".format(name), description="Model")
+            for topic_index in range(num_topics):
+                topics[name, topic_index] = Topic.objects.create(index=topic_index, parent_model=lda_models[name])
+        for name, type_of_comparison, values in (
+                ("a-b", 0, {(0, 0): 0.9, (1, 0): 0.6, (0, 1): 0.4, (1, 2): 0.8}),
+                ("b-c", 1, {(0, 0): 0.1, (0, 1): 0.5, (1, 1): 0.2})):
+            name_0, name_1 = name.split("-")
+            comparison = Comparison.objects.create(name=name, description="Comparison",
+                                                   type_of_comparison=type_of_comparison,
+                                                   lda_model_0=lda_models[name_0], lda_model_1=lda_models[name_1])
+            for (topic_0, topic_1), value in values.items():
+                TopicsComparison.objects.create(parent_comparison=comparison, topic_0=topics[name_0, topic_0],
+                                                topic_1=topics[name_1, topic_1], value=value)
+
+    def trace(self, model_name, topic_index, threshold, comparisons="a-b,b-c"):
+        return self.client.get(reverse("api_topic_evolution", args=(model_name, topic_index)),
+                               {"comparisons": comparisons, "threshold": threshold})
+
+    @staticmethod
+    def associations(response):
+        return sorted((parent["name"], association["child"]["name"], association["label"])
+                      for parent in response.json()["parents"] for association in parent["associations"])
+
+    def test_topics_are_traced_across_generations(self):
+        response = self.trace("a", 0, 0.5)
+        self.assertEqual([generation["name"] for generation in response.json()["generations"]], ["a", "b", "c"])
+        self.assertEqual(self.associations(response), [("a_0", "b_0", 0.9), ("b_0", "c_0", 0.1), ("b_0", "c_1", 0.5)])
+        self.assertEqual([parent["highlight"] for parent in response.json()["parents"]], [True, False])
+        # Ancestors and descendants of a topic of the middle generation
+        self.assertEqual(self.associations(self.trace("b", 0, 0.5)),
+                         [("a_0", "b_0", 0.9), ("a_1", "b_0", 0.6), ("b_0", "c_0", 0.1), ("b_0", "c_1", 0.5)])
+
+    def test_comparisons_worse_than_the_threshold_are_cut_off(self):
+        self.assertEqual(self.associations(self.trace("b", 0, 0.3)),
+                         [("a_0", "b_0", 0.9), ("a_1", "b_0", 0.6), ("b_0", "c_0", 0.1)])
+        self.assertEqual(self.associations(self.trace("a", 0, 0.95)), [])
+
+    def test_topic_without_edges_has_no_associations(self):
+        response = self.trace("a", 2, 0.0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["parents"], [])
+
+    def test_bad_chains_are_rejected(self):
+        for comparisons in ("b-c,a-b", "a-b,missing", ""):
+            with self.subTest(comparisons=comparisons):
+                self.assertEqual(self.trace("a", 0, 0.5, comparisons=comparisons).status_code, 400)
+        self.assertEqual(self.trace("c", 0, 0.5, comparisons="a-b").status_code, 400)
+        self.assertEqual(self.trace("a", 0, "high").status_code, 400)
+
+
+class IdfTests(TestCase):
+
+    def setUp(self):
+        from gensim.models import LdaModel as GensimLdaModel
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = synthetic.write_gensim_model(os.path.join(directory.name, "model.lda"), 2, 20)
+        self.lda_model = LdaModel(name="model", path=path, use_tfidf=True)
+        self.gensim_model = GensimLdaModel.load(path)
+
+    def test_idf_matches_gensim(self):
+        from gensim.models.tfidfmodel import df2idf
+
+        dictionary = self.gensim_model.id2word
+        del dictionary.dfs[3]
+        with np.errstate(all="raise"):
+            path = tfidf.build_idf(self.lda_model, self.gensim_model)
+        idf = np.load(path)
+        self.assertEqual(idf[3], 0)
+        np.testing.assert_allclose(idf[[term_id for term_id in range(len(dictionary)) if term_id != 3]],
+                                   [df2idf(df, dictionary.num_docs) for _, df in sorted(dictionary.dfs.items())],
+                                   rtol=1e-6)
+
+    def test_models_using_tfidf_need_document_frequencies(self):
+        self.gensim_model.id2word.dfs = dict()
+        with self.assertRaises(ValueError):
+            tfidf.build_idf(self.lda_model, self.gensim_model)
+        self.lda_model.use_tfidf = False
+        with self.assertLogs("topic_evolution_visualization.tfidf", "WARNING"):
+            self.assertIsNone(tfidf.build_idf(self.lda_model, self.gensim_model))
+
+
+class ComparisonMetricTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        # Models over overlapping vocabularies, so that some terms are only known to one of them
+        cls.lda_models = [LdaModel(name="model-{}".format(index), path=synthetic.write_gensim_model(
+            os.path.join(directory.name, "model-{}.lda".format(index)), num_topics, vocabulary_size, seed=index))
+            for index, (num_topics, vocabulary_size) in enumerate(((7, 40), (5, 60)))]
+        # Distributions of both models over the union of their vocabularies
+        cls.distributions = list()
+        terms = synthetic.synthetic_terms(60)
+        for lda_model_obj in cls.lda_models:
+            gensim_model = model_registry.get_gensim_model(lda_model_obj)
+            distributions = np.zeros((gensim_model.num_topics, len(terms)))
+            columns = [terms.index(gensim_model.id2word[term_id]) for term_id in range(len(gensim_model.id2word))]
+            distributions[:, columns] = gensim_model.get_topics()
+            cls.distributions.append(distributions)
+
+    def brute_force(self, metric):
+        from scipy.spatial import distance
+
+        distributions_0, distributions_1 = self.distributions
+        if metric == "jaccard":
+            # Over the top 10 terms of every topic
+            incidences = [np.zeros(distributions.shape, dtype=bool) for distributions in self.distributions]
+            for incidence, distributions in zip(incidences, self.distributions):
+                np.put_along_axis(incidence, np.argsort(-distributions, axis=1)[:, :10], True, axis=1)
+            return 1 - distance.cdist(*incidences, "jaccard")
+        if metric == "hellinger":
+            return distance.cdist(np.sqrt(distributions_0), np.sqrt(distributions_1), "euclidean") / np.sqrt(2)
+        if metric == "cosine":
+            return 1 - distance.cdist(distributions_0, distributions_1, "cosine")
+        return distance.cdist(distributions_0, distributions_1, lambda p, q: distance.jensenshannon(p, q, base=2))
+
+    def test_metrics_match_brute_force(self):
+        for metric in ("hellinger", "jensen_shannon", "cosine", "jaccard"):
+            expected = self.brute_force(metric)
+            # Tiny blocks and chunks, computed in process and by worker processes mapping the matrices
+            for workers in (1, 2):
+                with self.subTest(metric=metric, workers=workers), \
+                        mock.patch.object(settings, "COMPARISON_BLOCK_ELEMENTS", 16), \
+                        mock.patch.object(settings, "TOP_N_TOPIC_TERMS", 10):
+                    values = comparisons.compare_models(*self.lda_models, metric, workers=workers)
+                    np.testing.assert_allclose(values, expected, atol=1e-5)
+
+
+@skipUnless(connection.vendor == "postgresql", "Synthetic data is written through PostgreSQL")
+class SyntheticDataTests(TestCase):
+
+    def test_synthetic_models_can_be_compared(self):
+        lda_model_0 = synthetic.create_model("synthetic-0", 20, 500, words_per_term=2)
+        lda_model_1 = synthetic.create_model("synthetic-1", 10, 500, seed=1)
+        comparison = synthetic.create_comparison("synthetic", lda_model_0, lda_model_1, density=0.5)
+        self.assertEqual(TopicTermRepresentation.objects.filter(lda_model=lda_model_1).count(),
+                         10 * settings.TOP_N_TOPIC_TERMS)
+        self.assertEqual(Word.objects.count(), 1000)
+        self.assertTrue(queries.get_topics_terms_representation(lda_model_0, 0)[0][0]["term"].endswith("1"))
+        self.assertTrue(0 < comparison.topics_measurement.count() < 200)
+        synthetic.delete_synthetic_data("synthetic-0", "synthetic-1")
+        self.assertFalse(Term.objects.exists())
+
+
+@skipUnless(connection.vendor == "postgresql", "Topic comparisons are written through PostgreSQL")
+class ComparisonPruningTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        lda_models = [LdaModel.objects.create(name="model-{}".format(index), is_main=index == 0, is_ingested=True,
+                                              path="model-{}.lda".format(index), description="Model")
+                      for index in range(2)]
+        for lda_model in lda_models:
+            for topic_index in range(3):
+                create_topic_terms(lda_model, topic_index, [("term{}".format(topic_index), 0.5)])
+        cls.comparison = Comparison.objects.create(name="comparison", description="Comparison", type_of_comparison=0,
+                                                   lda_model_0=lda_models[0], lda_model_1=lda_models[1],
+                                                   threshold=0.3, top_k=2)
+        comparisons.store_comparison(cls.comparison, np.array([[0.9, 0.2, 0.5],
+                                                               [0.8, 0.1, 0.6],
+                                                               [0.7, 0.25, 0.4]], dtype=np.float32))
+        # Pairs at least as good as the threshold among the two best of their topic of the second model
+        cls.stored = {(0, 0), (1, 0), (1, 2), (0, 2)}
+
+    def assert_only_stored_pairs_are_served(self, comparison):
+        self.assertEqual({(edge["topic_0"], edge["topic_1"])
+                          for topic_1 in range(3) for edge in queries.get_topic_comparisons(comparison, topic_1)},
+                         self.stored)
+        self.assertEqual([edge["topic_0"] for edge in queries.get_topic_comparisons(comparison, 0)], [0, 1])
+        self.assertEqual(queries.get_topic_comparisons(comparison, 1, threshold=0.0), [])
+        edges, _ = queries.get_comparison_edges_page(comparison, after=0, limit=2)
+        self.assertEqual([(edge["topic_0"], edge["topic_1"]) for edge in edges], [(1, 2), (0, 2)])
+        indexes_0, indexes_1, _ = evolution.comparison_pairs(comparison)
+        self.assertEqual(set(zip(indexes_0.tolist(), indexes_1.tolist())), self.stored)
+
+    def test_pruned_pairs_of_the_packed_matrix_are_not_served(self):
+        comparison = Comparison.objects.get(pk=self.comparison.pk)
+        self.assertIsNotNone(comparison.get_matrix())
+        self.assertEqual(set(comparison.topics_measurement.values_list("topic_0__index", "topic_1__index")),
+                         self.stored)
+        self.assert_only_stored_pairs_are_served(comparison)
+
+    def test_topic_comparisons_serve_the_same_pairs(self):
+        Comparison.objects.filter(pk=self.comparison.pk).update(matrix=None, matrix_rows=None, matrix_columns=None)
+        self.assert_only_stored_pairs_are_served(Comparison.objects.get(pk=self.comparison.pk))
+
+
+@skipUnless(connection.vendor == "postgresql", "Articles are searched through PostgreSQL")
+class ArticleSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=True, is_ingested=True, path="model.lda",
+                                                description="Model")
+        cls.topics = [create_topic_terms(cls.lda_model, topic_index, [("term", 0.5)]) for topic_index in range(2)]
+        cls.corpus = Corpus.objects.create(name="corpus", description="Corpus")
+        articles.load_articles(cls.corpus, [
+            {"identifier": "a", "title": "Neural networks", "abstract": "Training deep networks.", "year": 2019},
+            {"identifier": "b", "title": "Galaxies", "abstract": "Neural networks classify galaxies.", "year": 2020},
+            {"identifier": "c", "title": "Stars", "abstract": "The life of stars."}
+        ])
+        articles.update_search_vectors(batch_size=2)
+        for identifier, topic, value in (("a", 0, 0.9), ("b", 0, 0.2), ("b", 1, 0.7)):
+            ArticleTopicDistribution.objects.create(article=Article.objects.get(identifier=identifier),
+                                                    topic=cls.topics[topic], rank=1, value=value)
+
+    def test_articles_are_ranked_by_text(self):
+        self.assertFalse(Article.objects.filter(search_vector__isnull=True).exists())
+        self.assertEqual([article["identifier"] for article in articles.search_articles("neural networks")],
+                         ["a", "b"])
+
+    def test_articles_are_filtered_by_topic_weight(self):
+        url = reverse("api_search_articles", args=("model",))
+        found = self.client.get(url, {"q": "networks", "topics": "0,1", "weight": 0.5}).json()["articles"]
+        self.assertEqual([(article["identifier"], article["topic_weight"]) for article in found],
+                         [("a", 0.9), ("b", 0.7)])
+        found = self.client.get(url, {"q": "networks", "topics": "1"}).json()["articles"]
+        self.assertEqual([article["identifier"] for article in found], ["b"])
+
+    def test_reloaded_articles_are_reindexed(self):
+        stats = articles.load_articles(self.corpus, [
+            {"identifier": "a", "title": "Neural networks", "abstract": "Training deep networks.", "year": 2019},
+            {"identifier": "c", "title": "Stars", "abstract": "The life of neural stars."}
+        ])
+        self.assertEqual(stats["written"], 1)
+        self.assertEqual(articles.update_search_vectors(), 1)
+        self.assertEqual(len(articles.search_articles("neural")), 3)
+
+
+@skipUnless(connection.vendor == "postgresql", "Articles are loaded through PostgreSQL")
+class CorpusScoringTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = synthetic.write_gensim_model(os.path.join(directory.name, "model.lda"), 4, 50)
+        self.lda_model = LdaModel.objects.create(name="model", is_main=True, path=path, description="Model")
+        ingest_lda_model(self.lda_model)
+        self.corpus = Corpus.objects.create(name="corpus", description="Corpus")
+        terms = synthetic.synthetic_terms(50)
+        articles.load_articles(self.corpus, [{"identifier": str(index), "abstract": " ".join(terms[index::5]),
+                                              "year": 2000 + index % 2} for index in range(5)] +
+                               [{"identifier": "empty", "abstract": "none", "year": 2001}])
+
+    def test_articles_are_scored_and_resumed(self):
+        job = scoring.get_scoring_job(self.lda_model, self.corpus, top_k=2)
+        stats = scoring.run_scoring_job(job.pk, workers=1, batch_size=2)
+        self.assertEqual((stats["articles"], stats["rows"]), (6, 10))
+        self.assertEqual(list(ArticleTopicDistribution.objects.filter(article__identifier="0")
+                              .values_list("rank", flat=True)), [1, 2])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.scored_articles), (ScoringJob.DONE, 6))
+
+        # A job interrupted after its first batch rescored the rest without duplicating rows
+        first_batch = list(Article.objects.order_by("pk").values_list("pk", flat=True)[:2])
+        ScoringJob.objects.filter(pk=job.pk).update(status=ScoringJob.FAILED, last_article=first_batch[-1],
+                                                    scored_articles=2)
+        self.assertEqual(scoring.get_scoring_job(self.lda_model, self.corpus, top_k=2), job)
+        self.assertEqual(scoring.run_scoring_job(job.pk, workers=1)["articles"], 4)
+        self.assertEqual(ArticleTopicDistribution.objects.count(), 10)
+
+    def test_running_scoring_jobs_are_claimed_once(self):
+        job = scoring.get_scoring_job(self.lda_model, self.corpus, top_k=2)
+        self.assertTrue(scoring.claim_scoring_job(job.pk))
+        self.assertFalse(scoring.claim_scoring_job(job.pk))
+        with self.assertRaises(ValueError):
+            scoring.run_scoring_job(job.pk, workers=1)
+
+        # A running job with a recent heartbeat is left alone, one whose heartbeat went stale is requeued and resumed
+        self.assertEqual(scoring.get_scoring_job(self.lda_model, self.corpus, top_k=2).status, ScoringJob.RUNNING)
+        ScoringJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - datetime.timedelta(
+            seconds=settings.SCORING_JOB_STALE_SECONDS + 1))
+        self.assertEqual(scoring.get_scoring_job(self.lda_model, self.corpus, top_k=2).status, ScoringJob.PENDING)
+        self.assertEqual(scoring.run_scoring_job(job.pk, workers=1)["articles"], 6)
+
+    def test_similar_topics_and_articles_are_indexed(self):
+        similar = self.client.get(reverse("api_similar_topics", args=("model", 1)), {"limit": 2}).json()["similar"]
+        self.assertEqual(len(similar), 2)
+        self.assertNotIn(1, [topic["topic"] for topic in similar])
+        self.assertGreaterEqual(similar[0]["similarity"], similar[1]["similarity"])
+        topics = model_registry.get_gensim_model(self.lda_model).get_topics()
+        expected = topics[1] @ topics[similar[0]["topic"]] / np.linalg.norm(topics[1]) / np.linalg.norm(
+            topics[similar[0]["topic"]])
+        self.assertAlmostEqual(similar[0]["similarity"], expected, places=4)
+
+        scoring.run_scoring_job(scoring.get_scoring_job(self.lda_model, self.corpus, top_k=4).pk, workers=1)
+        vectors = dict()
+        for article_pk, topic_index, value in ArticleTopicDistribution.objects.values_list("article", "topic__index",
+                                                                                            "value"):
+            vectors.setdefault(article_pk, np.zeros(4))[topic_index] = float(value)
+        article = Article.objects.get(identifier="0").pk
+        expected = sorted(((vector @ vectors[article] / np.linalg.norm(vector) / np.linalg.norm(vectors[article]),
+                            article_pk) for article_pk, vector in vectors.items() if article_pk != article),
+                          reverse=True)
+        found = similarity.similar_articles(self.lda_model, article, k=3)
+        self.assertEqual([article_pk for article_pk, _ in found], [article_pk for _, article_pk in expected[:3]])
+        self.assertEqual(len(self.client.get(reverse("api_similar_articles", args=("model", "0"))).json()["similar"]),
+                         4)
+
+    def test_prevalence_follows_scoring(self):
+        job = scoring.get_scoring_job(self.lda_model, self.corpus, top_k=2)
+        scoring.run_scoring_job(job.pk, workers=1, batch_size=4)
+        scoring.run_scoring_job(scoring.get_scoring_job(self.lda_model, self.corpus, top_k=1).pk, workers=1)
+        series = self.client.get(reverse("api_topic_prevalence", args=("model",))).json()
+        self.assertEqual(series["years"], [2000, 2001])
+        self.assertEqual(sum(sum(topic["doc_count"]) for topic in series["topics"]), 5)
+        self.assertEqual([sum(topic["doc_count"][1] for topic in series["topics"])], [2])
+        for year in range(2):
+            self.assertAlmostEqual(sum(topic["share"][year] for topic in series["topics"]), 1.0)
+        maintained = prevalence.get_prevalence_series(self.lda_model)
+        prevalence.rebuild_prevalence(self.lda_model)
+        self.assertEqual(prevalence.get_prevalence_series(self.lda_model)["topics"][0]["doc_count"],
+                         maintained["topics"][0]["doc_count"])
+
+
+    def test_prevalence_follows_year_corrections(self):
+        scoring.run_scoring_job(scoring.get_scoring_job(self.lda_model, self.corpus, top_k=2).pk, workers=1)
+        terms = synthetic.synthetic_terms(50)
+        stats = articles.load_articles(self.corpus, [{"identifier": "0", "abstract": " ".join(terms[0::5]),
+                                                      "year": 2005}])
+        self.assertEqual((stats["written"], stats["moved"]), (1, 1))
+        maintained = prevalence.get_prevalence_series(self.lda_model)
+        self.assertEqual(maintained["years"], list(range(2000, 2006)))
+        # Re-scoring the article takes its topics away from its new year
+        job = scoring.get_scoring_job(self.lda_model, self.corpus, top_k=1)
+        self.assertEqual(scoring.run_scoring_job(job.pk, workers=1)["articles"], 6)
+        maintained = prevalence.get_prevalence_series(self.lda_model)
+        prevalence.rebuild_prevalence(self.lda_model)
+        rebuilt = prevalence.get_prevalence_series(self.lda_model)
+        self.assertEqual(maintained["years"], rebuilt["years"])
+        for maintained_topic, rebuilt_topic in zip(maintained["topics"], rebuilt["topics"]):
+            self.assertEqual(maintained_topic["doc_count"], rebuilt_topic["doc_count"])
+            np.testing.assert_allclose(maintained_topic["weight_sum"], rebuilt_topic["weight_sum"], atol=1e-9)
+
+class StartupTests(TestCase):
+
+    def test_workers_boot_without_heavy_modules(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "startup.json")
+            call_command("benchmark_startup", rounds=1, output=output, stdout=io.StringIO())
+            with open(output) as output_file:
+                self.assertEqual(json.load(output_file)["results"]["heavy_modules"], [])
+
+
+class BatchedInferenceTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(model_registry.clear)
+        self.lda_model = LdaModel(name="model", path=synthetic.write_gensim_model(
+            os.path.join(directory.name, "model.lda"), 4, 60), preprocessor_name="default")
+        self.gensim_model = model_registry.get_gensim_model(self.lda_model)
+        tfidf.build_idf(self.lda_model, self.gensim_model)
+        # Documents made of the top terms of each topic, and one without any term of the vocabulary
+        self.documents = [(topic_index, " ".join(self.gensim_model.id2word[term_id]
+                                                 for term_id, _ in self.gensim_model.get_topic_terms(topic_index, 8)
+                                                 for _ in range(3)))
+                          for topic_index in range(4)] + [(4, "unknown")]
+
+    def infer(self):
+        return list(inference.infer_topics(self.lda_model, self.documents, top_k=2, batch_size=2,
+                                           preprocess=lambda _, texts: [text.split() for text in texts]))
+
+    def assert_matches_gensim(self, results, weigh):
+        dictionary = self.gensim_model.id2word
+        self.assertEqual([document_id for document_id, _ in results], list(range(5)))
+        self.assertEqual(results[-1][1], [])
+        for (_, text), (_, topics) in zip(self.documents[:-1], results[:-1]):
+            expected = sorted(self.gensim_model.get_document_topics(weigh(dictionary.doc2bow(text.split())),
+                                                                    minimum_probability=0),
+                              key=lambda topic: -topic[1])[:2]
+            self.assertEqual(topics[0][0], expected[0][0])
+            np.testing.assert_allclose([value for _, value in topics], [value for _, value in expected], atol=0.02)
+
+    def test_batches_match_per_document_inference(self):
+        self.assert_matches_gensim(self.infer(), lambda bow: bow)
+
+    def test_tfidf_batches_match_per_document_inference(self):
+        from gensim.models import TfidfModel
+
+        self.lda_model.use_tfidf = True
+        tfidf_model = TfidfModel(dictionary=self.gensim_model.id2word)
+        self.assert_matches_gensim(self.infer(), lambda bow: tfidf_model[bow])
+
+
+class InferenceApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lda_model = LdaModel.objects.create(name="model", is_main=True, is_ingested=True, path="missing.lda",
+                                                description="Model", preprocessor_name="unknown")
+
+    def setUp(self):
+        queries.forget_model()
+
+    def test_misconfigured_model_fails_before_streaming(self):
+        url = reverse("api_infer_topics")
+        with self.assertLogs("topic_evolution_visualization.views", "ERROR"):
+            response = self.client.post(url, "galaxies and stars\n", content_type="text/plain")
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("Unknown preprocessor", response.json()["error"])
+        LdaModel.objects.filter(pk=self.lda_model.pk).update(preprocessor_name="default")
+        queries.forget_model()
+        with self.assertLogs("topic_evolution_visualization.views", "ERROR"):
+            response = self.client.post(url, "galaxies and stars\n", content_type="text/plain")
+        self.assertEqual(response.status_code, 500)
 
-# Create your tests here.
+    @mock.patch.object(settings, "INFERENCE_MAX_DOCUMENTS", 2)
+    def test_documents_are_limited(self):
+        response = self.client.post(reverse("api_infer_topics"), "one\ntwo\nthree\n", content_type="text/plain")
+        self.assertEqual(response.status_code, 413)
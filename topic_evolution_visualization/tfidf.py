@@ -0,0 +1,57 @@
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Weights below this are dropped from tf-idf vectors, as gensim's TfidfModel does
+EPSILON = 1e-12
+
+
+def idf_path(lda_model_obj):
+    return os.path.abspath(lda_model_obj.path) + ".idf.npy"
+
+
+def build_idf(lda_model_obj, lda_model):
+    # Stores next to the model file the inverse document frequency of every term of the training corpus, indexed by
+    # the term's dictionary id, with the same definition gensim's TfidfModel uses; terms no document holds weigh 0.
+    # Without document frequencies there is no table to store, which only a model using tf-idf cannot do without
+    dictionary = lda_model.id2word
+    if not getattr(dictionary, "dfs", None) or not getattr(dictionary, "num_docs", 0):
+        if lda_model_obj.use_tfidf:
+            raise ValueError("Model {} uses tf-idf, but its dictionary holds no document frequencies".format(
+                lda_model_obj.name))
+        logger.warning("Model %s: the dictionary holds no document frequencies, no idf table is built",
+                       lda_model_obj.name)
+        return None
+    dfs = np.zeros(len(dictionary), dtype=np.float64)
+    dfs[np.fromiter(dictionary.dfs.keys(), dtype=np.int64)] = np.fromiter(dictionary.dfs.values(), dtype=np.float64)
+    ratios = np.divide(dictionary.num_docs, dfs, out=np.ones_like(dfs), where=dfs > 0)
+    idf = np.log2(ratios).astype(np.float32)
+    path = idf_path(lda_model_obj)
+    with open(path, "wb") as idf_file:
+        np.save(idf_file, idf)
+    return path
+
+
+def weight_bows(bows, idf):
+    # Tf-idf weighting of a batch of bags of words, normalized to unit length. The term frequencies of the whole batch
+    # are weighted with a single gather-multiply over the concatenated bags
+    lengths = np.fromiter((len(bow) for bow in bows), dtype=np.int64, count=len(bows))
+    if not lengths.sum():
+        return [[] for _ in bows]
+    term_ids = np.fromiter((term_id for bow in bows for term_id, _ in bow), dtype=np.int64, count=lengths.sum())
+    weights = np.fromiter((count for bow in bows for _, count in bow), dtype=np.float64, count=lengths.sum())
+    weights *= idf[term_ids]
+    weights[np.abs(weights) <= EPSILON] = 0
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    squares = np.add.reduceat(weights ** 2, offsets[:-1][lengths > 0])
+    norms = np.ones(len(bows))
+    norms[lengths > 0] = np.sqrt(squares)
+    norms[norms == 0] = 1
+    weights /= np.repeat(norms, lengths)
+
+    term_ids, weights = term_ids.tolist(), weights.tolist()
+    return [[(term_id, weight) for term_id, weight in zip(term_ids[start:end], weights[start:end]) if weight]
+            for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
@@ -8,6 +8,22 @@ urlpatterns = [
     # path("new-article/", views.new_article_topic_analysis, name="text_topics"),
     # path("new-article/ajax/text-topics/", views.ajax_text_topics),
     path('', views.home, name="home"),
+    path("metrics/", views.metrics, name="metrics"),
+    path("api/infer/", views.api_infer_topics, name="api_infer_topics"),
+    path("api/evolution/<str:model_name>/topics/<int:topic_index>/", views.api_topic_evolution,
+         name="api_topic_evolution"),
+    path("api/v1/models/<str:model_name>/topics/", views.api_model_topics, name="api_model_topics"),
+    path("api/v1/models/<str:model_name>/topics/columns/", views.api_model_topics_columns,
+         name="api_model_topics_columns"),
+    path("api/v1/models/<str:model_name>/topics/<int:topic_index>/similar/", views.api_similar_topics,
+         name="api_similar_topics"),
+    path("api/v1/models/<str:model_name>/articles/<str:identifier>/similar/", views.api_similar_articles,
+         name="api_similar_articles"),
+    path("api/v1/models/<str:model_name>/prevalence/", views.api_topic_prevalence, name="api_topic_prevalence"),
+    path("api/v1/models/<str:model_name>/articles/", views.api_search_articles, name="api_search_articles"),
+    path("api/v1/topics/<int:topic_index>/terms/", views.api_topic_terms, name="api_topic_terms"),
+    path("api/v1/comparisons/<str:comparison_name>/edges/", views.api_comparison_edges,
+         name="api_comparison_edges"),
     # TODO: can we make something smart that fills the links of each page
     # re_path(r'a\d',views.index),
     # re_path(r'([.]\/)*',views.index)
@@ -1,14 +1,25 @@
+import itertools
+import json
+import logging
 import re
+import time
 
+import orjson
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.db.models import Min, Max, Subquery
-from django.http import JsonResponse, Http404
+from django.http import JsonResponse, Http404, StreamingHttpResponse, HttpResponse
 from django.shortcuts import render
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_GET, condition
 
+from topic_evolution import settings
 from topic_evolution_visualization import models
-from . import queries
+from . import queries, instrumentation, articles, prevalence
 from .forms import NewArticleForm
 
+logger = logging.getLogger(__name__)
+
 
 # Create your views here.
 def home(request):
@@ -16,14 +27,385 @@ def home(request):
     main_model = queries.get_model()
     if main_model:
         template_context["model"] = {
+            "name": main_model.name,
             "description": main_model.description,
             "training_context": main_model.training_context
         }
-        template_context["topics"] = queries.get_topics_terms_representation(main_model)
+        # Topics are fetched by the page as they scroll into view
+        template_context["top_n"] = settings.HOME_TOP_N_TOPIC_TERMS
 
     return render(context=template_context, template_name='topic_evolution_visualization/home.html', request=request)
 
 
+def metrics(request):
+    # Metrics of the sampled requests handled by this process, in the Prometheus text format, for local scrapers only.
+    # They are disabled by default since the remote address cannot tell local scrapers from proxied requests
+    if not settings.INSTRUMENTATION_METRICS_ENABLED or \
+            request.META.get("REMOTE_ADDR") not in settings.INSTRUMENTATION_METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(instrumentation.registry.export(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def parse_documents(lines):
+    # Every non-empty line is a document: either a JSON object with a "text" and an optional "id", a JSON string or,
+    # failing that, the raw text of the line. Documents without an id are identified by their line number
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            document = json.loads(line)
+        except ValueError:
+            document = line
+        if isinstance(document, dict):
+            yield document.get("id", line_number), str(document.get("text", ""))
+        else:
+            yield line_number, str(document)
+
+
+@csrf_exempt
+@require_POST
+def api_infer_topics(request):
+    # Inference pulls in gensim, nltk and numpy, which web workers only import once a request needs them
+    from . import inference
+    from .preprocessing import PreprocessingError
+
+    main_model = queries.get_model()
+    if main_model is None:
+        raise Http404
+    try:
+        top_k = int(request.GET.get("top", settings.INFERENCE_TOP_K))
+        if top_k < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({"error": "top must be a positive integer"}, status=400)
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > settings.INFERENCE_MAX_BYTES:
+        return JsonResponse({"error": "Requests are limited to {} bytes".format(settings.INFERENCE_MAX_BYTES)},
+                            status=413)
+    # Documents are read either from an uploaded file or from the request body, as JSON lines. They are all read, up to
+    # the limit, before anything is sent, so that every error gets its own status
+    documents = list(itertools.islice(parse_documents(request.FILES["file"] if "file" in request.FILES else request),
+                                      settings.INFERENCE_MAX_DOCUMENTS + 1))
+    if len(documents) > settings.INFERENCE_MAX_DOCUMENTS:
+        return JsonResponse({"error": "Requests are limited to {} documents".format(
+            settings.INFERENCE_MAX_DOCUMENTS)}, status=413)
+    try:
+        results = inference.infer_topics(main_model, documents, top_k=top_k)
+    except PreprocessingError as e:
+        logger.error("Model %s cannot infer topics: %s", main_model.name, e)
+        return JsonResponse({"error": "Preprocessing error: {}".format(e)}, status=500)
+    except OSError as e:
+        logger.error("Model %s cannot infer topics: %s", main_model.name, e)
+        return JsonResponse({"error": "The files of the model are unavailable"}, status=500)
+
+    def stream_results():
+        started = time.perf_counter()
+        documents_count = 0
+        for document_id, topics in results:
+            documents_count += 1
+            yield json.dumps({"id": document_id,
+                              "topics": [{"topic": topic, "value": value} for topic, value in topics]}) + "\n"
+        elapsed = time.perf_counter() - started
+        throughput = documents_count / elapsed if elapsed else float(documents_count)
+        logger.info("Inferred topics of %d documents in %.2fs (%.1f documents/s)", documents_count, elapsed,
+                    throughput)
+        yield json.dumps({"documents": documents_count, "seconds": elapsed, "documents_per_second": throughput}) + "\n"
+
+    return StreamingHttpResponse(stream_results(), content_type="application/x-ndjson")
+
+
+def api_topic_evolution(request, model_name, topic_index):
+    # Traces a topic of a model across the chain of comparisons given as a comma separated list of their names
+    from . import evolution
+
+    comparison_names = [name for name in request.GET.get("comparisons", "").split(",") if name]
+    if not comparison_names:
+        return JsonResponse({"error": "No comparisons given"}, status=400)
+    try:
+        threshold = float(request.GET["threshold"])
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "threshold must be a number"}, status=400)
+    try:
+        graph = evolution.get_evolution_graph(comparison_names)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    generation_names = [lda_model.name for lda_model in graph.generations]
+    if model_name not in generation_names:
+        return JsonResponse({"error": "Model {} is not part of the comparisons".format(model_name)}, status=400)
+    generation = generation_names.index(model_name)
+
+    parents = dict()
+    for generation_0, topic_0, generation_1, topic_1, value in graph.trace(generation, topic_index, threshold):
+        parent_name = "{}_{}".format(generation_names[generation_0], topic_0)
+        if parent_name not in parents:
+            parents[parent_name] = {
+                "name": parent_name,
+                "highlight": generation_0 == generation and topic_0 == topic_index,
+                "associations": list()
+            }
+        parents[parent_name]["associations"].append({
+            "child": {
+                "name": "{}_{}".format(generation_names[generation_1], topic_1),
+                "highlight": generation_1 == generation and topic_1 == topic_index
+            },
+            "label": value
+        })
+    return JsonResponse({
+        "generations": [{"name": lda_model.name, "description": lda_model.description}
+                        for lda_model in graph.generations],
+        "parents": list(parents.values())
+    })
+
+
+# Version of the read API, part of its URLs and of its ETags
+API_VERSION = 1
+
+
+def api_response(data, status=200, option=None):
+    with instrumentation.span("serialize"):
+        content = orjson.dumps(data, option=option)
+    return HttpResponse(content, content_type="application/json", status=status)
+
+
+def api_error(message, status=400):
+    return api_response({"error": message}, status=status)
+
+
+def int_parameter(request, name, default, minimum=0, maximum=None):
+    value = int(request.GET.get(name, default))
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError
+    return value
+
+
+def get_api_model(request, model_name=None):
+    # The named model, or the main model if no name is given, as long as it is ingested. It is resolved once per
+    # request, so the ETag function and the view share it
+    if not hasattr(request, "api_model"):
+        if model_name is None:
+            request.api_model = queries.get_model()
+        else:
+            request.api_model = models.LdaModel.objects.filter(name=model_name, is_ingested=True).first()
+    return request.api_model
+
+
+def get_api_comparison(request, comparison_name):
+    # The named comparison along with its models, resolved once per request like get_api_model
+    if not hasattr(request, "api_comparison"):
+        request.api_comparison = models.Comparison.objects.filter(name=comparison_name).select_related(
+            "lda_model_0", "lda_model_1").first()
+    return request.api_comparison
+
+
+def model_etag(request, model_name=None, **kwargs):
+    # Every representation of a model changes along with its data version, so the version identifies it
+    lda_model = get_api_model(request, model_name or request.GET.get("model"))
+    if lda_model is None:
+        return None
+    return '"v{}-model-{}-{}"'.format(API_VERSION, lda_model.pk, lda_model.data_version)
+
+
+def comparison_etag(request, comparison_name, **kwargs):
+    comparison = get_api_comparison(request, comparison_name)
+    if comparison is None:
+        return None
+    return '"v{}-comparison-{}-{}"'.format(API_VERSION, comparison.pk, comparison.data_version)
+
+
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=model_etag)
+def api_model_topics(request, model_name):
+    # The topics of a model a page at a time, each page continuing from the cursor returned by the previous one
+    lda_model = get_api_model(request, model_name)
+    if lda_model is None:
+        raise Http404
+    try:
+        after = int_parameter(request, "cursor", -1, minimum=-1)
+        limit = int_parameter(request, "limit", settings.API_PAGE_SIZE, minimum=1, maximum=settings.API_MAX_PAGE_SIZE)
+        top_n = int_parameter(request, "top", 0, maximum=settings.TOP_N_TOPIC_TERMS) or None
+    except ValueError:
+        return api_error("cursor, limit and top must be integers within range")
+    topics, next_cursor = queries.get_topics_page(lda_model, after=after, limit=limit, top_n=top_n)
+    return api_response({"model": lda_model.name, "topics": topics, "next_cursor": next_cursor})
+
+
+def pack_topics_columns(page, header):
+    # Binary topic columns: the bytes "TTC1", the length of a UTF-8 JSON header holding the topics, keyphrases, term
+    # strings and whatever else is given in header, the header itself padded with spaces to a multiple of 4 bytes, then
+    # the int32 term offsets of the topics, the uint32 term ids and the float32 term values, little-endian
+    import numpy as np
+
+    header = orjson.dumps(dict(header, topics=page["topics"].tolist(), keyphrases=page["keyphrases"],
+                               terms=page["terms"]))
+    header += b" " * (-len(header) % 4)
+    return b"".join((b"TTC1", np.uint32(len(header)).astype("<u4").tobytes(), header,
+                     page["offsets"].astype("<i4").tobytes(), page["term_ids"].astype("<u4").tobytes(),
+                     page["values"].astype("<f4").tobytes()))
+
+
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=model_etag)
+def api_model_topics_columns(request, model_name):
+    # The topics of a model a page at a time as columns, which avoid repeating keys and term strings for every row, in
+    # JSON or, with format=binary, packed as typed arrays
+    lda_model = get_api_model(request, model_name)
+    if lda_model is None:
+        raise Http404
+    try:
+        after = int_parameter(request, "cursor", -1, minimum=-1)
+        limit = int_parameter(request, "limit", settings.API_PAGE_SIZE, minimum=1, maximum=settings.API_MAX_PAGE_SIZE)
+        top_n = int_parameter(request, "top", settings.TOP_N_TOPIC_TERMS, minimum=1,
+                              maximum=settings.TOP_N_TOPIC_TERMS)
+    except ValueError:
+        return api_error("cursor, limit and top must be integers within range")
+    page, next_cursor = queries.get_topics_columns_page(queries.get_cached_topics_columns(lda_model), after=after,
+                                                        limit=limit, top_n=top_n)
+    if request.GET.get("format") == "binary":
+        with instrumentation.span("serialize"):
+            content = pack_topics_columns(page, {"model": lda_model.name, "next_cursor": next_cursor})
+        return HttpResponse(content, content_type="application/octet-stream")
+    return api_response(dict(page, model=lda_model.name, next_cursor=next_cursor), option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=model_etag)
+def api_topic_terms(request, topic_index):
+    # The terms of a topic of the main model, or of the model given, best first
+    lda_model = get_api_model(request, request.GET.get("model"))
+    if lda_model is None:
+        raise Http404
+    try:
+        top_n = int_parameter(request, "top", settings.TOP_N_TOPIC_TERMS, minimum=1,
+                              maximum=settings.TOP_N_TOPIC_TERMS)
+    except ValueError:
+        return api_error("top must be a positive integer up to {}".format(settings.TOP_N_TOPIC_TERMS))
+    terms = queries.get_topics_terms_representation(lda_model, topic_index, top_n=top_n)[topic_index]
+    if not terms:
+        raise Http404
+    return api_response({"model": lda_model.name, "topic": topic_index,
+                         "terms": [{"term": term["term"], "value": float(term["value"])} for term in terms]})
+
+
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=comparison_etag)
+def api_comparison_edges(request, comparison_name):
+    # The topic comparisons satisfying the threshold, paginated by topic of the second model
+    comparison = get_api_comparison(request, comparison_name)
+    if comparison is None:
+        raise Http404
+    try:
+        threshold = float(request.GET["threshold"]) if "threshold" in request.GET else None
+        after = int_parameter(request, "cursor", -1, minimum=-1)
+        limit = int_parameter(request, "limit", settings.API_PAGE_SIZE, minimum=1, maximum=settings.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("threshold must be a number, cursor and limit integers within range")
+    edges, next_cursor = queries.get_comparison_edges_page(comparison, threshold=threshold, after=after, limit=limit)
+    return api_response({
+        "comparison": comparison.name,
+        "is_score": comparison.type_of_comparison == 0,
+        "lda_model_0": comparison.lda_model_0.name,
+        "lda_model_1": comparison.lda_model_1.name,
+        "edges": edges,
+        "next_cursor": next_cursor
+    })
+
+
+@require_GET
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=model_etag)
+def api_similar_topics(request, model_name, topic_index):
+    # The topics of a model most similar to one of them, by the cosine similarity of their term distributions
+    from . import similarity
+
+    lda_model = get_api_model(request, model_name)
+    if lda_model is None:
+        raise Http404
+    try:
+        limit = int_parameter(request, "limit", settings.SIMILARITY_TOP_K, minimum=1,
+                              maximum=settings.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("limit must be an integer within range")
+    similar = similarity.similar_topics(lda_model, topic_index, k=limit)
+    if similar is None:
+        raise Http404
+    return api_response({"model": lda_model.name, "topic": topic_index,
+                         "similar": [{"topic": index, "similarity": value} for index, value in similar]})
+
+
+@require_GET
+def api_similar_articles(request, model_name, identifier):
+    # The articles most similar to one of them, by the cosine similarity of the topics the model assigned them
+    from . import similarity
+
+    lda_model = get_api_model(request, model_name)
+    article = models.Article.objects.filter(identifier=identifier).values_list("pk", flat=True).first()
+    if lda_model is None or article is None:
+        raise Http404
+    try:
+        limit = int_parameter(request, "limit", settings.SIMILARITY_TOP_K, minimum=1,
+                              maximum=settings.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("limit must be an integer within range")
+    similar = similarity.similar_articles(lda_model, article, k=limit)
+    if similar is None:
+        raise Http404
+    found = models.Article.objects.in_bulk([article_pk for article_pk, _ in similar])
+    return api_response({"model": lda_model.name, "article": identifier, "similar": [
+        {"identifier": found[article_pk].identifier, "title": found[article_pk].title, "similarity": value}
+        for article_pk, value in similar if article_pk in found]})
+
+
+@require_GET
+def api_topic_prevalence(request, model_name):
+    # The yearly prevalence series of every topic of a model, over the articles it has scored
+    lda_model = get_api_model(request, model_name)
+    if lda_model is None:
+        raise Http404
+    return api_response(dict(prevalence.get_prevalence_series(lda_model), model=lda_model.name))
+
+
+@require_GET
+def api_search_articles(request, model_name):
+    # Articles matching the q query, optionally only those assigned one of the comma separated topic indexes of the
+    # model with a weight above weight, and only those of the named corpus
+    lda_model = get_api_model(request, model_name)
+    if lda_model is None:
+        raise Http404
+    text = request.GET.get("q", "").strip()
+    if not text:
+        return api_error("q must be given")
+    try:
+        topic_indexes = [int(index) for index in request.GET["topics"].split(",")] if "topics" in request.GET else None
+        min_weight = float(request.GET["weight"]) if "weight" in request.GET else None
+        limit = int_parameter(request, "limit", settings.API_PAGE_SIZE, minimum=1, maximum=settings.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("topics must be comma separated integers, weight a number and limit an integer within range")
+    corpus = None
+    if "corpus" in request.GET:
+        corpus = models.Corpus.objects.filter(name=request.GET["corpus"]).first()
+        if corpus is None:
+            raise Http404
+    topics = None
+    if topic_indexes is not None:
+        topics = list(models.Topic.objects.filter(parent_model=lda_model, index__in=topic_indexes)
+                      .values_list("pk", flat=True))
+    found = articles.search_articles(text, topics=topics, min_weight=min_weight, corpus=corpus, limit=limit)
+    for article in found:
+        if "topic_weight" in article:
+            article["topic_weight"] = float(article["topic_weight"])
+    return api_response({"model": lda_model.name, "articles": found})
+
+
 # def topic_evolution(request):
 #     navbar_json = generate_navbar(config.NAV_BAR_ADDRESSES, {"m_topic_evo"})
 #     template_context = dict()
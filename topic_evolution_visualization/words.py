@@ -0,0 +1,103 @@
+import logging
+import time
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from . import queries
+from .bulk import copy_into
+from .models import LdaModel, Term, TopicTermRepresentation, Word
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = "word_import"
+RANKED_TABLE = "word_import_ranked"
+
+
+def read_word_map(lines):
+    # A nonstemmed map holds a line per original word: the stemmed term, the word and optionally its frequency, tab
+    # separated. The words of a term are ranked by descending frequency, or by their order in the file
+    for position, line in enumerate(lines):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        fields = line.rstrip("\r\n").split("\t")
+        if len(fields) < 2 or not fields[0] or not fields[1]:
+            continue
+        frequency = int(fields[2]) if len(fields) > 2 and fields[2] else None
+        yield fields[0], fields[1], frequency, position
+
+
+def import_words(lines):
+    # Replaces every Word with the ones of a nonstemmed map. The file is streamed into a staging table, ranked there and
+    # merged into the Word table in a single transaction, so readers see either the previous words or the new ones.
+    # The rank 1 word of every term and the displayed terms of every model are refreshed in the same transaction
+    started = time.perf_counter()
+    words_table, terms_table = Word._meta.db_table, Term._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS "{}", "{}"'.format(STAGING_TABLE, RANKED_TABLE))
+        cursor.execute('CREATE TEMPORARY TABLE "{}" (stemmed varchar(200), string varchar(220), frequency bigint, '
+                       'position bigint)'.format(STAGING_TABLE))
+    staged = copy_into(STAGING_TABLE, ("stemmed", "string", "frequency", "position"), read_word_map(lines))
+
+    with connection.cursor() as cursor:
+        # A word appearing more than once keeps its first occurrence
+        cursor.execute(
+            'CREATE TEMPORARY TABLE "{ranked}" AS '
+            'SELECT string, stemmed, row_number() OVER (PARTITION BY stemmed ORDER BY frequency DESC NULLS LAST, '
+            'position) AS rank '
+            'FROM (SELECT DISTINCT ON (string) * FROM "{staging}" ORDER BY string, position) AS words'.format(
+                ranked=RANKED_TABLE, staging=STAGING_TABLE))
+
+        with transaction.atomic():
+            cursor.execute('INSERT INTO "{terms}" (string) SELECT DISTINCT stemmed FROM "{ranked}" '
+                           'ON CONFLICT (string) DO NOTHING'.format(terms=terms_table, ranked=RANKED_TABLE))
+            cursor.execute('DELETE FROM "{words}" WHERE NOT EXISTS (SELECT 1 FROM "{ranked}" AS ranked '
+                           'WHERE ranked.string = "{words}".string)'.format(words=words_table, ranked=RANKED_TABLE))
+            deleted = cursor.rowcount
+            cursor.execute(
+                'UPDATE "{words}" SET rank = ranked.rank, stemmed_id = terms.id '
+                'FROM "{ranked}" AS ranked JOIN "{terms}" AS terms ON terms.string = ranked.stemmed '
+                'WHERE ranked.string = "{words}".string '
+                'AND ("{words}".rank, "{words}".stemmed_id) IS DISTINCT FROM (ranked.rank, terms.id)'.format(
+                    words=words_table, ranked=RANKED_TABLE, terms=terms_table))
+            updated = cursor.rowcount
+            cursor.execute(
+                'INSERT INTO "{words}" (string, rank, stemmed_id) '
+                'SELECT ranked.string, ranked.rank, terms.id '
+                'FROM "{ranked}" AS ranked JOIN "{terms}" AS terms ON terms.string = ranked.stemmed '
+                'ON CONFLICT (string) DO NOTHING'.format(words=words_table, ranked=RANKED_TABLE, terms=terms_table))
+            inserted = cursor.rowcount
+            refresh_display_words()
+
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS "{}", "{}"'.format(STAGING_TABLE, RANKED_TABLE))
+    elapsed = time.perf_counter() - started
+    logger.info("Imported %d words in %.2fs: %d inserted, %d updated, %d deleted", staged, elapsed, inserted, updated,
+                deleted)
+    return {"words": staged, "inserted": inserted, "updated": updated, "deleted": deleted, "seconds": elapsed}
+
+
+def refresh_display_words():
+    # Sets the rank 1 word of every term whose one changed, then what every model displays for these terms. Only rows
+    # that actually change are written
+    words_table, terms_table = Word._meta.db_table, Term._meta.db_table
+    representations_table = TopicTermRepresentation._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE "{terms}" SET display_word = display_words.string '
+            'FROM (SELECT terms.id, words.string FROM "{terms}" AS terms '
+            'LEFT JOIN LATERAL (SELECT string FROM "{words}" WHERE stemmed_id = terms.id AND rank = 1 LIMIT 1) '
+            'AS words ON TRUE) AS display_words '
+            'WHERE display_words.id = "{terms}".id '
+            'AND "{terms}".display_word IS DISTINCT FROM display_words.string'.format(terms=terms_table,
+                                                                                      words=words_table))
+        cursor.execute(
+            'UPDATE "{representations}" SET display_term = COALESCE(terms.display_word, terms.string) '
+            'FROM "{terms}" AS terms WHERE terms.id = "{representations}".term_id '
+            'AND "{representations}".display_term <> COALESCE(terms.display_word, terms.string)'.format(
+                representations=representations_table, terms=terms_table))
+        changed = cursor.rowcount
+    if changed:
+        LdaModel.objects.update(data_version=F("data_version") + 1)
+        queries.forget_model()
+    return changed